@@ -0,0 +1,275 @@
+"""Benchmark of the per-step host overhead of ``GPUMonitoringCallback`` and ``SteadyStateDetection``.
+
+The callbacks run against a fake trainer and strategy which simulate any world size in a single process: the gather
+returns the values of the current process for all ranks without any communication, so only the cost of the callbacks
+themselves is measured. Reported are the median microseconds per call of every hook, the number of tensor
+allocations per call of every hook and per step (from the memory events of the autograd profiler) and the number of
+logged keys.
+
+    PYTHONPATH=. python benchmarks/callback_overhead.py --world-sizes 1 64 4096 --save-baseline baseline.json
+    PYTHONPATH=. python benchmarks/callback_overhead.py --world-sizes 1 64 4096 --baseline baseline.json
+    PYTHONPATH=. python benchmarks/callback_overhead.py --world-sizes 1 4096 --aggregate-ranks --max-scaling-ratio 3
+
+With ``--baseline``, the script exits with status 1 if any hook got slower by more than ``--max-regression`` (relative)
+or allocates more tensors per step or logs more keys than in the baseline. With ``--max-scaling-ratio`` it exits with
+status 1 if any hook takes more than that many times as long at the largest world size as at the smallest or allocates
+more tensors per call, or if more keys are logged. Run it with ``--aggregate-ranks``, as logging one key per rank
+necessarily scales with the world size. ``tests/test_callback_overhead.py`` checks the allocation and key counts, which
+do not depend on the machine.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from lit_llms.callbacks import GPUMonitoringCallback, SteadyStateDetection
+from lit_llms.callbacks.sensor_backends import FakeSensorBackend
+from lit_llms.callbacks.step_timer import PerfCounterTimer
+
+# results by world size: microseconds per call by hook, tensor allocations per call by hook and per step and the
+# number of logged keys
+Results = Dict[int, Dict[str, float]]
+
+ALLOCATIONS = "allocations_per_step"
+ALLOCATIONS_PER_CALL = "allocations_per_call"
+LOGGED_KEYS = "logged_keys"
+
+
+def _is_count(name: str) -> bool:
+    return name in (ALLOCATIONS, LOGGED_KEYS) or name.endswith(ALLOCATIONS_PER_CALL)
+
+
+class FakeStrategy:
+    """Strategy of a single process simulating ``world_size`` ranks reporting the same values."""
+
+    def __init__(self, world_size: int) -> None:
+        self.world_size = world_size
+        self.root_device = torch.device("cpu")
+        self.model = None
+
+    def all_gather(self, tensor: torch.Tensor) -> torch.Tensor:
+        return tensor.unsqueeze(0).repeat(self.world_size, *([1] * tensor.dim()))
+
+    def broadcast(self, obj: Any, src: int = 0) -> Any:
+        return obj
+
+    def reduce_boolean_decision(self, decision: bool, all: bool = True) -> bool:
+        return decision
+
+    def reduce(self, tensor: torch.Tensor, reduce_op: str = "mean") -> torch.Tensor:
+        return tensor
+
+    def barrier(self, name: Any = None) -> None:
+        pass
+
+
+def fake_trainer(world_size: int, num_nodes: Optional[int] = None) -> Tuple[Any, Any]:
+    """Trainer and module which store all logged metrics in ``trainer.callback_metrics``.
+
+    Without ``num_nodes`` there are 8 ranks per node.
+    """
+    trainer = SimpleNamespace(
+        world_size=world_size,
+        num_nodes=max(world_size // 8, 1) if num_nodes is None else num_nodes,
+        global_rank=0,
+        is_global_zero=True,
+        global_step=0,
+        callback_metrics={},
+        strategy=FakeStrategy(world_size),
+        loggers=[],
+        state=SimpleNamespace(fn="fit"),
+        sanity_checking=False,
+        should_stop=False,
+    )
+
+    def log_dict(metrics: Dict[str, Any], **kwargs: Any) -> None:
+        trainer.callback_metrics.update(metrics)
+
+    def log(name: str, value: Any, **kwargs: Any) -> None:
+        trainer.callback_metrics[name] = value
+
+    return trainer, SimpleNamespace(log_dict=log_dict, log=log)
+
+
+def _step_hooks(batch_idx: int) -> List[Tuple[str, Tuple]]:
+    """The hooks called in every training step and their arguments after the trainer and module."""
+    return [
+        ("on_train_batch_start", (None, batch_idx)),
+        ("on_before_backward", (None,)),
+        ("on_after_backward", ()),
+        ("on_before_optimizer_step", (None,)),
+        ("on_before_zero_grad", (None,)),
+        ("on_train_batch_end", (None, torch.zeros(8, 1), batch_idx)),
+    ]
+
+
+def _run_steps(
+    callbacks: Dict[str, Any], trainer: Any, module: Any, steps: range, timings: Dict[str, List[float]]
+) -> None:
+    """Calls the hooks of all steps and records the time of every call in ``timings``."""
+    for batch_idx in steps:
+        trainer.global_step = batch_idx
+        for hook_name, args in _step_hooks(batch_idx):
+            for callback_name, callback in callbacks.items():
+                hook = getattr(callback, hook_name)
+                start = time.perf_counter()
+                hook(trainer, module, *args)
+                timings[f"{callback_name}.{hook_name}"].append(time.perf_counter() - start)
+
+
+def _count_allocations(
+    callbacks: Dict[str, Any], trainer: Any, module: Any, steps: range, allocations: Dict[str, List[float]]
+) -> None:
+    """Calls the hooks of all steps and records the number of tensor allocations of every call in ``allocations``."""
+    for batch_idx in steps:
+        trainer.global_step = batch_idx
+        for hook_name, args in _step_hooks(batch_idx):
+            for callback_name, callback in callbacks.items():
+                hook = getattr(callback, hook_name)
+                with torch.autograd.profiler.profile(profile_memory=True) as profiler:
+                    hook(trainer, module, *args)
+                num_allocations = sum(1 for event in profiler.function_events if event.cpu_memory_usage > 0)
+                allocations[f"{callback_name}.{hook_name}"].append(num_allocations)
+
+
+def benchmark(
+    world_size: int,
+    num_steps: int,
+    warmup_steps: int = 110,
+    aggregate_ranks: bool = False,
+    num_nodes: Optional[int] = None,
+) -> Dict[str, float]:
+    """Median microseconds per call of every hook, tensor allocations per call of every hook and per step and the
+    number of logged keys at the given world size."""
+    trainer, module = fake_trainer(world_size, num_nodes)
+    callbacks = {
+        "GPUMonitoringCallback": GPUMonitoringCallback(
+            sensor_backend=FakeSensorBackend(utilization=50.0, memory=1024**3),
+            step_timer=PerfCounterTimer(),
+            aggregate_ranks=aggregate_ranks,
+        ),
+        # never reaches steady state with rtol=0, so that the metrics are evaluated in every step
+        "SteadyStateDetection": SteadyStateDetection(
+            batch_size=8, num_params=10**6, average=10, rtol=0.0, stop_on_steady_state=False
+        ),
+    }
+
+    # fill the moving average windows first
+    warmup_timings: Dict[str, List[float]] = defaultdict(list)
+    _run_steps(callbacks, trainer, module, range(warmup_steps), warmup_timings)
+
+    timings: Dict[str, List[float]] = defaultdict(list)
+    _run_steps(callbacks, trainer, module, range(warmup_steps, warmup_steps + num_steps), timings)
+    results = {name: 1e6 * statistics.median(values) for name, values in timings.items()}
+
+    num_profiled_steps = min(num_steps, 20)
+    allocations: Dict[str, List[float]] = defaultdict(list)
+    start = warmup_steps + num_steps
+    _count_allocations(callbacks, trainer, module, range(start, start + num_profiled_steps), allocations)
+    for name, values in allocations.items():
+        results[f"{name}.{ALLOCATIONS_PER_CALL}"] = statistics.fmean(values)
+    results[ALLOCATIONS] = sum(sum(values) for values in allocations.values()) / num_profiled_steps
+    results[LOGGED_KEYS] = len(trainer.callback_metrics)
+    return results
+
+
+def regressions(results: Results, baseline: Results, max_regression: float) -> List[str]:
+    """Descriptions of all hooks which got slower than allowed or allocate more and of more logged keys than in the
+    baseline."""
+    messages = []
+    for world_size, values in results.items():
+        for name, value in values.items():
+            reference = baseline.get(world_size, {}).get(name)
+            if reference is None:
+                continue
+            if _is_count(name):
+                if value > reference:
+                    messages.append(f"world size {world_size}: {value:.1f} {name} (baseline {reference:.1f})")
+            elif value > reference * (1 + max_regression):
+                messages.append(f"world size {world_size}: {name} took {value:.1f} us (baseline {reference:.1f} us)")
+    return messages
+
+
+def scaling_regressions(results: Results, max_ratio: float, min_time: float = 10.0) -> List[str]:
+    """Descriptions of all hooks which take more than ``max_ratio`` times as long at the largest world size as at the
+    smallest or allocate more tensors per call, and of more logged keys.
+
+    Times below ``min_time`` microseconds are raised to it, so that the noise of hooks doing next to nothing is ignored.
+    """
+    smallest, largest = min(results), max(results)
+    messages = []
+    for name, value in results[largest].items():
+        reference = results[smallest].get(name)
+        if reference is None or name == ALLOCATIONS:
+            continue
+        if _is_count(name):
+            if value > reference:
+                messages.append(
+                    f"{name}: {value:.1f} at world size {largest}, {reference:.1f} at world size {smallest}"
+                )
+        elif max(value, min_time) > max_ratio * max(reference, min_time):
+            messages.append(
+                f"{name}: {value:.1f} us at world size {largest}, {reference:.1f} us at world size {smallest}"
+            )
+    return messages
+
+
+def _print_results(results: Results, world_sizes: Sequence[int]) -> None:
+    names = sorted({name for values in results.values() for name in values if not _is_count(name)})
+    count_names = sorted({name for values in results.values() for name in values if _is_count(name)})
+    width = max(len(name) for name in names + count_names)
+    print(f"{'[us per call]':<{width}} | " + " | ".join(f"{f'ws={ws}':>10}" for ws in world_sizes))
+    for name in names + count_names:
+        print(f"{name:<{width}} | " + " | ".join(f"{results[ws][name]:>10.1f}" for ws in world_sizes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--world-sizes", type=int, nargs="+", default=[1, 8, 64, 512, 4096])
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--save-baseline", type=str, default=None)
+    parser.add_argument("--baseline", type=str, default=None)
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    parser.add_argument("--max-scaling-ratio", type=float, default=None)
+    parser.add_argument("--aggregate-ranks", action="store_true")
+    parser.add_argument("--num-nodes", type=int, default=None)
+    args = parser.parse_args()
+
+    results = {
+        world_size: benchmark(
+            world_size, args.steps, aggregate_ranks=args.aggregate_ranks, num_nodes=args.num_nodes
+        )
+        for world_size in args.world_sizes
+    }
+    _print_results(results, args.world_sizes)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {int(world_size): values for world_size, values in json.load(f).items()}
+        messages = regressions(results, baseline, args.max_regression)
+        if messages:
+            print("Overhead regressions:", *messages, sep="\n  ")
+            sys.exit(1)
+        print(f"No regressions above {args.max_regression:.0%} compared to {args.baseline}")
+
+    if args.max_scaling_ratio is not None:
+        messages = scaling_regressions(results, args.max_scaling_ratio)
+        if messages:
+            print("Overhead growing with the world size:", *messages, sep="\n  ")
+            sys.exit(1)
+        print(f"No hook slower by more than {args.max_scaling_ratio}x at world size {max(results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark of the per-step collectives of ``GPUMonitoringCallback`` on the gloo backend.
+
+Compares the previous pattern (reduce of the step time, separate ``all_gather`` of memory and utilization and a
+``barrier``) with the single fused ``all_gather`` and the full ``on_train_batch_start`` hook.
+
+    PYTHONPATH=. python benchmarks/monitoring_collectives.py --world-sizes 2 4 8 --steps 200
+"""
+
+import argparse
+import os
+import time
+from typing import Callable, Dict, List
+from unittest import mock
+
+import torch
+import torch.distributed as dist
+
+from lit_llms.callbacks import GPUMonitoringCallback
+
+
+def _all_gather(tensor: torch.Tensor) -> torch.Tensor:
+    gathered = [torch.empty_like(tensor) for _ in range(dist.get_world_size())]
+    dist.all_gather(gathered, tensor)
+    return torch.stack(gathered)
+
+
+def _legacy_step() -> None:
+    time_delta = torch.tensor(0.1)
+    dist.all_reduce(time_delta)
+    _all_gather(torch.tensor(1.0))
+    _all_gather(torch.tensor(50.0))
+    dist.barrier()
+
+
+def _fused_step() -> None:
+    _all_gather(torch.tensor([0.1, 1.0, 50.0]))
+
+
+def _callback_step_fn() -> Callable[[], None]:
+    trainer = mock.MagicMock()
+    trainer.world_size = dist.get_world_size()
+    trainer.strategy.root_device = torch.device("cpu")
+    trainer.strategy.all_gather = _all_gather
+    callback = GPUMonitoringCallback()
+    module = mock.MagicMock()
+    batch_idx = 0
+
+    def step() -> None:
+        nonlocal batch_idx
+        callback.on_train_batch_start(trainer, module, None, batch_idx)
+        callback.on_train_batch_end(trainer, module, None, None, batch_idx)
+        batch_idx += 1
+
+    return step
+
+
+def _time(step: Callable[[], None], num_steps: int) -> float:
+    for _ in range(10):
+        step()
+    dist.barrier()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        step()
+    return (time.perf_counter() - start) / num_steps
+
+
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def _worker(rank: int, world_size: int, num_steps: int, port: int, results: Dict[int, List[float]]) -> None:
+    os.environ["MASTER_ADDR"] = "localhost"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+
+    timings = [_time(fn, num_steps) for fn in (_legacy_step, _fused_step, _callback_step_fn())]
+    if rank == 0:
+        results[world_size] = timings
+    dist.destroy_process_group()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--world-sizes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--port", type=int, default=29517)
+    args = parser.parse_args()
+
+    manager = torch.multiprocessing.Manager()
+    results = manager.dict()
+    for i, world_size in enumerate(args.world_sizes):
+        torch.multiprocessing.spawn(
+            _worker, args=(world_size, args.steps, args.port + i, results), nprocs=world_size, join=True
+        )
+
+    print(f"{'ranks':>5} | {'legacy [us]':>12} | {'fused [us]':>12} | {'speedup':>7} | {'callback hook [us]':>18}")
+    for world_size in args.world_sizes:
+        legacy, fused, hook = results[world_size]
+        speedup = legacy / fused
+        print(
+            f"{world_size:>5} | {legacy * 1e6:>12.1f} | {fused * 1e6:>12.1f} | {speedup:>6.2f}x | {hook * 1e6:>18.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,13 @@
+from lit_llms.callbacks.communication import CommunicationMonitor
+from lit_llms.callbacks.memory_stats import MemoryStatsCallback
 from lit_llms.callbacks.monitoring import GPUMonitoringCallback
 from lit_llms.callbacks.steady_state_detection import SteadyStateDetection
+from lit_llms.callbacks.throughput import ThroughputCallback
 
-__all__ = ["GPUMonitoringCallback", "SteadyStateDetection"]
+__all__ = [
+    "CommunicationMonitor",
+    "GPUMonitoringCallback",
+    "MemoryStatsCallback",
+    "SteadyStateDetection",
+    "ThroughputCallback",
+]
@@ -0,0 +1,176 @@
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import lightning
+import torch
+from lightning.pytorch.utilities.rank_zero import rank_zero_warn
+
+# a DDP communication hook taking the hook state and a gradient bucket
+CommHook = Callable[[Any, Any], torch.futures.Future]
+
+
+def _union_length(intervals: List[Tuple[float, float]]) -> float:
+    """Total length covered by the intervals."""
+    length, covered_until = 0.0, float("-inf")
+    for start, end in sorted(intervals):
+        if end > covered_until:
+            length += end - max(start, covered_until)
+            covered_until = end
+    return length
+
+
+class CommunicationMonitor(lightning.pytorch.callbacks.Callback):
+    """Measures the gradient communication of DDP per rank by wrapping its communication hook.
+
+    Every gradient bucket is timed from the call of the hook until its future completes, by default using the
+    ``allreduce_hook`` of PyTorch, which matches DDP without a hook. Other hooks (e.g. for gradient compression) can be
+    wrapped by passing ``comm_hook`` and ``comm_hook_state``. The hook is registered on the DDP model in
+    ``on_fit_start``, so it cannot be combined with the ``ddp_comm_hook`` of the strategy.
+
+    Every ``every_n_steps`` steps, the following means over the steps with communication since the previous report are
+    gathered from all ranks and logged per rank (``<logname>/<stat>_rank<i>``):
+
+    - ``time``: the time any bucket was being communicated, in seconds
+    - ``bytes``: the size of all buckets
+    - ``bus_bandwidth``: the all-reduce bus bandwidth ``bytes / time * 2 (world_size - 1) / world_size`` in bytes per
+      second, comparable across world sizes and to the link bandwidth
+    - ``overlap``: the fraction of the communication time overlapping with the backward pass. The communication after
+      the last bucket was handed to the hook, i.e. after all gradients were computed, is exposed.
+
+    Buckets on the host (gloo) are timed by host timestamps. The futures of buckets on a GPU (NCCL) complete as soon as
+    the collective is enqueued, so they are timed by CUDA events instead: the start event is recorded on the current
+    stream when the hook is called and the end event in the completion callback, whose current stream waits for the
+    collective. The time the collective waited for the communication stream is included. The events are read one step
+    later, when the collectives have usually finished, so that the host never waits for the device.
+    """
+
+    def __init__(
+        self,
+        every_n_steps: int = 10,
+        comm_hook: Optional[CommHook] = None,
+        comm_hook_state: Any = None,
+        logname: str = "comm",
+    ):
+        super().__init__()
+        if every_n_steps < 1:
+            raise ValueError(f"every_n_steps must be at least 1, got {every_n_steps}")
+        self.every_n_steps = every_n_steps
+        self.comm_hook = comm_hook
+        self.comm_hook_state = comm_hook_state
+        self.logname = logname
+        # start, end and size of the buckets communicated in the current step, appended by the completion callbacks.
+        # The start and end are host timestamps or CUDA events
+        self._buckets: List[Tuple[Any, Any, int]] = []
+        # the buckets timed by CUDA events of the previous step with communication, read in the next one
+        self._pending: List[Tuple[Any, Any, int]] = []
+        # sums of the communication time, exposed time and bytes and the number of steps with communication
+        self._totals = [0.0, 0.0, 0.0, 0]
+        self._num_steps = 0
+
+    def attach(self, model: torch.nn.parallel.DistributedDataParallel) -> None:
+        """Registers the timing communication hook on a DDP model."""
+        if self.comm_hook is None:
+            from torch.distributed.algorithms.ddp_comm_hooks.default_hooks import allreduce_hook
+
+            self.comm_hook = allreduce_hook
+        model.register_comm_hook(self.comm_hook_state, self._timed_hook)
+
+    # DDP checks the annotations of the hook
+    def _timed_hook(self, state: Any, bucket: torch.distributed.GradBucket) -> torch.futures.Future[torch.Tensor]:
+        buffer = bucket.buffer()
+        num_bytes = buffer.numel() * buffer.element_size()
+        assert self.comm_hook is not None
+        if buffer.is_cuda:
+            start_event = torch.cuda.Event(enable_timing=True)
+            start_event.record()
+
+            def record_event(fut: torch.futures.Future[torch.Tensor]) -> torch.Tensor:
+                # the current stream of the callback waits for the collective
+                end_event = torch.cuda.Event(enable_timing=True)
+                end_event.record()
+                self._buckets.append((start_event, end_event, num_bytes))
+                return fut.value()
+
+            return self.comm_hook(state, bucket).then(record_event)
+
+        start = time.perf_counter()
+
+        def record(fut: torch.futures.Future[torch.Tensor]) -> torch.Tensor:
+            self._buckets.append((start, time.perf_counter(), num_bytes))
+            return fut.value()
+
+        return self.comm_hook(state, bucket).then(record)
+
+    @staticmethod
+    def _read_events(buckets: List[Tuple[Any, Any, int]]) -> List[Tuple[float, float, int]]:
+        """The start and end of buckets timed by CUDA events in seconds relative to the first start event."""
+        reference = buckets[0][0]
+        times = []
+        for start, end, num_bytes in buckets:
+            end.synchronize()
+            times.append((reference.elapsed_time(start) / 1000, reference.elapsed_time(end) / 1000, num_bytes))
+        return times
+
+    def on_fit_start(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        model = trainer.strategy.model
+        if not isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            rank_zero_warn("The CommunicationMonitor only measures the communication of DDP models.")
+            return
+        try:
+            self.attach(model)
+        except RuntimeError as e:
+            # a hook was registered by the strategy already
+            rank_zero_warn(f"The CommunicationMonitor could not register its communication hook: {e}")
+
+    @torch.no_grad()
+    def on_train_batch_end(
+        self,
+        trainer: lightning.pytorch.Trainer,
+        pl_module: lightning.pytorch.LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        # DDP waited for all buckets at the end of the backward pass
+        buckets, self._buckets = self._buckets, []
+        if buckets and isinstance(buckets[0][0], torch.cuda.Event):
+            buckets, self._pending = self._pending, buckets
+            buckets = self._read_events(buckets) if buckets else []
+        if buckets:
+            comm_time = _union_length([(start, end) for start, end, _ in buckets])
+            exposed_time = max(end for _, end, _ in buckets) - max(start for start, _, _ in buckets)
+            self._totals[0] += comm_time
+            self._totals[1] += min(max(exposed_time, 0.0), comm_time)
+            self._totals[2] += sum(num_bytes for _, _, num_bytes in buckets)
+            self._totals[3] += 1
+
+        self._num_steps += 1
+        if self._num_steps % self.every_n_steps:
+            return
+
+        comm_time, exposed_time, num_bytes, num_comm_steps = self._totals
+        self._totals = [0.0, 0.0, 0.0, 0]
+        steps = max(num_comm_steps, 1)
+        local_stats = torch.tensor(
+            [comm_time / steps, exposed_time / steps, num_bytes / steps],
+            dtype=torch.float64,
+            device=trainer.strategy.root_device,
+        )
+        # a single collective for the stats of all ranks
+        comm_times, exposed_times, bytes_per_step = trainer.strategy.all_gather(local_stats).reshape(-1, 3).t()
+
+        world_size = trainer.world_size
+        has_time = comm_times > 0
+        safe_times = torch.where(has_time, comm_times, torch.ones_like(comm_times))
+        bus_bandwidths = torch.where(
+            has_time, bytes_per_step / safe_times * 2 * (world_size - 1) / world_size, torch.zeros_like(comm_times)
+        )
+        overlaps = torch.where(has_time, 1 - exposed_times / safe_times, torch.zeros_like(comm_times))
+
+        metrics = {}
+        for i in range(world_size):
+            metrics[f"{self.logname}/time_rank{i}"] = comm_times[i]
+            metrics[f"{self.logname}/bytes_rank{i}"] = bytes_per_step[i]
+            metrics[f"{self.logname}/bus_bandwidth_rank{i}"] = bus_bandwidths[i]
+            metrics[f"{self.logname}/overlap_rank{i}"] = overlaps[i]
+        pl_module.log_dict(metrics, sync_dist=False, on_step=True, on_epoch=False, rank_zero_only=True)
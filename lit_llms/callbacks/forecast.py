@@ -0,0 +1,114 @@
+import json
+import math
+import os
+import statistics
+from collections import deque
+from typing import Any, Deque, Dict, Mapping, Optional, Sequence
+
+import fsspec
+import torch
+
+from lit_llms.callbacks.throughput import lookup_device
+
+# rough on-demand cloud prices in USD per GPU hour, matched against the lowercase CUDA device name. Pass the prices of
+# your provider to get meaningful costs.
+GPU_HOUR_PRICES: Dict[str, float] = {
+    "h100": 3.0,
+    "a100": 1.8,
+    "l40s": 1.0,
+    "a10": 0.75,
+    "l4": 0.8,
+    "v100": 0.9,
+    "t4": 0.35,
+}
+
+
+def price_for_device(device: torch.device, table: Mapping[str, float] = GPU_HOUR_PRICES) -> Optional[float]:
+    """Price per GPU hour of the longest entry of ``table`` contained in the device name, ``None`` if there is none."""
+    return lookup_device(device, table)
+
+
+class TimeToTrainForecaster:
+    """Forecast of the remaining wall clock time, GPU hours and cost of training from the observed step times.
+
+    The last ``max_samples`` step times are kept. The remaining time of ``remaining_steps`` steps is modelled as normal
+    with the mean ``remaining_steps * (mean + overhead_per_step)`` and a variance combining the standard error of the
+    mean step time, estimated from the means of ``num_batches`` consecutive batches of samples so that correlated step
+    times do not understate it, and the variance of the individual steps. The ``quantiles`` of this distribution are
+    reported as ``hours_p<q>``, ``gpu_hours_p<q>`` and, with a price per GPU hour, ``cost_p<q>``.
+    """
+
+    def __init__(
+        self, max_samples: int = 1000, num_batches: int = 10, quantiles: Sequence[float] = (0.1, 0.5, 0.9)
+    ) -> None:
+        if max_samples < 1:
+            raise ValueError(f"max_samples must be at least 1, got {max_samples}")
+        if not all(0 < q < 1 for q in quantiles):
+            raise ValueError(f"quantiles must be in (0, 1), got {quantiles}")
+        self.max_samples = max_samples
+        self.num_batches = num_batches
+        self.quantiles = tuple(quantiles)
+        self.step_times: Deque[float] = deque(maxlen=max_samples)
+
+    def update(self, step_time: float) -> None:
+        self.step_times.append(float(step_time))
+
+    def truncate(self, num_samples: int) -> None:
+        """Keeps only the last ``num_samples`` step times, e.g. to drop the ones before steady state."""
+        while len(self.step_times) > num_samples:
+            self.step_times.popleft()
+
+    def standard_error(self) -> float:
+        """Standard error of the mean step time from the means of consecutive batches of samples."""
+        samples = list(self.step_times)
+        batch_size = max(len(samples) // max(self.num_batches, 1), 1)
+        num_batches = len(samples) // batch_size
+        if num_batches < 2:
+            return 0.0
+        # the oldest samples which do not fill a batch are left out
+        start = len(samples) - num_batches * batch_size
+        batch_means = torch.tensor(samples[start:], dtype=torch.float64).view(num_batches, batch_size).mean(1)
+        return float(batch_means.std()) / math.sqrt(num_batches)
+
+    def forecast(
+        self,
+        remaining_steps: float,
+        num_gpus: int,
+        overhead_per_step: float = 0.0,
+        price_per_gpu_hour: Optional[float] = None,
+    ) -> Dict[str, float]:
+        if not self.step_times:
+            raise ValueError("Cannot forecast the training time without any step times!")
+        remaining_steps = max(remaining_steps, 0.0)
+        mean = statistics.fmean(self.step_times)
+        std = statistics.stdev(self.step_times) if len(self.step_times) > 1 else 0.0
+        total_mean = remaining_steps * (mean + overhead_per_step)
+        total_std = math.sqrt((remaining_steps * self.standard_error()) ** 2 + remaining_steps * std**2)
+
+        forecast = {
+            "remaining_steps": remaining_steps,
+            "seconds_per_step": mean,
+            "overhead_seconds_per_step": overhead_per_step,
+        }
+        normal = statistics.NormalDist()
+        for q in self.quantiles:
+            postfix = f"p{round(q * 100)}"
+            hours = max(total_mean + normal.inv_cdf(q) * total_std, 0.0) / 3600
+            forecast[f"hours_{postfix}"] = hours
+            forecast[f"gpu_hours_{postfix}"] = hours * num_gpus
+            if price_per_gpu_hour is not None:
+                forecast[f"cost_{postfix}"] = hours * num_gpus * price_per_gpu_hour
+        return forecast
+
+
+def write_report(path: str, forecast: Mapping[str, float], **info: Any) -> None:
+    """Writes the forecast together with further information as JSON."""
+    fs, _ = fsspec.core.url_to_fs(path)
+    dirname = os.path.dirname(path)
+    if dirname:
+        fs.makedirs(dirname, exist_ok=True)
+    # write to a temporary file first so that readers never see a partial report
+    tmp_path = f"{path}.tmp"
+    with fs.open(tmp_path, "w") as f:
+        json.dump({"forecast": dict(forecast), **info}, f, indent=2)
+    fs.mv(tmp_path, path)
@@ -0,0 +1,106 @@
+import math
+from typing import NamedTuple, Optional
+
+import torch
+
+
+class LossCurve(NamedTuple):
+    """Learning curve ``loss(step) = irreducible + scale * step ** -exponent``."""
+
+    irreducible: float
+    scale: float
+    exponent: float
+    # root mean squared error of the fit
+    rmse: float
+    num_samples: int
+
+    def loss_at(self, step: float) -> float:
+        return self.irreducible + self.scale * step**-self.exponent
+
+    def steps_to_target(self, target_loss: float) -> float:
+        """The step at which the curve reaches ``target_loss``, ``inf`` if the target is not above the irreducible
+        loss."""
+        if target_loss <= self.irreducible:
+            return math.inf
+        return (self.scale / (target_loss - self.irreducible)) ** (1 / self.exponent)
+
+
+class LossCurveFitter:
+    """Incremental least squares fit of a power law learning curve to the training loss.
+
+    For a fixed exponent the curve ``irreducible + scale * step ** -exponent`` is linear in its two other parameters,
+    so the fitter keeps the sums of the normal equations for each of ``num_exponents`` log-spaced exponents between
+    ``min_exponent`` and ``max_exponent``. ``update`` adds a loss in O(``num_exponents``) and the memory does not grow
+    with the number of steps. ``fit`` solves the normal equations of all exponents at once and returns the curve with
+    the smallest squared error among those decreasing with the steps.
+
+    Losses before ``min_step``, e.g. of the warmup, are ignored and ``fit`` returns ``None`` until ``min_samples``
+    losses have been added.
+    """
+
+    def __init__(
+        self,
+        min_exponent: float = 0.01,
+        max_exponent: float = 2.0,
+        num_exponents: int = 100,
+        min_samples: int = 50,
+        min_step: int = 1,
+    ) -> None:
+        if not 0 < min_exponent < max_exponent:
+            raise ValueError(f"Expected 0 < min_exponent < max_exponent, got {min_exponent} and {max_exponent}")
+        if num_exponents < 2:
+            raise ValueError(f"num_exponents must be at least 2, got {num_exponents}")
+        if min_samples < 3:
+            raise ValueError(f"min_samples must be at least 3, got {min_samples}")
+        self.exponents = torch.logspace(
+            math.log10(min_exponent), math.log10(max_exponent), num_exponents, dtype=torch.float64
+        )
+        self.min_samples = min_samples
+        self.min_step = max(min_step, 1)
+        self.reset()
+
+    def reset(self) -> None:
+        self.num_samples = 0
+        self._sum_y = 0.0
+        self._sum_y_squares = 0.0
+        # sums of x = step ** -exponent, of x ** 2 and of x * y per exponent
+        self._sum_x = torch.zeros_like(self.exponents)
+        self._sum_x_squares = torch.zeros_like(self.exponents)
+        self._sum_xy = torch.zeros_like(self.exponents)
+
+    def update(self, step: int, loss: float) -> None:
+        if step < self.min_step or not math.isfinite(loss):
+            return
+        x = torch.pow(float(step), -self.exponents)
+        self.num_samples += 1
+        self._sum_y += loss
+        self._sum_y_squares += loss * loss
+        self._sum_x += x
+        self._sum_x_squares += x * x
+        self._sum_xy.add_(x, alpha=loss)
+
+    def fit(self) -> Optional[LossCurve]:
+        if self.num_samples < self.min_samples:
+            return None
+        n = self.num_samples
+        det = n * self._sum_x_squares - self._sum_x**2
+        scale = (n * self._sum_xy - self._sum_x * self._sum_y) / det
+        irreducible = (self._sum_y - scale * self._sum_x) / n
+        squared_error = self._sum_y_squares - irreducible * self._sum_y - scale * self._sum_xy
+        # exponents for which all losses were at (numerically) the same x cannot be fit
+        valid = (det > 1e-12 * n * self._sum_x_squares) & (scale > 0)
+        if not bool(valid.any()):
+            return None
+        best = int(torch.where(valid, squared_error, torch.full_like(squared_error, math.inf)).argmin())
+        return LossCurve(
+            irreducible=float(irreducible[best]),
+            scale=float(scale[best]),
+            exponent=float(self.exponents[best]),
+            rmse=math.sqrt(max(float(squared_error[best]), 0.0) / n),
+            num_samples=n,
+        )
+
+    def steps_to_target(self, target_loss: float) -> Optional[float]:
+        """The step at which the fitted curve reaches ``target_loss``, ``None`` without a fit."""
+        curve = self.fit()
+        return None if curve is None else curve.steps_to_target(target_loss)
@@ -0,0 +1,90 @@
+from typing import Any, Callable, Mapping, Optional
+
+import lightning
+import torch
+from lightning.pytorch.utilities.rank_zero import rank_zero_warn
+
+# returns the statistics of the CUDA caching allocator in the format of :func:`torch.cuda.memory_stats`
+MemoryStatsProvider = Callable[[], Mapping[str, Any]]
+
+# logged name and key in the allocator statistics
+_MEMORY_STATS = (
+    ("allocated_bytes", "allocated_bytes.all.current"),
+    ("reserved_bytes", "reserved_bytes.all.current"),
+    ("active_bytes", "active_bytes.all.current"),
+    ("inactive_split_bytes", "inactive_split_bytes.all.current"),
+    ("num_alloc_retries", "num_alloc_retries"),
+    ("num_ooms", "num_ooms"),
+)
+
+
+def cuda_memory_stats_provider(device: Optional[torch.device] = None) -> MemoryStatsProvider:
+    """Provider reading the caching allocator statistics of a CUDA device."""
+    return lambda: torch.cuda.memory_stats(device)
+
+
+class MemoryStatsCallback(lightning.pytorch.callbacks.Callback):
+    """Logs the statistics of the CUDA caching allocator of every rank every ``every_n_steps`` training steps.
+
+    Logged per rank (``<logname>/<stat>_rank<i>``) are the allocated, reserved, active and inactive split bytes, the
+    fragmentation (the fraction of the reserved memory in inactive split blocks, which can only be reused by
+    allocations fitting into them) and the cumulative number of allocation retries (the allocator freed its cache
+    to satisfy an allocation) and out of memory errors.
+
+    Reading the statistics does not synchronize with the device, but gathering them from all ranks is a collective, so
+    the cadence trades the resolution against the overhead. ``stats_provider`` replaces
+    :func:`torch.cuda.memory_stats`, e.g. to test on CPU.
+    """
+
+    def __init__(
+        self,
+        every_n_steps: int = 50,
+        stats_provider: Optional[MemoryStatsProvider] = None,
+        logname: str = "memory",
+    ):
+        super().__init__()
+        if every_n_steps < 1:
+            raise ValueError(f"every_n_steps must be at least 1, got {every_n_steps}")
+        self.every_n_steps = every_n_steps
+        self.stats_provider = stats_provider
+        self.logname = logname
+        self._num_steps = 0
+
+    def on_train_start(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        if self.stats_provider is None:
+            device = trainer.strategy.root_device
+            if device.type == "cuda":
+                self.stats_provider = cuda_memory_stats_provider(device)
+            else:
+                rank_zero_warn(f"No CUDA allocator statistics available on {device}, the memory stats are not logged.")
+
+    @torch.no_grad()
+    def on_train_batch_end(
+        self,
+        trainer: lightning.pytorch.Trainer,
+        pl_module: lightning.pytorch.LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        self._num_steps += 1
+        if self.stats_provider is None or self._num_steps % self.every_n_steps:
+            return
+
+        stats = self.stats_provider()
+        values = [float(stats.get(key, 0)) for _, key in _MEMORY_STATS]
+        stats_total_rank = trainer.strategy.all_gather(
+            torch.tensor(values, dtype=torch.float64, device=trainer.strategy.root_device)
+        ).reshape(trainer.world_size, len(values))
+
+        names = [name for name, _ in _MEMORY_STATS]
+        reserved = stats_total_rank[:, names.index("reserved_bytes")]
+        inactive_split = stats_total_rank[:, names.index("inactive_split_bytes")]
+        fragmentation = torch.where(reserved > 0, inactive_split / reserved.clamp(min=1), torch.zeros_like(reserved))
+
+        metrics = {}
+        for i in range(trainer.world_size):
+            for s, name in enumerate(names):
+                metrics[f"{self.logname}/{name}_rank{i}"] = stats_total_rank[i, s]
+            metrics[f"{self.logname}/fragmentation_rank{i}"] = fragmentation[i]
+        pl_module.log_dict(metrics, sync_dist=False, on_step=True, on_epoch=False, rank_zero_only=True)
@@ -1,45 +1,311 @@
+import math
 import time
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import lightning
 import torch
+from lightning.pytorch.utilities.rank_zero import rank_zero_info, rank_zero_warn
 
-from lit_llms.moving_average import MovingAverage
+from lit_llms.callbacks.sensor_backends import CUDASensorBackend, SensorBackend
+from lit_llms.callbacks.step_timer import step_timer_for_device, StepTimer
+from lit_llms.callbacks.straggler_detection import robust_outliers, Straggler
+from lit_llms.callbacks.trace_writer import TraceWriter
+from lit_llms.callbacks.utilization_sampler import Sensor, UtilizationSampler
+from lit_llms.moving_average import MovingAverage, MultiWindowMovingAverage
+from lit_llms.streaming_quantile import StreamingQuantile
+
+# the single window averages stored in checkpoints of former versions, by the average they are converted into
+_FORMER_AVERAGES = {
+    "seconds_per_iter_averages": ("seconds_per_iter10", "seconds_per_iter100"),
+    "gpu_utilization_averages": ("gpu_utilizations10", "gpu_utilizations100"),
+}
 
 
 class GPUMonitoringCallback(lightning.pytorch.callbacks.Callback):
     """Monitoring the GPU utilization and memory usage per rank together with the processing time per batch to be
-    consumed by other callbacks."""
+    consumed by other callbacks.
+
+    The utilization and memory are read from a :class:`~lit_llms.callbacks.sensor_backends.SensorBackend`, by default
+    :class:`~lit_llms.callbacks.sensor_backends.CUDASensorBackend` of the device of the rank. Pass e.g. a
+    :class:`~lit_llms.callbacks.sensor_backends.HostSensorBackend` as ``sensor_backend`` to monitor the host instead.
+    The additional stats of the backend are recorded once per step and gathered, averaged and logged per rank like the
+    step timings.
+
+    By default the utilization is queried from several training hooks per step. If ``utilization_sampling_interval``
+    is set, a :class:`~lit_llms.callbacks.utilization_sampler.UtilizationSampler` polls it from a background thread
+    instead (using ``utilization_sensor`` if given and the backend otherwise) and the hooks only read the aggregated
+    samples once per step.
+
+    The metrics of all ranks are gathered and logged every ``log_every_n_steps`` steps. In between, every rank only
+    records its own per-step values, which are gathered together with a single collective. The moving averages and
+    percentiles are still updated once per step, so their windows are in steps and not in log events. The logged step
+    time and utilization are the means since the last log event, the memory is the peak since the last log event and
+    for ``log_every_n_steps > 1`` the minimum and maximum step time are logged as well. The metrics in
+    ``trainer.callback_metrics`` keep their values until the next log event, so consumers should only read them when
+    ``num_log_events`` changed.
+
+    Every step is further split into the time waiting for the data (from ``on_train_batch_end`` to the next
+    ``on_train_batch_start``) and the compute time (from ``on_train_batch_start`` to ``on_train_batch_end``), which
+    are logged per rank together with the fraction of the time spent waiting for data over all ranks.
+
+    The compute time is broken down into the forward, backward and optimizer phases by marks recorded from the
+    training hooks with a :class:`~lit_llms.callbacks.step_timer.StepTimer` (by default CUDA events on GPUs and
+    ``perf_counter`` otherwise). The CUDA event timer reports the phases of the step before the previous one to never
+    wait for the device.
+
+    The clock of the step time and the data wait is paused from the start of a validation loop (``on_validation_start``)
+    or a checkpoint save (``on_save_checkpoint``) during fitting until the next training step starts. The paused time is
+    reported per rank as overhead instead, split into the duration of the validation loop
+    (``<overhead_time_logname>_validation``) and the time from dumping the checkpoint until training resumes
+    (``<overhead_time_logname>_checkpoint``, mostly writing it). Their moving averages are the overhead per step.
+
+    With a ``trace_writer``, the steps and their data wait, compute and phases, the collectives of the callback and the
+    validation and checkpoint overhead are further recorded as spans of a
+    :class:`~lit_llms.callbacks.trace_writer.TraceWriter` which periodically dumps them as a Chrome trace per rank.
+    The spans use host timestamps, so with asynchronous CUDA execution they show when the work was issued.
+
+    With ``async_collectives=True`` the gather is launched with ``async_op=True`` and only waited for at the start of
+    the next step, so that it overlaps with the forward pass instead of acting as a global barrier. The logged metrics
+    are then one step stale and the metrics of the last sync before the end of training are not logged.
+
+    All statistics above which are gathered per rank are logged with one key per rank (``<logname>_rank<i>``). With
+    ``aggregate_ranks=True`` they are summarized instead, so that the number of keys scales with the number of nodes
+    and not with the number of ranks: the global ``_min``, ``_mean``, ``_max`` and ``_std``, the ``_node<n>_min``,
+    ``_node<n>_mean`` and ``_node<n>_max`` of every node and the values and ranks of the ``top_k_ranks`` worst ranks
+    (``_worst<j>`` and ``_worst<j>_rank``, the highest times and memory and the lowest utilization). The per-rank keys
+    are then only logged every ``per_rank_every_n_steps`` steps, or written as histograms to all loggers supporting
+    them with ``per_rank_as_histogram=True``.
+
+    With ``straggler_detection=True`` the per-rank step time (data wait and compute time) and compute time averaged over
+    the last ``straggler_window`` steps are checked for stragglers at every log event once the window has been filled.
+    A rank is a straggler if its robust z-score based on the median and the median absolute deviation over all ranks
+    exceeds ``straggler_threshold`` and it is at least ``straggler_min_slowdown`` times slower than the median. The
+    number of stragglers, the maximum slowdown over all ranks and the slowdown of every straggler
+    (``<straggler_logname>/<signal>_rank<i>_slowdown``) are logged and ``straggler_hook`` is called with the trainer and
+    the list of :class:`~lit_llms.callbacks.straggler_detection.Straggler`. This needs at least three ranks.
+    """
+
+    # phases of a step and the marks of the step timer they span
+    _phases = {
+        "forward": ("batch_start", "before_backward"),
+        "backward": ("before_backward", "after_backward"),
+        "optimizer": ("before_optimizer_step", "batch_end"),
+    }
 
     def __init__(
         self,
         gpu_memory_logname: str = "gpu_stats/max_memory",
         gpu_util_logname: str = "gpu_stats/utilization",
         time_per_batch_logname: str = "time/seconds_per_iter",
+        average_windows: Sequence[int] = (10, 100),
+        percentiles: Sequence[float] = (),
+        utilization_sampling_interval: Optional[float] = None,
+        utilization_sensor: Optional[Sensor] = None,
+        log_every_n_steps: int = 1,
+        async_collectives: bool = False,
+        data_wait_logname: str = "time/data_wait",
+        compute_time_logname: str = "time/compute",
+        data_bound_fraction_logname: str = "time/data_bound_fraction",
+        phase_time_logname: str = "time/phase",
+        step_timer: Optional[StepTimer] = None,
+        aggregate_ranks: bool = False,
+        top_k_ranks: int = 3,
+        per_rank_every_n_steps: Optional[int] = None,
+        per_rank_as_histogram: bool = False,
+        straggler_detection: bool = False,
+        straggler_window: Optional[int] = None,
+        straggler_threshold: float = 3.5,
+        straggler_min_slowdown: float = 1.05,
+        straggler_hook: Optional[Callable[[lightning.pytorch.Trainer, List[Straggler]], None]] = None,
+        straggler_logname: str = "stragglers",
+        sensor_backend: Optional[SensorBackend] = None,
+        overhead_time_logname: str = "time/overhead",
+        trace_writer: Optional[TraceWriter] = None,
     ):
         super().__init__()
+        if log_every_n_steps < 1:
+            raise ValueError(f"log_every_n_steps must be at least 1, got {log_every_n_steps}")
+        if per_rank_every_n_steps is not None and per_rank_every_n_steps < 1:
+            raise ValueError(f"per_rank_every_n_steps must be at least 1, got {per_rank_every_n_steps}")
+        if straggler_window is not None and straggler_window not in average_windows:
+            raise ValueError(
+                f"straggler_window must be one of the average_windows {average_windows}, got {straggler_window}"
+            )
         self.last_batch_start_time: Optional[float] = None
-        self.gpu_utilizations10: List[MovingAverage] = []
-        self.gpu_utilizations100: List[MovingAverage] = []
+        self.last_batch_end_time: Optional[float] = None
+        self.average_windows = tuple(average_windows)
+        self.percentiles = tuple(percentiles)
+        # one batched average (and percentile sketch) over all ranks and windows, created once the world size is known
+        self.gpu_utilization_averages: Optional[MultiWindowMovingAverage] = None
+        self.gpu_utilization_quantiles: Optional[StreamingQuantile] = None
         self.running_utilizations_per_batch: List[Union[torch.Tensor, float]] = []
-
-        self.seconds_per_iter10 = MovingAverage(window_size=10, sync_on_compute=False)
-        self.seconds_per_iter100 = MovingAverage(window_size=100, sync_on_compute=False)
+        # per-rank averages of the data wait and compute time and of the durations of the phases of a step
+        self.step_timing_averages: Optional[MultiWindowMovingAverage] = None
+        self.phase_timing_averages: Optional[MultiWindowMovingAverage] = None
+        # per-rank averages of the validation and checkpointing time per step
+        self.overhead_timing_averages: Optional[MultiWindowMovingAverage] = None
+        self.sensor_backend = CUDASensorBackend() if sensor_backend is None else sensor_backend
+        # the default backend is bound to the device of the rank in ``setup``
+        self._default_sensor_backend = sensor_backend is None
+        # the per-rank averages of the additional stats of the sensor backend
+        self.sensor_stat_averages: Optional[MultiWindowMovingAverage] = None
+        # the timings logged per rank grouped by the tracker they are averaged in
+        self._timing_groups: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+            ("step_timing_averages", (data_wait_logname, compute_time_logname)),
+            ("phase_timing_averages", tuple(f"{phase_time_logname}_{phase}" for phase in self._phases)),
+            (
+                "overhead_timing_averages",
+                (f"{overhead_time_logname}_validation", f"{overhead_time_logname}_checkpoint"),
+            ),
+        )
+        if self.sensor_backend.stat_names:
+            self._timing_groups += (("sensor_stat_averages", tuple(self.sensor_backend.stat_names)),)
+        self.step_timer = step_timer
+
+        self.utilization_sampling_interval = utilization_sampling_interval
+        self.utilization_sensor = utilization_sensor
+        self.utilization_sampler: Optional[UtilizationSampler] = None
+        self._sampled_utilization: Optional[float] = None
+
+        self.log_every_n_steps = log_every_n_steps
+        # the number of times the gathered metrics were logged, for consumers to tell fresh from stale metrics
+        self.num_log_events = 0
+        # per-step values of the current rank since the last sync: step time, utilization and the timings of all groups
+        self._pending_steps: List[List[float]] = []
+
+        self.async_collectives = async_collectives
+        # the gather launched at the last sync together with the steps having a time, a utilization and timings
+        self._pending_gather: Optional[Tuple[Callable[[], torch.Tensor], List[List[int]]]] = None
+
+        self.seconds_per_iter_averages = MultiWindowMovingAverage(
+            window_sizes=self.average_windows, sync_on_compute=False
+        )
+        self.seconds_per_iter_quantiles: Optional[StreamingQuantile] = None
+        if self.percentiles:
+            self.seconds_per_iter_quantiles = StreamingQuantile(
+                quantiles=[p / 100 for p in self.percentiles], min_value=1e-4, max_value=1e4, sync_on_compute=False
+            )
 
         self.gpu_memory_logname = gpu_memory_logname
         self.gpu_util_logname = gpu_util_logname
         self.time_per_batch_logname = time_per_batch_logname
+        self.data_wait_logname = data_wait_logname
+        self.compute_time_logname = compute_time_logname
+        self.data_bound_fraction_logname = data_bound_fraction_logname
+        self.phase_time_logname = phase_time_logname
+        self.overhead_time_logname = overhead_time_logname
+
+        # the start of the current pause of the step clock and of the running validation loop and checkpoint save
+        self._pause_start: Optional[float] = None
+        self._validation_start: Optional[float] = None
+        self._checkpoint_start: Optional[float] = None
+        # the validation and checkpointing time since the previous training step
+        self._overhead_times = [0.0, 0.0]
+
+        self.trace_writer = trace_writer
+        # host timestamps of the marks of the current step for the trace
+        self._trace_marks: Dict[str, float] = {}
+
+        self.aggregate_ranks = aggregate_ranks
+        self.top_k_ranks = top_k_ranks
+        self.per_rank_every_n_steps = per_rank_every_n_steps
+        self.per_rank_as_histogram = per_rank_as_histogram
+        self._steps_since_per_rank = 0
+
+        self.straggler_detection = straggler_detection
+        self.straggler_window = min(self.average_windows) if straggler_window is None else straggler_window
+        self.straggler_threshold = straggler_threshold
+        self.straggler_min_slowdown = straggler_min_slowdown
+        self.straggler_hook = straggler_hook
+        self.straggler_logname = straggler_logname
 
     def _reset_running_utilizations(self) -> None:
         self.running_utilizations_per_batch = []
 
-    def _init_gpu_util_trackers(self, world_size: int) -> None:
-        if not self.gpu_utilizations10:
-            for _ in range(world_size):
-                self.gpu_utilizations10.append(MovingAverage(window_size=10, sync_on_compute=False))
-        if not self.gpu_utilizations100:
-            for _ in range(world_size):
-                self.gpu_utilizations100.append(MovingAverage(window_size=100, sync_on_compute=False))
+    def setup(
+        self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule, stage: str
+    ) -> None:
+        # the current device of the sampler thread is the first GPU, not the one of this rank
+        if self._default_sensor_backend and trainer.strategy.root_device.type == "cuda":
+            self.sensor_backend = CUDASensorBackend(trainer.strategy.root_device)
+
+    def _init_utilization_sampler(self) -> None:
+        if self.utilization_sampling_interval is None or self.utilization_sampler is not None:
+            return
+        sensor = self.utilization_sensor or self.sensor_backend.sensor()
+        self.utilization_sampler = UtilizationSampler(sensor, interval=self.utilization_sampling_interval)
+        # take the first sample synchronously so that every rank has a utilization to share from the first step on
+        self.utilization_sampler.sample()
+        self.utilization_sampler.start()
+
+    def _stop_utilization_sampler(self) -> None:
+        if self.utilization_sampler is not None:
+            self.utilization_sampler.stop()
+            self.utilization_sampler = None
+
+    def on_train_start(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        self._init_utilization_sampler()
+        if self.trace_writer is not None:
+            self.trace_writer.rank = trainer.global_rank
+
+    def on_train_end(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        self._stop_utilization_sampler()
+        self._finish_pending_gather(trainer, pl_module, log=False)
+        if self.trace_writer is not None:
+            self.trace_writer.close()
+
+    def teardown(
+        self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule, stage: str
+    ) -> None:
+        self._stop_utilization_sampler()
+        self._finish_pending_gather(trainer, pl_module, log=False)
+        if self.trace_writer is not None:
+            self.trace_writer.close()
+
+    def _init_gpu_util_trackers(self, world_size: int, device: Optional[torch.device] = None) -> None:
+        if self.gpu_utilization_averages is None:
+            self.gpu_utilization_averages = MultiWindowMovingAverage(
+                window_sizes=self.average_windows, num_streams=world_size, sync_on_compute=False
+            )
+
+        for name_str, timing_lognames in self._timing_groups:
+            if getattr(self, name_str) is None:
+                # the timings of all ranks are flattened to [num_timings * world_size] streams
+                averages = MultiWindowMovingAverage(
+                    window_sizes=self.average_windows,
+                    num_streams=len(timing_lognames) * world_size,
+                    sync_on_compute=False,
+                )
+                setattr(self, name_str, averages)
+
+        if self.percentiles and self.gpu_utilization_quantiles is None:
+            self.gpu_utilization_quantiles = StreamingQuantile(
+                quantiles=[p / 100 for p in self.percentiles],
+                min_value=1.0,
+                max_value=100.0,
+                num_streams=world_size,
+                sync_on_compute=False,
+            )
+
+        # keep the buffers next to the gathered statistics to avoid a device transfer per step
+        if device is not None:
+            for name_str in (*self._average_names, *self._quantile_names):
+                metric = getattr(self, name_str)
+                if metric is not None and metric.device != device:
+                    metric.to(device)
+
+    @property
+    def _average_names(self) -> Tuple[str, ...]:
+        """The names of all moving averages, including the ones of every timing group."""
+        return (
+            "gpu_utilization_averages",
+            "seconds_per_iter_averages",
+            *(name_str for name_str, _ in self._timing_groups),
+        )
+
+    @property
+    def _quantile_names(self) -> Tuple[str, ...]:
+        return ("gpu_utilization_quantiles", "seconds_per_iter_quantiles")
 
     @torch.no_grad()
     def on_train_batch_start(
@@ -49,74 +315,385 @@ class GPUMonitoringCallback(lightning.pytorch.callbacks.Callback):
         batch: Any,
         batch_idx: int,
     ) -> None:
-        self._init_gpu_util_trackers(trainer.world_size)
-
-        metrics = {}
-
-        # only calc time after first batch
+        self._init_gpu_util_trackers(trainer.world_size, trainer.strategy.root_device)
+        self._init_utilization_sampler()
+        if self.step_timer is None:
+            self.step_timer = step_timer_for_device(trainer.strategy.root_device)
+        # the gather launched at the previous sync had the previous step to complete
+        self._finish_pending_gather(trainer, pl_module)
+
+        # collect the metrics of the current rank, the times are only available after the first batch
+        curr_time = time.time()
+        paused_time = self._resume_clock(curr_time)
+        if self.trace_writer is not None:
+            self._trace_step(curr_time)
+        overhead_times, self._overhead_times = self._overhead_times, [0.0, 0.0]
+        time_delta = float("nan")
+        timings = [float("nan")] * 2
         if batch_idx:
-            curr_time = time.time()
             assert self.last_batch_start_time is not None
-            time_delta = curr_time - self.last_batch_start_time
-            avg_time_delta = torch.tensor(trainer.strategy.reduce(time_delta), dtype=torch.float)
-            self.seconds_per_iter10.update(avg_time_delta)
-            self.seconds_per_iter100.update(avg_time_delta)
-            self.last_batch_start_time = curr_time
-
-            metrics[self.time_per_batch_logname] = avg_time_delta
-            metrics[f"{self.time_per_batch_logname}{self._average_postfix(10)}"] = self.seconds_per_iter10.compute()
-            metrics[f"{self.time_per_batch_logname}{self._average_postfix(100)}"] = self.seconds_per_iter100.compute()
-
-        # collect the metrics on the current rank
-        device = trainer.strategy.root_device
-
-        max_memory = torch.tensor(torch.cuda.max_memory_allocated(), device=device, dtype=torch.float) / (
-            1024**3
-        )  # in GB
-        torch.cuda.reset_max_memory_allocated()
-
-        # gather the metrics from all processes
-        max_memory_total_rank = trainer.strategy.all_gather(max_memory)
-
-        if self.running_utilizations_per_batch:
-            curr_utils = sum(self.running_utilizations_per_batch) / len(self.running_utilizations_per_batch)
-            curr_utils_total_rank = trainer.strategy.all_gather(curr_utils)
-            self._reset_running_utilizations()
-
-            # the metrics are in an N x 1 tensor where N is the total number of processes
-            assert curr_utils_total_rank.size(0) == trainer.world_size
-        else:
-            curr_utils_total_rank = None
-
-        # bookkeeping and compute statistics for each rank
-        for i in range(trainer.world_size):
-            metrics[f"{self.gpu_memory_logname}_rank{i}"] = max_memory_total_rank[i]
-            if curr_utils_total_rank is not None:
-                metrics[f"{self.gpu_util_logname}_rank{i}"] = curr_utils_total_rank[i]
-                self.gpu_utilizations10[i].update(curr_utils_total_rank[i])
-                self.gpu_utilizations100[i].update(curr_utils_total_rank[i])
-
-            # update counts have to be the same for 10 and 100 metrics
-            # check for protected and public because of https://github.com/Lightning-AI/metrics/pull/1370
-            curr_update_count = getattr(
-                self.gpu_utilizations10[i],
-                "_update_count",
-                getattr(self.gpu_utilizations10[i], "update_count", 1),
-            )
-            if curr_update_count > 10:
-                metrics[f"{self.gpu_util_logname}_rank{i}{self._average_postfix(10)}"] = self.gpu_utilizations10[
-                    i
-                ].compute()
-            if curr_update_count > 100:
-                metrics[f"{self.gpu_util_logname}_rank{i}{self._average_postfix(100)}"] = self.gpu_utilizations100[
-                    i
-                ].compute()
-
-        pl_module.log_dict(metrics, sync_dist=False, on_step=True, on_epoch=False, rank_zero_only=True)
-
-        trainer.strategy.barrier()
+            time_delta = curr_time - self.last_batch_start_time - paused_time
+            if self.last_batch_end_time is not None and self.last_batch_end_time >= self.last_batch_start_time:
+                # waiting for the current batch and computing the previous one
+                timings = [
+                    curr_time - self.last_batch_end_time - paused_time,
+                    self.last_batch_end_time - self.last_batch_start_time,
+                ]
+        self.step_timer.next_step()
+        phase_timings = self.step_timer.durations(list(self._phases.values())) or [float("nan")] * len(self._phases)
+        curr_utils = self._collect_utilization()
+        self._pending_steps.append(
+            [
+                time_delta,
+                float("nan") if curr_utils is None else curr_utils,
+                *timings,
+                *phase_timings,
+                *overhead_times,
+                *self.sensor_backend.stats(),
+            ]
+        )
+
+        if len(self._pending_steps) >= self.log_every_n_steps:
+            self._sync_and_log(trainer, pl_module)
+
         self._get_current_utilisation(trainer)
         self.last_batch_start_time = time.time()
+        self._record_mark("batch_start")
+
+    def _sync_and_log(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        # peak since the last sync
+        max_memory = self.sensor_backend.max_memory() / 1024**3  # in GB
+
+        # which steps have a time, utilization or timings is decided on the host and is the same for all ranks
+        steps, self._pending_steps = self._pending_steps, []
+        valid_steps = [
+            [i for i, step in enumerate(steps) if not math.isnan(step[0])],
+            [i for i, step in enumerate(steps) if not math.isnan(step[1])],
+        ]
+        column = 2
+        for _, timing_lognames in self._timing_groups:
+            columns = slice(column, column + len(timing_lognames))
+            valid_steps.append([i for i, step in enumerate(steps) if not any(map(math.isnan, step[columns]))])
+            column = columns.stop
+
+        # exchange the metrics of all steps since the last sync of all processes in a single collective
+        stats = [max_memory, *(value for step in steps for value in step)]
+        start = self._trace_clock()
+        if self.async_collectives:
+            self._pending_gather = (self._all_gather_stats_async(trainer, stats), valid_steps)
+            self._add_trace_span("all_gather_launch", start, self._trace_clock(), track=1)
+        else:
+            gathered = self._all_gather_stats(trainer, stats)
+            self._add_trace_span("all_gather", start, self._trace_clock(), track=1)
+            self._log_gathered(trainer, pl_module, gathered, valid_steps)
+
+    def _finish_pending_gather(
+        self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule, log: bool = True
+    ) -> None:
+        if self._pending_gather is None:
+            return
+        wait, valid_steps = self._pending_gather
+        self._pending_gather = None
+        start = self._trace_clock()
+        gathered = wait()
+        self._add_trace_span("all_gather_wait", start, self._trace_clock(), track=1)
+        self._log_gathered(trainer, pl_module, gathered, valid_steps, log=log)
+
+    def _log_gathered(
+        self,
+        trainer: lightning.pytorch.Trainer,
+        pl_module: lightning.pytorch.LightningModule,
+        gathered: torch.Tensor,
+        valid_steps: List[List[int]],
+        log: bool = True,
+    ) -> None:
+        """Updates the trackers with the gathered per-step metrics of all ranks since the last sync and logs them."""
+        assert self.gpu_utilization_averages is not None
+        metrics = {}
+        time_steps, util_steps = valid_steps[:2]
+
+        max_memory_total_rank = gathered[:, 0]
+        num_values = 2 + sum(len(timing_lognames) for _, timing_lognames in self._timing_groups)
+        steps_total_rank = gathered[:, 1:].reshape(trainer.world_size, -1, num_values)
+        step_times_total_rank, utils_total_rank = steps_total_rank[..., 0], steps_total_rank[..., 1]
+
+        if time_steps:
+            # the moving averages and percentiles are updated once per step to keep their windows in steps
+            step_times = step_times_total_rank[:, time_steps].mean(0)
+            for step_time in step_times:
+                self.seconds_per_iter_averages.update(step_time)
+                if self.seconds_per_iter_quantiles is not None:
+                    self.seconds_per_iter_quantiles.update(step_time)
+
+            metrics[self.time_per_batch_logname] = step_times.mean()
+            if self.log_every_n_steps > 1:
+                metrics[f"{self.time_per_batch_logname}_min"] = step_times.min()
+                metrics[f"{self.time_per_batch_logname}_max"] = step_times.max()
+
+            time_averages = self.seconds_per_iter_averages.compute().reshape(len(self.average_windows))
+            for window, time_average in zip(self.average_windows, time_averages):
+                metrics[f"{self.time_per_batch_logname}{self._average_postfix(window)}"] = time_average
+
+            if self.seconds_per_iter_quantiles is not None:
+                time_quantiles = self.seconds_per_iter_quantiles.compute().reshape(len(self.percentiles))
+                for percentile, time_quantile in zip(self.percentiles, time_quantiles):
+                    metrics[f"{self.time_per_batch_logname}{self._percentile_postfix(percentile)}"] = time_quantile
+
+        curr_utils_total_rank: Optional[torch.Tensor] = None
+        util_quantiles: Optional[torch.Tensor] = None
+        if util_steps:
+            for step in util_steps:
+                self.gpu_utilization_averages.update(utils_total_rank[:, step])
+                if self.gpu_utilization_quantiles is not None:
+                    self.gpu_utilization_quantiles.update(utils_total_rank[:, step])
+            curr_utils_total_rank = utils_total_rank[:, util_steps].mean(1)
+
+            if self.gpu_utilization_quantiles is not None:
+                util_quantiles = self.gpu_utilization_quantiles.compute().reshape(
+                    len(self.percentiles), trainer.world_size
+                )
+
+        # only report the averages over windows that have been filled
+        util_windows = self._filled_windows(self.gpu_utilization_averages)
+        if util_windows:
+            # torchmetrics squeezes single element results, so restore the window and rank dimensions
+            util_averages = self.gpu_utilization_averages.compute().reshape(
+                len(self.average_windows), trainer.world_size
+            )
+
+        # the current timings ([world_size, num_timings]) and the filled windows with their averages of every group
+        timing_results = []
+        column = 2
+        for (name_str, timing_lognames), timing_steps in zip(self._timing_groups, valid_steps[2:]):
+            timing_averages: MultiWindowMovingAverage = getattr(self, name_str)
+            columns = slice(column, column + len(timing_lognames))
+            column = columns.stop
+
+            curr_timings_total_rank: Optional[torch.Tensor] = None
+            if timing_steps:
+                timings_total_rank = steps_total_rank[:, timing_steps, columns]
+                for step_timings in timings_total_rank.unbind(1):
+                    timing_averages.update(step_timings.t())
+                curr_timings_total_rank = timings_total_rank.mean(1)
+
+            timing_windows = self._filled_windows(timing_averages)
+            averages = None
+            if timing_windows:
+                averages = timing_averages.compute().reshape(
+                    len(self.average_windows), len(timing_lognames), trainer.world_size
+                )
+            timing_results.append((timing_lognames, curr_timings_total_rank, timing_windows, averages))
+
+        # fraction of the time all ranks spent waiting for data
+        _, curr_step_timings, step_timing_windows, step_timing_averages = timing_results[0]
+        if curr_step_timings is not None:
+            data_wait, compute = curr_step_timings.sum(0)
+            metrics[self.data_bound_fraction_logname] = data_wait / (data_wait + compute)
+        for k, window in step_timing_windows:
+            assert step_timing_averages is not None
+            data_wait, compute = step_timing_averages[k].sum(-1)
+            metrics[f"{self.data_bound_fraction_logname}{self._average_postfix(window)}"] = data_wait / (
+                data_wait + compute
+            )
+
+        if self.straggler_detection and trainer.world_size >= 3:
+            k = self.average_windows.index(self.straggler_window)
+            if (k, self.straggler_window) in step_timing_windows:
+                assert step_timing_averages is not None
+                metrics.update(self._detect_stragglers(trainer, step_timing_averages[k], log))
+
+        # the statistics of all ranks by their name without the rank and whether high values are worse
+        per_rank: List[Tuple[str, str, torch.Tensor, bool]] = [
+            (self.gpu_memory_logname, "", max_memory_total_rank, True)
+        ]
+        if curr_utils_total_rank is not None:
+            per_rank.append((self.gpu_util_logname, "", curr_utils_total_rank, False))
+        for k, window in util_windows:
+            per_rank.append((self.gpu_util_logname, self._average_postfix(window), util_averages[k], False))
+        if util_quantiles is not None:
+            for k, percentile in enumerate(self.percentiles):
+                per_rank.append((self.gpu_util_logname, self._percentile_postfix(percentile), util_quantiles[k], False))
+        for timing_lognames, curr_timings_total_rank, timing_windows, averages in timing_results:
+            for t, timing_logname in enumerate(timing_lognames):
+                if curr_timings_total_rank is not None:
+                    per_rank.append((timing_logname, "", curr_timings_total_rank[:, t], True))
+                for k, window in timing_windows:
+                    assert averages is not None
+                    per_rank.append((timing_logname, self._average_postfix(window), averages[k, t], True))
+
+        report_per_rank = True
+        if self.aggregate_ranks:
+            metrics.update(self._aggregate_ranks(trainer, per_rank))
+            report_per_rank = False
+            if self.per_rank_every_n_steps is not None:
+                self._steps_since_per_rank += steps_total_rank.size(1)
+                if self._steps_since_per_rank >= self.per_rank_every_n_steps:
+                    self._steps_since_per_rank = 0
+                    report_per_rank = True
+
+        if report_per_rank and self.per_rank_as_histogram and self.aggregate_ranks:
+            if log:
+                self._log_per_rank_histograms(trainer, per_rank)
+        elif report_per_rank:
+            # bookkeeping of the statistics for each rank
+            for i in range(trainer.world_size):
+                for logname, postfix, values, _ in per_rank:
+                    metrics[f"{logname}_rank{i}{postfix}"] = values[i]
+
+        if log:
+            pl_module.log_dict(metrics, sync_dist=False, on_step=True, on_epoch=False, rank_zero_only=True)
+            self.num_log_events += 1
+
+    def _aggregate_ranks(
+        self, trainer: lightning.pytorch.Trainer, per_rank: List[Tuple[str, str, torch.Tensor, bool]]
+    ) -> Dict[str, torch.Tensor]:
+        """Global and per-node summaries and the worst ranks of the statistics of all ranks."""
+        values = torch.stack([rank_values for _, _, rank_values, _ in per_rank])
+        signs = values.new_tensor([1.0 if higher_is_worse else -1.0 for *_, higher_is_worse in per_rank]).unsqueeze(1)
+
+        # all summaries are computed for all statistics at once
+        summaries = {
+            "min": values.min(1).values,
+            "mean": values.mean(1),
+            "max": values.max(1).values,
+            "std": values.std(1, unbiased=False),
+        }
+        num_nodes = trainer.num_nodes
+        if num_nodes > 1 and trainer.world_size % num_nodes == 0:
+            per_node = values.reshape(len(per_rank), num_nodes, -1)
+            for node in range(num_nodes):
+                summaries[f"node{node}_min"] = per_node[:, node].min(-1).values
+                summaries[f"node{node}_mean"] = per_node[:, node].mean(-1)
+                summaries[f"node{node}_max"] = per_node[:, node].max(-1).values
+
+        worst_values, worst_ranks = (values * signs).topk(min(self.top_k_ranks, trainer.world_size), dim=1)
+        worst_values = worst_values * signs
+        for j in range(worst_ranks.size(1)):
+            summaries[f"worst{j}"] = worst_values[:, j]
+            summaries[f"worst{j}_rank"] = worst_ranks[:, j].to(values.dtype)
+
+        metrics = {}
+        for s, (logname, postfix, _, _) in enumerate(per_rank):
+            for summary_name, summary in summaries.items():
+                metrics[f"{logname}{postfix}_{summary_name}"] = summary[s]
+        return metrics
+
+    def _detect_stragglers(
+        self, trainer: lightning.pytorch.Trainer, step_timings: torch.Tensor, log: bool
+    ) -> Dict[str, torch.Tensor]:
+        """Scores the per-rank averages of the data wait and compute time ([2, world_size]) for stragglers."""
+        data_wait, compute = step_timings
+        signal_names = ("step", "compute")
+        outliers, slowdowns, scores = robust_outliers(
+            torch.stack([data_wait + compute, compute]), self.straggler_threshold, self.straggler_min_slowdown
+        )
+
+        # a single transfer to the host of the signal, rank, slowdown and score of all stragglers
+        flagged = outliers.nonzero()
+        flagged_values = torch.cat(
+            [flagged.to(slowdowns.dtype), slowdowns[outliers].unsqueeze(1), scores[outliers].unsqueeze(1)], dim=1
+        ).tolist()
+        stragglers = [
+            Straggler(rank=int(rank), signal=signal_names[int(s)], slowdown=slowdown, score=score)
+            for s, rank, slowdown, score in flagged_values
+        ]
+
+        metrics = {}
+        num_stragglers = outliers.sum(1)
+        max_slowdowns = slowdowns.max(1).values
+        for s, signal_name in enumerate(signal_names):
+            metrics[f"{self.straggler_logname}/{signal_name}_count"] = num_stragglers[s].to(slowdowns.dtype)
+            metrics[f"{self.straggler_logname}/{signal_name}_max_slowdown"] = max_slowdowns[s]
+        for straggler in stragglers:
+            metrics[f"{self.straggler_logname}/{straggler.signal}_rank{straggler.rank}_slowdown"] = (
+                slowdowns.new_tensor(straggler.slowdown)
+            )
+
+        if stragglers and log:
+            rank_zero_info(
+                "Stragglers in the last {} steps: {}".format(
+                    self.straggler_window,
+                    ", ".join(f"rank {s.rank} ({s.signal} {s.slowdown:.2f}x)" for s in stragglers),
+                )
+            )
+            if self.straggler_hook is not None:
+                self.straggler_hook(trainer, stragglers)
+        return metrics
+
+    @staticmethod
+    def _log_per_rank_histograms(
+        trainer: lightning.pytorch.Trainer, per_rank: List[Tuple[str, str, torch.Tensor, bool]]
+    ) -> None:
+        if not trainer.is_global_zero:
+            return
+        for logger in trainer.loggers:
+            add_histogram = getattr(getattr(logger, "experiment", None), "add_histogram", None)
+            if add_histogram is None:
+                continue
+            for logname, postfix, values, _ in per_rank:
+                add_histogram(f"{logname}{postfix}_per_rank", values, global_step=trainer.global_step)
+
+    def _filled_windows(self, metric: MultiWindowMovingAverage) -> List[Tuple[int, int]]:
+        """Indices and sizes of the averaging windows which have been filled."""
+        # check for protected and public because of https://github.com/Lightning-AI/metrics/pull/1370
+        update_count = getattr(metric, "_update_count", getattr(metric, "update_count", 1))
+        return [(k, window) for k, window in enumerate(self.average_windows) if update_count > window]
+
+    def _collect_utilization(self) -> Optional[float]:
+        """Mean utilization of the current rank since the previous step."""
+        if self.utilization_sampler is not None:
+            sample = self.utilization_sampler.read()
+            # keep reporting the last sample if the sampler did not take a new one since the previous step
+            if sample is not None:
+                self._sampled_utilization = sample[0]
+            return self._sampled_utilization
+
+        if not self.running_utilizations_per_batch:
+            return None
+        curr_utils = float(sum(self.running_utilizations_per_batch) / len(self.running_utilizations_per_batch))
+        self._reset_running_utilizations()
+        return curr_utils
+
+    @staticmethod
+    def _all_gather_stats(trainer: lightning.pytorch.Trainer, stats: Sequence[float]) -> torch.Tensor:
+        """Gathers the per-rank statistics of all processes packed into one tensor with a single ``all_gather``.
+
+        Returns a tensor of shape ``[world_size, len(stats)]``.
+        """
+        local_stats = torch.tensor(stats, device=trainer.strategy.root_device, dtype=torch.float)
+        return trainer.strategy.all_gather(local_stats).reshape(trainer.world_size, len(stats))
+
+    @staticmethod
+    def _all_gather_stats_async(
+        trainer: lightning.pytorch.Trainer, stats: Sequence[float]
+    ) -> Callable[[], torch.Tensor]:
+        """Launches the gather of :meth:`_all_gather_stats` without waiting for it.
+
+        Returns a function which waits for the collective and returns the gathered statistics. Without an initialized
+        process group the statistics are gathered by the strategy right away.
+        """
+        if not (torch.distributed.is_available() and torch.distributed.is_initialized()):
+            gathered = GPUMonitoringCallback._all_gather_stats(trainer, stats)
+            return lambda: gathered
+
+        local_stats = torch.tensor(stats, device=trainer.strategy.root_device, dtype=torch.float)
+        into_tensor = hasattr(torch.distributed, "all_gather_into_tensor")
+        if into_tensor:
+            gathered = local_stats.new_empty(trainer.world_size * len(stats))
+            work = torch.distributed.all_gather_into_tensor(gathered, local_stats, async_op=True)
+        else:
+            # torch < 1.13
+            chunks = [torch.empty_like(local_stats) for _ in range(trainer.world_size)]
+            work = torch.distributed.all_gather(chunks, local_stats, async_op=True)
+        # async_op=True always returns a work handle
+        assert work is not None
+
+        def wait() -> torch.Tensor:
+            work.wait()
+            result = gathered if into_tensor else torch.cat(chunks)
+            return result.reshape(trainer.world_size, len(stats))
+
+        return wait
 
     @torch.no_grad()
     def on_train_batch_end(
@@ -127,18 +704,22 @@ class GPUMonitoringCallback(lightning.pytorch.callbacks.Callback):
         batch: Any,
         batch_idx: int,
     ) -> None:
+        self.last_batch_end_time = time.time()
+        self._record_mark("batch_end")
         self._get_current_utilisation(trainer)
 
     @torch.no_grad()
     def on_before_backward(
         self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule, loss: torch.Tensor
     ) -> None:
+        self._record_mark("before_backward")
         self._get_current_utilisation(trainer)
 
     @torch.no_grad()
     def on_after_backward(
         self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule
     ) -> None:
+        self._record_mark("after_backward")
         self._get_current_utilisation(trainer)
 
     @torch.no_grad()
@@ -149,6 +730,7 @@ class GPUMonitoringCallback(lightning.pytorch.callbacks.Callback):
         optimizer: torch.optim.Optimizer,
         opt_idx: int = 0,
     ) -> None:
+        self._record_mark("before_optimizer_step")
         self._get_current_utilisation(trainer)
 
     @torch.no_grad()
@@ -160,14 +742,76 @@ class GPUMonitoringCallback(lightning.pytorch.callbacks.Callback):
     ) -> None:
         self._get_current_utilisation(trainer)
 
+    @staticmethod
+    def _is_fitting(trainer: lightning.pytorch.Trainer) -> bool:
+        return trainer.state.fn == "fit" and not trainer.sanity_checking
+
+    def _pause_clock(self, now: float) -> None:
+        if self._pause_start is None:
+            self._pause_start = now
+
+    def _resume_clock(self, now: float) -> float:
+        """Ends the current pause of the step clock and returns its duration."""
+        if self._pause_start is None:
+            return 0.0
+        if self._checkpoint_start is not None:
+            self._overhead_times[1] += now - self._checkpoint_start
+            self._add_trace_span("checkpoint", self._checkpoint_start, now, track=2)
+        paused_time = now - self._pause_start
+        self._pause_start = self._validation_start = self._checkpoint_start = None
+        return paused_time
+
+    def on_validation_start(
+        self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule
+    ) -> None:
+        if not self._is_fitting(trainer):
+            return
+        self._validation_start = time.time()
+        self._pause_clock(self._validation_start)
+
+    def on_validation_end(
+        self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule
+    ) -> None:
+        if self._validation_start is not None:
+            now = time.time()
+            self._overhead_times[0] += now - self._validation_start
+            self._add_trace_span("validation", self._validation_start, now, track=2)
+            self._validation_start = None
+
+    def _record_mark(self, mark: str) -> None:
+        if self.step_timer is not None:
+            self.step_timer.record(mark)
+        if self.trace_writer is not None:
+            self._trace_marks[mark] = time.time()
+
+    def _trace_clock(self) -> float:
+        """The current time if the spans are traced, the clock is not read otherwise."""
+        return time.time() if self.trace_writer is not None else 0.0
+
+    def _add_trace_span(self, name: str, start: float, end: float, track: int = 0) -> None:
+        if self.trace_writer is not None:
+            self.trace_writer.add_span(name, start, end, track=track)
+
+    def _trace_step(self, now: float) -> None:
+        """Records the spans of the step which ends now."""
+        assert self.trace_writer is not None
+        marks, self._trace_marks = self._trace_marks, {}
+        start, end = marks.get("batch_start"), marks.get("batch_end")
+        if start is not None:
+            self.trace_writer.add_span("step", start, now)
+            if end is not None and end >= start:
+                self.trace_writer.add_span("compute", start, end)
+                self.trace_writer.add_span("data_wait", end, now)
+            for phase, (start_mark, end_mark) in self._phases.items():
+                if start_mark in marks and end_mark in marks:
+                    self.trace_writer.add_span(phase, marks[start_mark], marks[end_mark])
+        self.trace_writer.step()
+
     def _get_current_utilisation(self, trainer: lightning.pytorch.Trainer) -> None:
-        self.running_utilizations_per_batch.append(
-            torch.tensor(
-                torch.cuda.utilization(),
-                device=trainer.strategy.root_device,
-                dtype=torch.float,
-            )
-        )
+        if self.utilization_sampler is not None:
+            return
+        # only keep host values here, they are moved to the device once per step
+        self.running_utilizations_per_batch.append(self.sensor_backend.utilization())
 
     def on_save_checkpoint(
         self,
@@ -175,11 +819,15 @@ class GPUMonitoringCallback(lightning.pytorch.callbacks.Callback):
         pl_module: lightning.pytorch.LightningModule,
         checkpoint: Dict[str, Any],
     ) -> None:
-        for name_str in ("gpu_utilizations10", "gpu_utilizations100"):
-            checkpoint[name_str] = [metric.state_dict() for metric in getattr(self, name_str)]
+        if self._is_fitting(trainer) and self._checkpoint_start is None:
+            # the checkpoint is written after all callbacks added their state, until training resumes
+            self._checkpoint_start = time.time()
+            self._pause_clock(self._checkpoint_start)
 
-        for name_str in ("seconds_per_iter10", "seconds_per_iter100"):
-            checkpoint[name_str] = getattr(self, name_str).state_dict()
+        for name_str in (*self._average_names, *self._quantile_names):
+            metric = getattr(self, name_str)
+            if metric is not None:
+                checkpoint[name_str] = metric.state_dict()
 
     def on_load_checkpoint(
         self,
@@ -188,13 +836,69 @@ class GPUMonitoringCallback(lightning.pytorch.callbacks.Callback):
         checkpoint: Dict[str, Any],
     ) -> None:
         self._init_gpu_util_trackers(trainer.world_size)
-        for name_str in ("gpu_utilizations10", "gpu_utilizations100"):
-            for metric, state in zip(getattr(self, name_str), checkpoint.pop(name_str, [])):
+        for name_str in self._average_names:
+            metric = getattr(self, name_str)
+            state = checkpoint.pop(name_str, None)
+            # skip checkpoints of runs with a different world size or different averaging windows
+            if (
+                metric is not None
+                and state is not None
+                and state["_extra_state"]["num_streams"] == metric.num_streams
+                and tuple(state["_extra_state"]["window_sizes"]) == self.average_windows
+            ):
+                metric.load_state_dict(state)
+
+        for name_str in self._quantile_names:
+            metric = getattr(self, name_str)
+            state = checkpoint.pop(name_str, None)
+            if (
+                metric is not None
+                and state is not None
+                and state["_extra_state"]["num_streams"] == metric.num_streams
+                and tuple(state["_extra_state"]["quantiles"]) == metric.quantiles
+            ):
                 metric.load_state_dict(state)
 
-        for name_str in ("seconds_per_iter10", "seconds_per_iter100"):
-            getattr(self, name_str).load_state_dict(checkpoint.pop(name_str, {}))
+        self._load_former_averages(checkpoint)
+
+    def _load_former_averages(self, checkpoint: Dict[str, Any]) -> None:
+        """Converts the single window averages of checkpoints of former versions by adding the values of their longest
+        window to the averages, unless these were loaded from the checkpoint."""
+        for name_str, former_names in _FORMER_AVERAGES.items():
+            former_states = [checkpoint.pop(former_name) for former_name in former_names if former_name in checkpoint]
+            # the utilization was averaged in a list with one average per rank
+            former_states = [state for state in former_states if state]
+            metric = getattr(self, name_str)
+            if not former_states or metric is None or metric.num_values:
+                continue
+
+            history = max((self._former_history(state) for state in former_states), key=lambda values: values.size(-1))
+            num_streams = 1 if metric.num_streams is None else metric.num_streams
+            if history.size(0) != num_streams:
+                rank_zero_warn(
+                    f"Dropped the {' and '.join(former_names)} averages of the checkpoint, which were tracked for "
+                    f"{history.size(0)} ranks instead of {num_streams}."
+                )
+                continue
+            for values in history.unbind(-1):
+                metric.update(values)
+
+    @staticmethod
+    def _former_history(state: Union[Dict[str, Any], List[Dict[str, Any]]]) -> torch.Tensor:
+        """The values of the former list based moving averages, oldest first, with one row per rank."""
+        histories = []
+        for rank_state in state if isinstance(state, list) else [state]:
+            average = MovingAverage(window_size=1)
+            average.load_state_dict(rank_state)
+            # the values in the order they were added, the unused slots of a window which is not yet full first
+            window = average.sliding_window.roll(-int(average.write_index), -1)
+            histories.append(window[window.size(-1) - int(average.num_values):])
+        return torch.stack(histories)
 
     @staticmethod
     def _average_postfix(average_window: int) -> str:
         return f"_averaged{average_window}"
+
+    @staticmethod
+    def _percentile_postfix(percentile: float) -> str:
+        return f"_p{percentile:g}"
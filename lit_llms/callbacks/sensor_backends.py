@@ -0,0 +1,233 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
+
+import torch
+from lightning_utilities.core.imports import RequirementCache
+
+from lit_llms.callbacks.utilization_sampler import Sensor
+
+_PSUTIL_AVAILABLE = RequirementCache("psutil")
+
+
+class SensorBackend(ABC):
+    """Source of the resource statistics of the current rank for
+    :class:`~lit_llms.callbacks.monitoring.GPUMonitoringCallback`.
+
+    ``utilization`` and ``max_memory`` are reported as the utilization and the peak memory. ``stats`` returns one value
+    per entry of ``stat_names`` once per step, which are gathered, averaged and logged per rank like the step timings
+    with the stat names as lognames.
+    """
+
+    stat_names: Tuple[str, ...] = ()
+
+    @abstractmethod
+    def utilization(self) -> float:
+        """Current utilization in percent."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def memory(self) -> float:
+        """Current memory usage in bytes."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def max_memory(self) -> float:
+        """Peak memory usage in bytes since the previous call."""
+        raise NotImplementedError
+
+    def stats(self) -> List[float]:
+        return []
+
+    def sensor(self) -> Sensor:
+        """Sensor for the :class:`~lit_llms.callbacks.utilization_sampler.UtilizationSampler`."""
+        return lambda: (self.utilization(), self.memory())
+
+
+class CUDASensorBackend(SensorBackend):
+    """NVML utilization and allocated memory of a CUDA device, the current device by default."""
+
+    def __init__(self, device: Optional[torch.device] = None) -> None:
+        self._device_args = () if device is None else (device,)
+
+    def utilization(self) -> float:
+        return float(torch.cuda.utilization(*self._device_args))
+
+    def memory(self) -> float:
+        return float(torch.cuda.memory_allocated(*self._device_args))
+
+    def max_memory(self) -> float:
+        max_memory = float(torch.cuda.max_memory_allocated(*self._device_args))
+        torch.cuda.reset_max_memory_allocated(*self._device_args)
+        return max_memory
+
+
+class HostSensorBackend(SensorBackend):
+    """CPU utilization of the host and the resident memory (RSS) of the process tree, including dataloader workers.
+
+    The RSS is sampled once per step by ``stats`` and by ``max_memory``, which reports the peak of these samples.
+
+    The stats are the disk read and write rates of the process tree, the network receive and send rates of the host
+    in bytes per second since the previous step and the pinned memory held by the CUDA host allocator. Uses psutil if
+    installed (unless ``use_psutil=False``) and reads ``/proc`` otherwise (Linux only).
+    """
+
+    def __init__(self, prefix: str = "host", use_psutil: Optional[bool] = None) -> None:
+        self.stat_names = tuple(
+            f"{prefix}/{name}"
+            for name in (
+                "disk_read_bytes_per_sec",
+                "disk_write_bytes_per_sec",
+                "net_recv_bytes_per_sec",
+                "net_sent_bytes_per_sec",
+                "pinned_memory_bytes",
+            )
+        )
+        self._max_memory = 0.0
+        self._last_cpu_times: Optional[Tuple[float, float]] = None
+        self._last_counters: Optional[Tuple[float, List[float]]] = None
+        self._use_psutil = bool(_PSUTIL_AVAILABLE) if use_psutil is None else use_psutil
+        if self._use_psutil:
+            import psutil
+
+            self._process = psutil.Process()
+
+    def utilization(self) -> float:
+        if self._use_psutil:
+            import psutil
+
+            utilization = psutil.cpu_percent(interval=None)
+        else:
+            utilization = self._proc_cpu_percent()
+        return utilization
+
+    def memory(self) -> float:
+        if self._use_psutil:
+            rss = 0.0
+            for process in self._process_tree():
+                try:
+                    rss += process.memory_info().rss
+                except Exception:  # the process exited in the meantime
+                    pass
+        else:
+            page_size = os.sysconf("SC_PAGE_SIZE")
+            rss = sum(float(_read_proc(f"/proc/{pid}/statm", "0 0").split()[1]) * page_size for pid in _proc_tree())
+        self._max_memory = max(self._max_memory, rss)
+        return rss
+
+    def max_memory(self) -> float:
+        max_memory = max(self._max_memory, self.memory())
+        self._max_memory = 0.0
+        return max_memory
+
+    def stats(self) -> List[float]:
+        # walking the process tree is too expensive for every hook, so the memory is only sampled once per step
+        self.memory()
+        now = time.perf_counter()
+        counters = self._io_counters()
+        rates = [0.0] * len(counters)
+        if self._last_counters is not None:
+            last_time, last_counters = self._last_counters
+            elapsed = max(now - last_time, 1e-9)
+            rates = [max(value - last, 0.0) / elapsed for value, last in zip(counters, last_counters)]
+        self._last_counters = (now, counters)
+        return [*rates, _pinned_memory()]
+
+    def _process_tree(self) -> List[Any]:
+        return [self._process, *self._process.children(recursive=True)]
+
+    def _io_counters(self) -> List[float]:
+        """Cumulative disk read and write bytes of the process tree and network bytes received and sent."""
+        disk_read = disk_write = 0.0
+        if self._use_psutil:
+            import psutil
+
+            for process in self._process_tree():
+                try:
+                    io = process.io_counters()
+                except Exception:  # the process exited in the meantime or the platform does not support it
+                    continue
+                disk_read += io.read_bytes
+                disk_write += io.write_bytes
+            net = psutil.net_io_counters()
+            return [disk_read, disk_write, float(net.bytes_recv), float(net.bytes_sent)]
+
+        for pid in _proc_tree():
+            io = dict(line.split(": ") for line in _read_proc(f"/proc/{pid}/io").splitlines() if ": " in line)
+            disk_read += float(io.get("read_bytes", 0))
+            disk_write += float(io.get("write_bytes", 0))
+        net_recv = net_sent = 0.0
+        for line in _read_proc("/proc/net/dev").splitlines()[2:]:
+            interface, values = line.split(":", 1)
+            if interface.strip() != "lo":
+                fields = values.split()
+                net_recv += float(fields[0])
+                net_sent += float(fields[8])
+        return [disk_read, disk_write, net_recv, net_sent]
+
+    def _proc_cpu_percent(self) -> float:
+        """CPU utilization of the host since the previous call from ``/proc/stat``."""
+        fields = [float(value) for value in _read_proc("/proc/stat", "cpu 0 0 0 0").splitlines()[0].split()[1:]]
+        # idle and iowait
+        idle, total = sum(fields[3:5]), sum(fields)
+        last_idle, last_total = self._last_cpu_times or (idle, total)
+        self._last_cpu_times = (idle, total)
+        if total <= last_total:
+            return 0.0
+        return 100.0 * (1.0 - (idle - last_idle) / (total - last_total))
+
+
+def _read_proc(path: str, default: str = "") -> str:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return default
+
+
+def _proc_tree(pid: int = 0) -> List[int]:
+    """The current process and all its descendants from ``/proc/<pid>/task/<tid>/children``."""
+    pid = pid or os.getpid()
+    pids = [pid]
+    for child in _read_proc(f"/proc/{pid}/task/{pid}/children").split():
+        pids.extend(_proc_tree(int(child)))
+    return pids
+
+
+def _pinned_memory() -> float:
+    """Bytes of pinned host memory held by the CUDA host allocator (torch >= 2.6)."""
+    if not (torch.cuda.is_available() and hasattr(torch.cuda, "host_memory_stats")):
+        return 0.0
+    return float(torch.cuda.host_memory_stats().get("allocated_bytes.current", 0))
+
+
+class FakeSensorBackend(SensorBackend):
+    """Backend returning given values, e.g. for testing. Every value is either a constant or a callable."""
+
+    def __init__(
+        self,
+        utilization: Union[float, Callable[[], float]] = 0.0,
+        memory: Union[float, Callable[[], float]] = 0.0,
+        stats: Optional[Mapping[str, Union[float, Callable[[], float]]]] = None,
+    ) -> None:
+        self._utilization = utilization
+        self._memory = memory
+        self._stats: Dict[str, Union[float, Callable[[], float]]] = dict(stats or {})
+        self.stat_names = tuple(self._stats)
+
+    @staticmethod
+    def _value(value: Union[float, Callable[[], float]]) -> float:
+        return float(value() if callable(value) else value)
+
+    def utilization(self) -> float:
+        return self._value(self._utilization)
+
+    def memory(self) -> float:
+        return self._value(self._memory)
+
+    def max_memory(self) -> float:
+        return self.memory()
+
+    def stats(self) -> List[float]:
+        return [self._value(value) for value in self._stats.values()]
@@ -1,15 +1,29 @@
-import operator
+import math
+import re
 import warnings
 from collections import defaultdict, deque
 from functools import partial
-from typing import Any, cast, Mapping, Optional
+from typing import Any, cast, Dict, List, Mapping, Optional, Tuple, Union
 
 import lightning
 import torch
-from lightning_utilities.core.imports import compare_version
-
+from lightning.pytorch.utilities.rank_zero import rank_zero_warn
+
+from lit_llms.callbacks.forecast import GPU_HOUR_PRICES, price_for_device, TimeToTrainForecaster, write_report
+from lit_llms.callbacks.loss_curve import LossCurveFitter
+from lit_llms.callbacks.monitoring import GPUMonitoringCallback
+from lit_llms.callbacks.steady_state_detectors import (
+    CVDetector,
+    MannKendallDetector,
+    MultiSignalDetector,
+    PageHinkleyDetector,
+    SlopeDetector,
+    SteadyStateDetector,
+)
 from lit_llms.callbacks.steady_state_utils import calc_total_time_per_node, chinchilla_metric_samples, is_steady_state
 
+_DETECTOR_MODES = ("slope", "mann_kendall", "page_hinkley", "cv")
+
 
 class SteadyStateDetection(lightning.pytorch.callbacks.model_summary.ModelSummary):
     """Detects steady state in model training.
@@ -28,6 +42,72 @@ class SteadyStateDetection(lightning.pytorch.callbacks.model_summary.ModelSummar
     Depending on the arguments specified to this callback other metrics might
     be required as well. These metrics are provided by
     :class:`lit_llms.callbacks.monitoring.GPUMonitoringCallback`.
+
+    Besides ``iter_speed`` and ``utilization``, which require all values of the
+    last ``moving_average_window`` steps to be within ``rtol``/``atol`` of
+    their mean, ``steady_state_det_mode`` selects a statistical detector of
+    :mod:`lit_llms.callbacks.steady_state_detectors` for the time per
+    iteration, with a window of ``moving_average_window`` steps:
+
+    - ``slope``: the drift of a least squares line is within ``rtol``
+    - ``mann_kendall``: the Mann-Kendall test finds no monotonic trend
+    - ``page_hinkley``: no shift of the mean by more than ``rtol`` for a window
+    - ``cv``: the coefficient of variation is at most ``rtol``
+
+    A :class:`~lit_llms.callbacks.steady_state_detectors.SteadyStateDetector`
+    can be passed as well. The confidence of the detector is logged as
+    ``steady_state_confidence``.
+
+    The ``multi_signal`` mode requires several signals to be steady together,
+    by default the time per iteration, the utilization and peak memory of
+    every rank and the samples per second of
+    :class:`~lit_llms.callbacks.throughput.ThroughputCallback`.
+    ``signal_tolerances`` maps the metric names of the signals to their
+    ``rtol``, where ``{rank}`` in a name is replaced by every rank. All signals
+    of all ranks are tested at once by a
+    :class:`~lit_llms.callbacks.steady_state_detectors.MultiSignalDetector`,
+    and ``signal_policy`` decides whether ``all``, ``any`` or a
+    ``signal_quorum`` fraction of the signals which are logged at all need to
+    be steady.
+
+    With a ``target_loss``, the remaining time is also forecast from the
+    distribution of the time per iteration since steady state by a
+    :class:`~lit_llms.callbacks.forecast.TimeToTrainForecaster`, adding the
+    validation and checkpoint overhead per step measured by the monitoring
+    callback over ``overhead_average`` steps (which should span the validation
+    and checkpoint interval) or, until that window is filled, over the largest
+    filled window. The p10/p50/p90 wall clock hours, GPU hours and,
+    with ``price_per_gpu_hour`` or a device of ``price_table``, costs are
+    logged as ``<forecast_logname>/<name>`` and written as JSON to
+    ``forecast_report_path`` if given.
+
+    With ``fit_loss_curve``, the loss logged as ``loss_logname`` is fit by a
+    power law learning curve with an irreducible loss by a
+    :class:`~lit_llms.callbacks.loss_curve.LossCurveFitter`, and the remaining
+    steps are the ones until the curve reaches ``target_loss``. Its parameters
+    and target step are logged as ``<forecast_logname>/loss_curve_<name>``.
+    The losses before ``loss_curve_min_step`` (e.g. of the warmup) are
+    ignored, and the curve is only fit from ``loss_curve_min_samples`` losses
+    with the exponents on a log-spaced grid of ``loss_curve_num_exponents``
+    between ``loss_curve_min_exponent`` and ``loss_curve_max_exponent``.
+    Until enough losses are fit, or if the target is not above the irreducible
+    loss of the curve, the remaining steps come from the Chinchilla fit of the
+    loss for ``num_params`` parameters.
+
+    The metrics are only evaluated every ``evaluate_every_n_steps`` steps and
+    only if the monitoring callback logged them again since the previous
+    evaluation (e.g. with its ``log_every_n_steps > 1``),
+    with a single device to host copy of all values read by rank 0, which then
+    shares its decision with one ``broadcast``. Once steady state is achieved
+    and training is not going to be stopped (or has been stopped), the
+    callback does not communicate anymore. With a ``target_loss`` and
+    ``forecast_every_n_steps``, rank 0 then still copies the time per
+    iteration, the loss and the overhead to the host every
+    ``forecast_every_n_steps`` steps without waiting for the copy, so that the
+    learning curve keeps being fit and the ``<forecast_logname>/<name>``
+    forecast is refined with them at the next refinement while training
+    continues. The report of the refined forecast is written at the end of
+    training.
     """
 
     def __init__(
@@ -37,15 +117,39 @@ class SteadyStateDetection(lightning.pytorch.callbacks.model_summary.ModelSummar
         num_params: Optional[int] = None,
         rtol: float = 0.015,
         atol: Optional[float] = None,
-        steady_state_det_mode: str = "iter_speed",
+        steady_state_det_mode: Union[str, SteadyStateDetector] = "iter_speed",
         average: Optional[float] = None,
         moving_average_window: int = 10,
         stop_on_steady_state: bool = True,
         steady_state_steps_before_stop: int = 10,
         gpu_util_logname: str = "gpu_stats/utilization",
         time_per_batch_logname: str = "time/seconds_per_iter",
+        evaluate_every_n_steps: int = 1,
+        signal_tolerances: Optional[Mapping[str, float]] = None,
+        signal_policy: str = "all",
+        signal_quorum: float = 0.5,
+        price_per_gpu_hour: Optional[float] = None,
+        price_table: Mapping[str, float] = GPU_HOUR_PRICES,
+        forecast_report_path: Optional[str] = None,
+        overhead_time_logname: str = "time/overhead",
+        overhead_average: int = 100,
+        forecast_logname: str = "forecast",
+        fit_loss_curve: bool = True,
+        loss_logname: str = "train_loss",
+        loss_curve_min_samples: int = 50,
+        loss_curve_min_step: int = 1,
+        loss_curve_min_exponent: float = 0.01,
+        loss_curve_max_exponent: float = 2.0,
+        loss_curve_num_exponents: int = 100,
+        forecast_every_n_steps: Optional[int] = None,
     ):
         super().__init__()
+        if evaluate_every_n_steps < 1:
+            raise ValueError(f"evaluate_every_n_steps must be at least 1, got {evaluate_every_n_steps}")
+        if forecast_every_n_steps is not None and forecast_every_n_steps < 1:
+            raise ValueError(f"forecast_every_n_steps must be at least 1, got {forecast_every_n_steps}")
+        if signal_policy not in MultiSignalDetector.policies:
+            raise ValueError(f"signal_policy must be one of {MultiSignalDetector.policies}, got {signal_policy}")
 
         self.target_loss = target_loss
         self.batch_size = batch_size
@@ -63,8 +167,74 @@ class SteadyStateDetection(lightning.pytorch.callbacks.model_summary.ModelSummar
         self.steady_state_stepped = 0
         self.gpu_util_logname = gpu_util_logname
         self.time_per_batch_logname = time_per_batch_logname
-
-        if steady_state_det_mode == "utilization":
+        self.evaluate_every_n_steps = evaluate_every_n_steps
+        self._num_steps = 0
+        # whether the decision cannot change anymore
+        self._finished = False
+        # the keys of the metrics read per evaluation and their index in the history of the current world size
+        self._history_keys: List[Tuple[int, str]] = []
+        self._history_world_size = -1
+        # the monitoring callback of the trainer and its number of log events at the last read of the metrics
+        self._monitoring: Optional[GPUMonitoringCallback] = None
+        self._num_log_events = 0
+
+        if signal_tolerances is None:
+            postfix = self._average_postfix(average)
+            signal_tolerances = {
+                time_per_batch_logname + postfix: rtol,
+                f"{gpu_util_logname}_rank{{rank}}{postfix}": rtol,
+                "gpu_stats/max_memory_rank{rank}": rtol,
+                "throughput/samples_per_sec": rtol,
+            }
+        self.signal_tolerances = dict(signal_tolerances)
+        self.signal_policy = signal_policy
+        self.signal_quorum = signal_quorum
+        self.moving_average_window = moving_average_window
+        # created once the world size is known
+        self.multi_signal_detector: Optional[MultiSignalDetector] = None
+
+        self.forecaster = TimeToTrainForecaster()
+        self.price_per_gpu_hour = price_per_gpu_hour
+        self.price_table = price_table
+        self.forecast_report_path = forecast_report_path
+        self.overhead_time_logname = overhead_time_logname
+        self.overhead_average = overhead_average
+        self.forecast_logname = forecast_logname
+        self._price_resolved = price_per_gpu_hour is not None
+
+        self.fit_loss_curve = fit_loss_curve
+        self.loss_logname = loss_logname
+        self.loss_curve = LossCurveFitter(
+            min_exponent=loss_curve_min_exponent,
+            max_exponent=loss_curve_max_exponent,
+            num_exponents=loss_curve_num_exponents,
+            min_samples=loss_curve_min_samples,
+            min_step=loss_curve_min_step,
+        )
+        self.forecast_every_n_steps = forecast_every_n_steps
+        # the forecast values copied to the host at the previous refinement after steady state: the forecast keys, the
+        # overhead kinds, the host values, the event of the copy on GPUs and the global step
+        self._pending_values: Optional[Tuple[List[str], List[str], torch.Tensor, Any, int]] = None
+        # the forecast and report info of the last refinement, written at the end of training
+        self._pending_report: Optional[Tuple[Dict[str, float], Dict[str, Any]]] = None
+        self._warned_unreachable_target = False
+        self._warned_no_overhead = False
+
+        self.detector: Optional[SteadyStateDetector] = None
+        if isinstance(steady_state_det_mode, SteadyStateDetector):
+            self.detector = steady_state_det_mode
+        elif steady_state_det_mode == "slope":
+            self.detector = SlopeDetector(moving_average_window, max_drift=rtol)
+        elif steady_state_det_mode == "mann_kendall":
+            self.detector = MannKendallDetector(moving_average_window)
+        elif steady_state_det_mode == "page_hinkley":
+            self.detector = PageHinkleyDetector(moving_average_window, delta=rtol / 2)
+        elif steady_state_det_mode == "cv":
+            self.detector = CVDetector(moving_average_window, max_cv=rtol)
+
+        if self.detector is not None:
+            self._steady_state_func = self._is_steady_state_detector
+        elif steady_state_det_mode == "utilization":
             warnings.warn(
                 "Cuda utilization as a proxy metric for steady state may not be optimal. "
                 "The actual parameters can differ a lot depending on the cluster configuration and backend "
@@ -73,9 +243,12 @@ class SteadyStateDetection(lightning.pytorch.callbacks.model_summary.ModelSummar
             self._steady_state_func = self._is_steady_state_utilization
         elif steady_state_det_mode == "iter_speed":
             self._steady_state_func = self._is_steady_state_iteration_speed
+        elif steady_state_det_mode == "multi_signal":
+            self._steady_state_func = self._is_steady_state_multi_signal
         else:
             raise ValueError(
-                f"steady_state_det_mode must be either 'utilization' or 'iter_speed', not {steady_state_det_mode}"
+                "steady_state_det_mode must be either 'utilization', 'iter_speed', 'multi_signal', one of "
+                f"{_DETECTOR_MODES} or a SteadyStateDetector, not {steady_state_det_mode}"
             )
 
     @property
@@ -85,6 +258,9 @@ class SteadyStateDetection(lightning.pytorch.callbacks.model_summary.ModelSummar
 
         return chinchilla_metric_samples(cast(float, self.target_loss), self.num_params)
 
+    def on_fit_start(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        self._monitoring = next((cb for cb in trainer.callbacks if isinstance(cb, GPUMonitoringCallback)), None)
+
     def on_train_batch_start(
         self,
         trainer: lightning.pytorch.Trainer,
@@ -111,77 +287,356 @@ class SteadyStateDetection(lightning.pytorch.callbacks.model_summary.ModelSummar
         if self.steady_state_achieved:
             self.steady_state_stepped += 1
 
-        metrics = trainer.callback_metrics
+        self._num_steps += 1
+        if self._finished:
+            # while training continues, rank 0 keeps refining the forecast at a lower cadence without communicating
+            if (
+                self.forecast_every_n_steps is not None
+                and self.target_loss is not None
+                and trainer.is_global_zero
+                and not trainer.should_stop
+                and self._num_steps % self.forecast_every_n_steps == 0
+                and self._has_new_metrics()
+            ):
+                self._refine_forecast(trainer, pl_module)
+            return
+        if self._num_steps % self.evaluate_every_n_steps or not self._has_new_metrics():
+            return
 
-        if trainer.is_global_zero and not self.steady_state_achieved:
-            for i in range(trainer.world_size):
-                metric_name_cuda = f"{self.gpu_util_logname}_rank{i}" + self._average_postfix(self.average)
+        should_stop = False
+        # only rank 0 decides as this is the only one that has the metrics
+        if trainer.is_global_zero:
+            metrics = trainer.callback_metrics
+            if not self.steady_state_achieved:
+                self._update_history(metrics, trainer.world_size, trainer.global_step)
+                self.steady_state_achieved = self._steady_state_func()
+                # only the step times of the steady window and after are used for the forecast
+                self.forecaster.truncate(self.moving_average_window)
+            else:
+                self._read_forecast_values(metrics, trainer.global_step)
+            if self.steady_state_achieved:
+                should_stop = self._on_steady_state(trainer, pl_module, metrics)
+
+        self.steady_state_achieved, should_stop = trainer.strategy.broadcast(
+            (self.steady_state_achieved, should_stop), src=0
+        )
+        if should_stop:
+            trainer.should_stop = True
+        self._finished = should_stop or (self.steady_state_achieved and not self.stop_on_steady_state)
 
-                if metric_name_cuda in trainer.callback_metrics:
-                    self.gpu_metrics[i].append(trainer.callback_metrics[metric_name_cuda].detach().cpu())
+        pl_module.log(
+            "steady_state_achieved",
+            torch.tensor(int(self.steady_state_achieved), dtype=torch.float),
+            sync_dist=False,
+            rank_zero_only=True,
+        )
+        confidence = self._confidence()
+        if confidence is not None:
+            pl_module.log(
+                "steady_state_confidence",
+                torch.tensor(confidence, dtype=torch.float),
+                sync_dist=False,
+                rank_zero_only=True,
+            )
 
-            metric_name_speed = self.time_per_batch_logname + self._average_postfix(self.average)
-            if metric_name_speed in trainer.callback_metrics:
-                self.iteration_speeds.append(trainer.callback_metrics[metric_name_speed].detach().cpu())
+    def _has_new_metrics(self) -> bool:
+        """Whether the monitoring callback logged its metrics since they were last read.
+
+        Between its log events, ``trainer.callback_metrics`` keeps the previous values, which would fill the history
+        with copies of the same value. The number of log events is the same on all ranks.
+        """
+        if self._monitoring is None:
+            return True
+        if self._monitoring.num_log_events == self._num_log_events:
+            return False
+        self._num_log_events = self._monitoring.num_log_events
+        return True
+
+    def _update_history(self, metrics: Dict[str, Any], world_size: int, global_step: int) -> None:
+        """Appends the latest values of the metrics to the history."""
+        present = [(index, metrics[key]) for index, key in self._get_history_keys(world_size) if key in metrics]
+        tensors = [torch.as_tensor(value) for _, value in present]
+        # the step time and loss of the forecast
+        forecast_keys = self._get_forecast_keys(metrics)
+        tensors.extend(torch.as_tensor(metrics[key]) for key in forecast_keys)
+        if not tensors:
+            return
+        # a single device to host copy for all values
+        values = torch.stack(tensors).detach().double().cpu()
+        if forecast_keys:
+            self._update_forecast(forecast_keys, values[len(present):].tolist(), global_step)
+            values = values[: len(present)]
+        if not present:
+            return
+
+        if self.steady_state_det_mode == "multi_signal":
+            if self.multi_signal_detector is None or self.multi_signal_detector.num_ranks != world_size:
+                self.multi_signal_detector = MultiSignalDetector(
+                    list(self.signal_tolerances.values()),
+                    world_size,
+                    window=self.moving_average_window,
+                    policy=self.signal_policy,
+                    quorum=self.signal_quorum,
+                )
+            signal_values = torch.full((len(self.signal_tolerances) * world_size,), math.nan, dtype=torch.float64)
+            signal_values[torch.tensor([index for index, _ in present])] = values
+            self.multi_signal_detector.update(signal_values.view(len(self.signal_tolerances), world_size))
+        elif self.steady_state_det_mode == "utilization":
+            for (i, _), value in zip(present, values.tolist()):
+                self.gpu_metrics[i].append(value)
+        else:
+            speed = values.item()
+            self.iteration_speeds.append(speed)
+            if self.detector is not None:
+                self.detector.update(speed)
+
+    def _get_history_keys(self, world_size: int) -> List[Tuple[int, str]]:
+        if world_size == self._history_world_size:
+            return self._history_keys
+
+        postfix = self._average_postfix(self.average)
+        if self.steady_state_det_mode == "multi_signal":
+            keys: List[Tuple[int, str]] = []
+            for s, name in enumerate(self.signal_tolerances):
+                if "{rank}" in name:
+                    keys.extend((s * world_size + i, name.format(rank=i)) for i in range(world_size))
+                else:
+                    keys.append((s * world_size, name))
+        elif self.steady_state_det_mode == "utilization":
+            keys = [(i, f"{self.gpu_util_logname}_rank{i}{postfix}") for i in range(world_size)]
+        else:
+            keys = [(0, self.time_per_batch_logname + postfix)]
+        self._history_keys, self._history_world_size = keys, world_size
+        return keys
+
+    def _get_forecast_keys(self, metrics: Dict[str, Any]) -> List[str]:
+        """The keys of the metrics read for the forecast."""
+        if self.target_loss is None:
+            return []
+        keys = [self.time_per_batch_logname]
+        if self.fit_loss_curve:
+            keys.append(self.loss_logname)
+        return [key for key in keys if key in metrics]
+
+    def _read_forecast_values(self, metrics: Dict[str, Any], global_step: int) -> None:
+        """Adds the latest step time and loss to the forecast with a single device to host copy."""
+        forecast_keys = self._get_forecast_keys(metrics)
+        if forecast_keys:
+            values = torch.stack([torch.as_tensor(metrics[key]) for key in forecast_keys]).double().cpu()
+            self._update_forecast(forecast_keys, values.tolist(), global_step)
+
+    def _update_forecast(self, keys: List[str], values: List[float], global_step: int) -> None:
+        for key, value in zip(keys, values):
+            if key == self.time_per_batch_logname:
+                self.forecaster.update(value)
+            else:
+                self.loss_curve.update(global_step, value)
+
+    def _confidence(self) -> Optional[float]:
+        if self.detector is not None:
+            return self.detector.confidence
+        if self.multi_signal_detector is not None:
+            return self.multi_signal_detector.confidence
+        return None
+
+    def _on_steady_state(
+        self,
+        trainer: lightning.pytorch.Trainer,
+        pl_module: lightning.pytorch.LightningModule,
+        metrics: Dict[str, Any],
+    ) -> bool:
+        """Logs the estimated total time and returns whether to stop training."""
+        speed_per_batch_averaged = metrics[self.time_per_batch_logname + self._average_postfix(10)]
+        # reflect current number of batches
 
-            self.steady_state_achieved = self._steady_state_func()
+        stop_message = "Stopping training due to steady state achieved! "
 
-        should_stop = False
-        # only rank 0 can enter this
-        if self.steady_state_achieved:
-            speed_per_batch_averaged = metrics[self.time_per_batch_logname + self._average_postfix(10)]
-            # reflect current number of batches
+        if self.target_loss is not None:
+            batch_size = cast(int, self.batch_size)
+            remaining_steps = self._remaining_steps(trainer, pl_module)
+            remaining_samples = math.ceil(remaining_steps * batch_size * trainer.world_size)
+            tpn = calc_total_time_per_node(remaining_samples, trainer.world_size, batch_size, speed_per_batch_averaged)
 
-            stop_message = "Stopping training due to steady state achieved! "
+            pl_module.log("estimated_total_time", tpn, sync_dist=False, rank_zero_only=True)
+            self._forecast(trainer, pl_module, self._overhead_per_step(metrics), remaining_steps)
 
-            if self.target_loss is not None:
-                tpn = calc_total_time_per_node(
-                    self.num_samples_required - trainer.global_step * self.batch_size * trainer.world_size,
-                    trainer.world_size,
-                    self.batch_size,
-                    speed_per_batch_averaged,
-                )
+            stop_message += f"Estimated total time: {float(tpn):.2f} hours!"
 
-                pl_module.log("estimated_total_time", tpn, sync_dist=False, rank_zero_only=True)
+        if not (self.stop_on_steady_state and self.steady_state_stepped >= self.steady_state_steps_before_stop):
+            return False
 
-                stop_message += f"Estimated total time: {float(tpn):.2f} hours!"
+        stop_message += (
+            f"Training on {trainer.num_nodes} nodes with a total of "
+            f"{trainer.world_size} parallel training processes! "
+            f"Speed / Batch (bs={self.batch_size}): {speed_per_batch_averaged} seconds. "
+        )
 
-            stop_message += (
-                f"Training on {trainer.num_nodes} nodes with a total of "
-                f"{trainer.world_size} parallel training processes! "
-                f"Speed / Batch (bs={self.batch_size}): {speed_per_batch_averaged} seconds. "
-                f"The GPU utilization is {metrics[self.gpu_util_logname + '_rank0' + self._average_postfix(10)]}% "
-                f"on average."
-            )
+        # the per-rank utilization is not logged if the monitoring callback aggregates the ranks
+        utilization_key = self.gpu_util_logname + "_rank0" + self._average_postfix(10)
+        if utilization_key not in metrics:
+            utilization_key = self.gpu_util_logname + self._average_postfix(10) + "_mean"
+        if utilization_key in metrics:
+            stop_message += f"The GPU utilization is {metrics[utilization_key]}% on average."
 
-            memory_key = "gpu_stats/max_memory_rank0"
-            if memory_key in metrics:
-                stop_message += f"Maximally used GPU Memory: {metrics[memory_key]} GB"
+        memory_key = "gpu_stats/max_memory_rank0"
+        if memory_key in metrics:
+            stop_message += f"Maximally used GPU Memory: {metrics[memory_key]} GB"
 
-            if self.stop_on_steady_state and self.steady_state_stepped >= self.steady_state_steps_before_stop:
-                print(stop_message)
-                should_stop = True
+        print(stop_message)
+        return True
 
-        # only rank0 decides as this is the only one that has the metrics
-        stop_tensor = torch.tensor(should_stop, device=trainer.strategy.root_device)
+    def _refine_forecast(
+        self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule
+    ) -> None:
+        """Refines the forecast after steady state with the values copied to the host at the previous refinement and
+        starts copying the latest ones, so that rank 0 never waits for the device."""
+        if self._pending_values is not None:
+            forecast_keys, overhead_kinds, host_values, copied, global_step = self._pending_values
+            if copied is not None:
+                # the copy finished long ago
+                copied.synchronize()
+            values = host_values.tolist()
+            self._update_forecast(forecast_keys, values[: len(forecast_keys)], global_step)
+            overheads = dict(zip(overhead_kinds, values[len(forecast_keys):]))
+            self._forecast(trainer, pl_module, overheads, self._remaining_steps(trainer, pl_module), write=False)
 
-        trainer.strategy.broadcast(stop_tensor, src=0)
+        metrics = trainer.callback_metrics
+        forecast_keys = self._get_forecast_keys(metrics)
+        overhead_keys = self._overhead_keys(metrics)
+        keys = [*forecast_keys, *overhead_keys.values()]
+        self._pending_values = None
+        if keys:
+            device_values = torch.stack([torch.as_tensor(metrics[key]) for key in keys]).double()
+            copied = None
+            if device_values.is_cuda:
+                host_values = device_values.to("cpu", non_blocking=True)
+                copied = torch.cuda.Event()
+                copied.record()
+            else:
+                host_values = device_values
+            self._pending_values = (forecast_keys, list(overhead_keys), host_values, copied, trainer.global_step)
+
+    def on_train_end(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        # the report of the refined forecast is only written at the end to keep the file system out of training
+        if self._pending_report is not None and self.forecast_report_path is not None:
+            forecast, info = self._pending_report
+            write_report(self.forecast_report_path, forecast, **info)
+        self._pending_report = None
+
+    def _remaining_steps(
+        self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule
+    ) -> float:
+        """The steps until the target loss, from the fitted learning curve if available or else from Chinchilla."""
+        target_loss = cast(float, self.target_loss)
+        curve = self.loss_curve.fit() if self.fit_loss_curve else None
+        if curve is not None:
+            target_step = curve.steps_to_target(target_loss)
+            if math.isfinite(target_step):
+                pl_module.log_dict(
+                    {
+                        f"{self.forecast_logname}/loss_curve_{name}": value
+                        for name, value in (*curve._asdict().items(), ("target_step", target_step))
+                    },
+                    sync_dist=False,
+                    rank_zero_only=True,
+                )
+                return max(target_step - trainer.global_step, 0.0)
+            if not self._warned_unreachable_target:
+                self._warned_unreachable_target = True
+                rank_zero_warn(
+                    f"The target loss {target_loss} is not above the irreducible loss {curve.irreducible:.4f} of the "
+                    "fitted learning curve, falling back to the Chinchilla estimate of the remaining steps."
+                )
+        batch_size = cast(int, self.batch_size)
+        return (self.num_samples_required - trainer.global_step * batch_size * trainer.world_size) / (
+            batch_size * trainer.world_size
+        )
 
-        if compare_version("lightning", operator.ge, "1.9.0"):
-            global_should_stop = trainer.strategy.reduce_boolean_decision(should_stop, all=False)
-        else:
-            # backport of reduce_boolean_decision with all=False to lightning < 2.0.0
-            decision = torch.tensor(int(should_stop), device=trainer.strategy.root_device)
-            decision = trainer.strategy.reduce(decision, reduce_op="sum")
-            global_should_stop = bool(decision > 0)
-        trainer.should_stop = global_should_stop
+    def _forecast(
+        self,
+        trainer: lightning.pytorch.Trainer,
+        pl_module: lightning.pytorch.LightningModule,
+        overheads: Dict[str, float],
+        remaining_steps: float,
+        write: bool = True,
+    ) -> None:
+        """Logs the forecast of the remaining time and cost and writes the report, or keeps it for the end of training
+        without ``write``."""
+        if not self.forecaster.step_times:
+            return
+        if not self._price_resolved:
+            self._price_resolved = True
+            self.price_per_gpu_hour = price_for_device(trainer.strategy.root_device, self.price_table)
+            if self.price_per_gpu_hour is None:
+                rank_zero_warn(
+                    f"Unknown price per GPU hour for {trainer.strategy.root_device}, the cost will not be forecast. "
+                    "Please pass `price_per_gpu_hour` to the SteadyStateDetection."
+                )
 
-        pl_module.log(
-            "steady_state_achieved",
-            torch.tensor(int(self.steady_state_achieved), dtype=torch.float),
+        forecast = self.forecaster.forecast(
+            remaining_steps, trainer.world_size, sum(overheads.values()), self.price_per_gpu_hour
+        )
+        pl_module.log_dict(
+            {f"{self.forecast_logname}/{name}": value for name, value in forecast.items()},
             sync_dist=False,
             rank_zero_only=True,
         )
+        if self.forecast_report_path is None:
+            return
+        info = dict(
+            global_step=trainer.global_step,
+            world_size=trainer.world_size,
+            num_nodes=trainer.num_nodes,
+            batch_size=self.batch_size,
+            target_loss=self.target_loss,
+            overhead_seconds_per_step=overheads,
+            price_per_gpu_hour=self.price_per_gpu_hour,
+            num_step_time_samples=len(self.forecaster.step_times),
+            loss_curve=self._loss_curve_report(),
+        )
+        if write:
+            write_report(self.forecast_report_path, forecast, **info)
+        else:
+            self._pending_report = (forecast, info)
+
+    def _loss_curve_report(self) -> Optional[Dict[str, float]]:
+        curve = self.loss_curve.fit() if self.fit_loss_curve else None
+        if curve is None:
+            return None
+        return {**curve._asdict(), "target_step": curve.steps_to_target(cast(float, self.target_loss))}
+
+    def _overhead_per_step(self, metrics: Dict[str, Any]) -> Dict[str, float]:
+        """The validation and checkpoint overhead per step of rank 0 or the mean over the ranks."""
+        return {kind: float(metrics[key]) for kind, key in self._overhead_keys(metrics).items()}
+
+    def _overhead_keys(self, metrics: Dict[str, Any]) -> Dict[str, str]:
+        """The keys of the validation and checkpoint overhead per step of rank 0 or the mean over the ranks.
+
+        The monitoring callback logs an average only once its window is filled, so before ``overhead_average`` steps
+        the overhead averaged over the largest filled window is used instead.
+        """
+        overheads = {}
+        for kind in ("validation", "checkpoint"):
+            name = re.escape(f"{self.overhead_time_logname}_{kind}")
+            pattern = re.compile(rf"{name}(?:_rank0_averaged(\d+)|_averaged(\d+)_mean)")
+            windows: Dict[int, str] = {}
+            for key in metrics:
+                match = pattern.fullmatch(key)
+                if match is None:
+                    continue
+                window = int(match.group(1) or match.group(2))
+                # rank 0 takes precedence over the mean over the ranks
+                if match.group(1) is not None or window not in windows:
+                    windows[window] = key
+            if windows:
+                overheads[kind] = windows[self.overhead_average if self.overhead_average in windows else max(windows)]
+        if not overheads and not self._warned_no_overhead:
+            self._warned_no_overhead = True
+            rank_zero_warn(
+                f"No validation or checkpoint overhead has been logged as `{self.overhead_time_logname}_*`, the "
+                "forecast does not include it. Please add a GPUMonitoringCallback with averages to the trainer."
+            )
+        return overheads
 
     def _is_steady_state_utilization(self) -> bool:
         steady_states = []
@@ -198,6 +653,13 @@ class SteadyStateDetection(lightning.pytorch.callbacks.model_summary.ModelSummar
             return is_steady_state(*self.iteration_speeds, rtol=self.rtol, atol=self.atol)
         return False
 
+    def _is_steady_state_multi_signal(self) -> bool:
+        return self.multi_signal_detector is not None and self.multi_signal_detector.steady
+
+    def _is_steady_state_detector(self) -> bool:
+        assert self.detector is not None
+        return self.detector.steady
+
     @staticmethod
     def _average_postfix(average: Optional[float] = None) -> str:
         if average is None:
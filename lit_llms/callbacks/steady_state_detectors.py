@@ -0,0 +1,352 @@
+import math
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from typing import Deque, List, Optional, Sequence, Tuple
+
+import torch
+
+
+def _normal_cdf(x: float) -> float:
+    return 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+
+
+class SteadyStateDetector(ABC):
+    """Decides from the stream of values of one signal, e.g. the time per iteration, whether it is in steady state.
+
+    ``update`` adds the value of the current step to the incremental state of the detector, ``confidence`` is its
+    confidence in [0, 1] that the signal is steady and ``steady`` its decision.
+    """
+
+    @abstractmethod
+    def update(self, value: float) -> None:
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def confidence(self) -> float:
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def steady(self) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def reset(self) -> None:
+        raise NotImplementedError
+
+
+class SlopeDetector(SteadyStateDetector):
+    """Least squares line through the last ``window`` values.
+
+    The confidence is the probability (normal approximation) that the drift of the line over the window lies within
+    ``max_drift`` of the mean given the standard error of its slope, and the signal is steady once the confidence
+    reaches ``min_confidence``. The sums of the regression are updated in O(1) when a value enters or leaves the window
+    and recomputed from the window every ``window`` updates to bound the rounding error.
+    """
+
+    def __init__(self, window: int = 10, max_drift: float = 0.015, min_confidence: float = 0.95) -> None:
+        if window < 3:
+            raise ValueError(f"window must be at least 3, got {window}")
+        self.window = window
+        self.max_drift = max_drift
+        self.min_confidence = min_confidence
+        self.reset()
+
+    def reset(self) -> None:
+        self._values: Deque[float] = deque(maxlen=self.window)
+        # sums of the values, of the values weighted by their position in the window and of the squared values
+        self._sum = 0.0
+        self._weighted_sum = 0.0
+        self._sum_squares = 0.0
+        self._num_updates = 0
+
+    def update(self, value: float) -> None:
+        value = float(value)
+        position = len(self._values)
+        if position == self.window:
+            oldest = self._values[0]
+            # the remaining values move one position to the front
+            self._weighted_sum -= self._sum - oldest
+            self._sum -= oldest
+            self._sum_squares -= oldest * oldest
+            position -= 1
+        self._values.append(value)
+        self._sum += value
+        self._weighted_sum += position * value
+        self._sum_squares += value * value
+
+        self._num_updates += 1
+        if self._num_updates % self.window == 0:
+            self._sum = sum(self._values)
+            self._weighted_sum = sum(i * v for i, v in enumerate(self._values))
+            self._sum_squares = sum(v * v for v in self._values)
+
+    @property
+    def slope(self) -> float:
+        n = len(self._values)
+        if n < 2:
+            return 0.0
+        return (self._weighted_sum - (n - 1) / 2 * self._sum) / (n * (n * n - 1) / 12)
+
+    @property
+    def confidence(self) -> float:
+        n = len(self._values)
+        if n < self.window:
+            return 0.0
+        sxx = n * (n * n - 1) / 12
+        sxy = self._weighted_sum - (n - 1) / 2 * self._sum
+        syy = max(self._sum_squares - self._sum * self._sum / n, 0.0)
+        slope = sxy / sxx
+        standard_error = math.sqrt(max(syy - sxy * sxy / sxx, 0.0) / (n - 2) / sxx)
+        bound = self.max_drift * abs(self._sum / n) / (n - 1)
+        if standard_error == 0:
+            return float(abs(slope) <= bound)
+        return max(_normal_cdf((bound - slope) / standard_error) - _normal_cdf((-bound - slope) / standard_error), 0.0)
+
+    @property
+    def steady(self) -> bool:
+        return len(self._values) == self.window and self.confidence >= self.min_confidence
+
+
+class MannKendallDetector(SteadyStateDetector):
+    """Mann-Kendall test for a monotonic trend in the last ``window`` values.
+
+    The confidence is the two-sided p-value of the test (without tie correction) and the signal is steady if there is
+    no trend at the significance level ``alpha``. The score over all pairs of the window is kept exactly: a new value
+    is compared against a sorted copy of the window with two binary searches, but inserting into and removing from the
+    sorted copy moves O(window) elements, so unlike the other detectors an update is not O(1).
+    """
+
+    def __init__(self, window: int = 10, alpha: float = 0.05) -> None:
+        if window < 3:
+            raise ValueError(f"window must be at least 3, got {window}")
+        self.window = window
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self) -> None:
+        self._values: Deque[float] = deque()
+        self._sorted: List[float] = []
+        self.score = 0
+
+    def update(self, value: float) -> None:
+        value = float(value)
+        if len(self._values) == self.window:
+            oldest = self._values.popleft()
+            del self._sorted[bisect_left(self._sorted, oldest)]
+            # the pairs of the oldest value with all later values
+            self.score -= (len(self._sorted) - bisect_right(self._sorted, oldest)) - bisect_left(self._sorted, oldest)
+        # the pairs of all earlier values with the new value
+        self.score += bisect_left(self._sorted, value) - (len(self._sorted) - bisect_right(self._sorted, value))
+        insort(self._sorted, value)
+        self._values.append(value)
+
+    @property
+    def confidence(self) -> float:
+        n = len(self._values)
+        if n < self.window:
+            return 0.0
+        if self.score == 0:
+            return 1.0
+        variance = n * (n - 1) * (2 * n + 5) / 18
+        z = (abs(self.score) - 1) / math.sqrt(variance)
+        return 2 * (1 - _normal_cdf(z))
+
+    @property
+    def steady(self) -> bool:
+        return len(self._values) == self.window and self.confidence >= self.alpha
+
+
+class PageHinkleyDetector(SteadyStateDetector):
+    """Two-sided Page-Hinkley (CUSUM) test for a shift of the mean.
+
+    The cumulative sums of the deviations from the running mean, relative to the mean and reduced by the allowed
+    magnitude ``delta``, raise a change once they exceed ``threshold`` above their minimum (increase) or below their
+    maximum (decrease). A change restarts the test from the current value and the signal is steady after ``window``
+    values without a change. By default, a persistent shift by ``2 * delta`` is detected within ``window`` values. The
+    confidence is the fraction of the window seen since the last change times the margin of both sums to the threshold.
+    """
+
+    def __init__(self, window: int = 10, delta: float = 0.0075, threshold: Optional[float] = None) -> None:
+        if window < 1:
+            raise ValueError(f"window must be at least 1, got {window}")
+        self.window = window
+        self.delta = delta
+        self.threshold = delta * window if threshold is None else threshold
+        self.reset()
+
+    def reset(self) -> None:
+        self.num_changes = 0
+        self._restart()
+
+    def _restart(self) -> None:
+        """Clears the test, but not the number of changes."""
+        self._count = 0
+        self._mean = 0.0
+        self._sum_up = self._min_up = 0.0
+        self._sum_down = self._max_down = 0.0
+
+    def update(self, value: float) -> None:
+        value = float(value)
+        self._accumulate(value)
+        if self._statistic > self.threshold:
+            self.num_changes += 1
+            # restart the test from the current value
+            self._restart()
+            self._accumulate(value)
+
+    def _accumulate(self, value: float) -> None:
+        self._count += 1
+        self._mean += (value - self._mean) / self._count
+        deviation = (value - self._mean) / abs(self._mean) if self._mean else 0.0
+        self._sum_up += deviation - self.delta
+        self._min_up = min(self._min_up, self._sum_up)
+        self._sum_down += deviation + self.delta
+        self._max_down = max(self._max_down, self._sum_down)
+
+    @property
+    def _statistic(self) -> float:
+        return max(self._sum_up - self._min_up, self._max_down - self._sum_down)
+
+    @property
+    def confidence(self) -> float:
+        margin = 1.0 - self._statistic / self.threshold if self.threshold > 0 else 0.0
+        return min(self._count / self.window, 1.0) * max(margin, 0.0)
+
+    @property
+    def steady(self) -> bool:
+        return self._count >= self.window
+
+
+class CVDetector(SteadyStateDetector):
+    """Coefficient of variation (standard deviation over mean) of the last ``window`` values.
+
+    The confidence is the probability (normal approximation of the sampling distribution of the coefficient of
+    variation) that it is at most ``max_cv`` and the signal is steady once the confidence reaches ``min_confidence``.
+    The sums are updated in O(1) and recomputed from the window every ``window`` updates.
+    """
+
+    def __init__(self, window: int = 10, max_cv: float = 0.015, min_confidence: float = 0.95) -> None:
+        if window < 2:
+            raise ValueError(f"window must be at least 2, got {window}")
+        self.window = window
+        self.max_cv = max_cv
+        self.min_confidence = min_confidence
+        self.reset()
+
+    def reset(self) -> None:
+        self._values: Deque[float] = deque(maxlen=self.window)
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._num_updates = 0
+
+    def update(self, value: float) -> None:
+        value = float(value)
+        if len(self._values) == self.window:
+            oldest = self._values[0]
+            self._sum -= oldest
+            self._sum_squares -= oldest * oldest
+        self._values.append(value)
+        self._sum += value
+        self._sum_squares += value * value
+
+        self._num_updates += 1
+        if self._num_updates % self.window == 0:
+            self._sum = sum(self._values)
+            self._sum_squares = sum(v * v for v in self._values)
+
+    @property
+    def cv(self) -> float:
+        n = len(self._values)
+        mean = self._sum / n if n else 0.0
+        if n < 2 or mean == 0:
+            return math.inf
+        variance = max(self._sum_squares - self._sum * mean, 0.0) / (n - 1)
+        return math.sqrt(variance) / abs(mean)
+
+    @property
+    def confidence(self) -> float:
+        n = len(self._values)
+        if n < self.window:
+            return 0.0
+        cv = self.cv
+        if math.isinf(cv):
+            return 0.0
+        standard_error = cv * math.sqrt((1 + 2 * cv * cv) / (2 * n))
+        if standard_error == 0:
+            return float(cv <= self.max_cv)
+        return _normal_cdf((self.max_cv - cv) / standard_error)
+
+    @property
+    def steady(self) -> bool:
+        return len(self._values) == self.window and self.confidence >= self.min_confidence
+
+
+class MultiSignalDetector:
+    """Tolerance test of several signals of all ranks in one vectorized pass.
+
+    The last ``window`` values are kept in a ``[signals, ranks, window]`` ring buffer, with NaN for the ranks not
+    reporting a signal (e.g. only rank 0 for global signals). A signal is steady on a rank if all values of the window
+    are within the ``rtol`` of the signal of their mean, and steady if it is steady on every rank reporting it. The
+    signals which are reported at all are combined by ``policy``: ``all`` or ``any`` of them, or a ``quorum`` fraction
+    of them need to be steady. The confidence is the fraction of steady signals.
+    """
+
+    policies = ("all", "any", "quorum")
+
+    def __init__(
+        self, rtols: Sequence[float], num_ranks: int, window: int = 10, policy: str = "all", quorum: float = 0.5
+    ) -> None:
+        if policy not in self.policies:
+            raise ValueError(f"policy must be one of {self.policies}, got {policy}")
+        if window < 1:
+            raise ValueError(f"window must be at least 1, got {window}")
+        self.rtols = torch.tensor(rtols, dtype=torch.float64)
+        self.num_ranks = num_ranks
+        self.window = window
+        self.policy = policy
+        self.quorum = quorum
+        self.reset()
+
+    def reset(self) -> None:
+        self._values = torch.full((len(self.rtols), self.num_ranks, self.window), math.nan, dtype=torch.float64)
+        self._num_updates = 0
+
+    def update(self, values: torch.Tensor) -> None:
+        """Adds the ``[signals, ranks]`` values of the current step."""
+        self._values[:, :, self._num_updates % self.window] = values
+        self._num_updates += 1
+
+    def steady_signals(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Whether every signal is steady and whether it is reported by any rank."""
+        missing = torch.isnan(self._values)
+        reported = ~missing.all(-1)
+        mean = self._values.mean(-1)
+        tolerance = self.rtols[:, None] * mean.abs()
+        within = (
+            ~missing.any(-1) & (self._values.amax(-1) - mean <= tolerance) & (mean - self._values.amin(-1) <= tolerance)
+        )
+        active = reported.any(-1)
+        return (within | ~reported).all(-1) & active, active
+
+    def _counts(self) -> Tuple[int, int]:
+        steady, active = self.steady_signals()
+        return int(steady.sum()), int(active.sum())
+
+    @property
+    def confidence(self) -> float:
+        num_steady, num_active = self._counts()
+        return num_steady / num_active if num_active else 0.0
+
+    @property
+    def steady(self) -> bool:
+        num_steady, num_active = self._counts()
+        if num_active == 0:
+            return False
+        if self.policy == "all":
+            return num_steady == num_active
+        if self.policy == "any":
+            return num_steady > 0
+        return num_steady >= self.quorum * num_active
@@ -0,0 +1,108 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import torch
+
+
+class StepTimer(ABC):
+    """Records the timestamps of named marks within every training step.
+
+    ``next_step`` closes the current step and ``durations`` returns the durations between pairs of marks of the most
+    recent closed step whose timestamps are available.
+    """
+
+    @abstractmethod
+    def record(self, mark: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def next_step(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def durations(self, phases: Sequence[Tuple[str, str]]) -> Optional[List[float]]:
+        """Durations in seconds from the start to the end mark of every phase.
+
+        Phases with a missing mark (e.g. the optimizer step of a step accumulating gradients) take no time. Returns
+        ``None`` if no step with recorded marks is available yet.
+        """
+        raise NotImplementedError
+
+
+class PerfCounterTimer(StepTimer):
+    """Host timestamps from :func:`time.perf_counter`, available as soon as the step is closed."""
+
+    def __init__(self) -> None:
+        self._current: Dict[str, float] = {}
+        self._closed: Dict[str, float] = {}
+
+    def record(self, mark: str) -> None:
+        self._current[mark] = time.perf_counter()
+
+    def next_step(self) -> None:
+        self._current, self._closed = {}, self._current
+
+    def durations(self, phases: Sequence[Tuple[str, str]]) -> Optional[List[float]]:
+        if not self._closed:
+            return None
+        return [
+            self._closed[end] - self._closed[start] if start in self._closed and end in self._closed else 0.0
+            for start, end in phases
+        ]
+
+
+class CUDAEventTimer(StepTimer):
+    """Device timestamps from CUDA events recorded on the current stream.
+
+    The events of a step only complete once the device executed its kernels. To never block the host on the step that
+    was just enqueued, ``durations`` reports the step closed before the most recent one, whose events have usually
+    completed already. The events are allocated once per mark and reused.
+    """
+
+    # number of closed steps to lag behind
+    lag = 1
+
+    def __init__(self, device: Optional[torch.device] = None) -> None:
+        self.device = device
+        # one set of events per step in flight, used round robin
+        self._events: List[Dict[str, torch.cuda.Event]] = [{} for _ in range(self.lag + 2)]
+        self._recorded: List[Set[str]] = [set() for _ in range(self.lag + 2)]
+        self._current = 0
+        self._num_closed = 0
+
+    def record(self, mark: str) -> None:
+        events = self._events[self._current]
+        if mark not in events:
+            events[mark] = torch.cuda.Event(enable_timing=True)
+        events[mark].record(torch.cuda.current_stream(self.device))
+        self._recorded[self._current].add(mark)
+
+    def next_step(self) -> None:
+        self._current = (self._current + 1) % len(self._events)
+        self._recorded[self._current] = set()
+        self._num_closed += 1
+
+    def durations(self, phases: Sequence[Tuple[str, str]]) -> Optional[List[float]]:
+        if self._num_closed <= self.lag:
+            return None
+        index = (self._current - 1 - self.lag) % len(self._events)
+        events, recorded = self._events[index], self._recorded[index]
+        if not recorded:
+            return None
+
+        durations = []
+        for start, end in phases:
+            if start in recorded and end in recorded:
+                events[end].synchronize()
+                durations.append(events[start].elapsed_time(events[end]) / 1000)  # ms to s
+            else:
+                durations.append(0.0)
+        return durations
+
+
+def step_timer_for_device(device: torch.device) -> StepTimer:
+    """CUDA events on GPUs and ``perf_counter`` otherwise."""
+    if device.type == "cuda":
+        return CUDAEventTimer(device)
+    return PerfCounterTimer()
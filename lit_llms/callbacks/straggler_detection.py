@@ -0,0 +1,35 @@
+from typing import NamedTuple, Tuple
+
+import torch
+
+# scales the MAD to the standard deviation of normally distributed values
+_MAD_TO_STD = 1.4826
+
+
+class Straggler(NamedTuple):
+    rank: int
+    # name of the timing the rank is slow in
+    signal: str
+    # timing of the rank relative to the median over all ranks
+    slowdown: float
+    # robust z-score of the timing of the rank
+    score: float
+
+
+def robust_outliers(
+    values: torch.Tensor, threshold: float = 3.5, min_slowdown: float = 1.05
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Finds the ranks with too high values along the last dimension using the median absolute deviation (MAD).
+
+    A rank is an outlier if its robust z-score ``(value - median) / (1.4826 * MAD)`` exceeds ``threshold`` and its value
+    is at least ``min_slowdown`` times the median. The second condition keeps tiny but consistent differences from
+    being flagged if almost all ranks have the same value and the MAD is close to zero.
+
+    Returns the outlier mask, the slowdowns (value / median) and the scores, all of the shape of ``values``.
+    """
+    median = values.median(-1, keepdim=True).values
+    mad = (values - median).abs().median(-1, keepdim=True).values
+    eps = torch.finfo(values.dtype).eps
+    scores = (values - median) / (_MAD_TO_STD * mad).clamp(min=eps * median.abs().clamp(min=1.0))
+    slowdowns = values / median.clamp(min=eps)
+    return (scores > threshold) & (slowdowns >= min_slowdown), slowdowns, scores
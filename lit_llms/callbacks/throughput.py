@@ -0,0 +1,152 @@
+import re
+from typing import Any, Dict, Mapping, Optional
+
+import lightning
+import torch
+from lightning.pytorch.utilities.rank_zero import rank_zero_warn
+
+from lit_llms.callbacks.monitoring import GPUMonitoringCallback
+
+# dense bf16/fp16 tensor core peak FLOPs per device, matched against the lowercase CUDA device name
+PEAK_FLOPS: Dict[str, float] = {
+    "h100 pcie": 756e12,
+    "h100": 989e12,
+    "a100": 312e12,
+    "l40s": 362e12,
+    "l40": 181e12,
+    "a10": 125e12,
+    "l4": 121e12,
+    "v100": 125e12,
+    "t4": 65e12,
+}
+
+
+def lookup_device(device: torch.device, table: Mapping[str, float]) -> Optional[float]:
+    """Value of the longest entry of ``table`` contained in the CUDA device name, ``None`` if there is none.
+
+    An entry only matches whole words of the name, so that e.g. ``l4`` does not match an L40.
+    """
+    if device.type != "cuda":
+        return None
+    name = torch.cuda.get_device_name(device).lower()
+    matches = [key for key in table if re.search(rf"(?<![a-z0-9]){re.escape(key)}(?![a-z0-9])", name)]
+    if not matches:
+        return None
+    return table[max(matches, key=len)]
+
+
+def peak_flops_for_device(device: torch.device, table: Mapping[str, float] = PEAK_FLOPS) -> Optional[float]:
+    """Peak FLOPs of the longest entry of ``table`` contained in the device name, ``None`` if there is none."""
+    return lookup_device(device, table)
+
+
+def extract_seq_len(batch: Any) -> Optional[int]:
+    """Size of the second dimension of the first tensor in the batch with at least two dimensions."""
+    if isinstance(batch, torch.Tensor):
+        return batch.size(1) if batch.dim() >= 2 else None
+    if isinstance(batch, Mapping):
+        batch = list(batch.values())
+    if isinstance(batch, (list, tuple)):
+        for value in batch:
+            seq_len = extract_seq_len(value)
+            if seq_len is not None:
+                return seq_len
+    return None
+
+
+class ThroughputCallback(lightning.pytorch.callbacks.Callback):
+    """Logs the global throughput in samples and tokens per second and the model FLOPs utilization (MFU).
+
+    The time per batch is taken from ``trainer.callback_metrics`` as provided by
+    :class:`lit_llms.callbacks.monitoring.GPUMonitoringCallback`, so no additional collectives are needed. With the
+    monitoring callback in the trainer, the throughput is only logged when it logged a new time per batch. The batch
+    size per process and the sequence length are inferred from the first batch and the number of trainable parameters
+    from the model at the start of fitting unless given.
+
+    The MFU counts ``6 * num_params`` FLOPs per token for the forward and backward pass (ignoring the attention) and
+    relates them to the peak FLOPs of all devices. The peak FLOPs per device are either given as ``peak_flops`` or
+    looked up by the CUDA device name in ``peak_flops_table``. If neither is available, the MFU is not logged.
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        seq_len: Optional[int] = None,
+        num_params: Optional[int] = None,
+        peak_flops: Optional[float] = None,
+        peak_flops_table: Mapping[str, float] = PEAK_FLOPS,
+        time_per_batch_logname: str = "time/seconds_per_iter",
+        samples_per_sec_logname: str = "throughput/samples_per_sec",
+        tokens_per_sec_logname: str = "throughput/tokens_per_sec",
+        mfu_logname: str = "throughput/mfu",
+    ):
+        super().__init__()
+        self.batch_size = batch_size
+        self.seq_len = seq_len
+        self.num_params = num_params
+        self.peak_flops = peak_flops
+        self.peak_flops_table = peak_flops_table
+        self.time_per_batch_logname = time_per_batch_logname
+        self.samples_per_sec_logname = samples_per_sec_logname
+        self.tokens_per_sec_logname = tokens_per_sec_logname
+        self.mfu_logname = mfu_logname
+        # the monitoring callback of the trainer and its number of log events when the throughput was last logged
+        self._monitoring: Optional[GPUMonitoringCallback] = None
+        self._num_log_events = 0
+
+    def on_fit_start(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        self._monitoring = next((cb for cb in trainer.callbacks if isinstance(cb, GPUMonitoringCallback)), None)
+        # the parameters of sharded models are only available once the strategy has been set up
+        if self.num_params is None:
+            self.num_params = self._count_trainable_parameters(pl_module)
+
+    @staticmethod
+    def _count_trainable_parameters(pl_module: lightning.pytorch.LightningModule) -> int:
+        # DeepSpeed ZeRO-3 keeps the full size of its partitioned parameters in ``ds_numel``
+        return sum(getattr(p, "ds_numel", p.numel()) for p in pl_module.parameters() if p.requires_grad)
+
+    def on_train_start(self, trainer: lightning.pytorch.Trainer, pl_module: lightning.pytorch.LightningModule) -> None:
+        if self.peak_flops is None:
+            self.peak_flops = peak_flops_for_device(trainer.strategy.root_device, self.peak_flops_table)
+            if self.peak_flops is None:
+                rank_zero_warn(
+                    f"Unknown peak FLOPs for {trainer.strategy.root_device}, the MFU will not be logged. "
+                    "Please pass `peak_flops` to the ThroughputCallback."
+                )
+
+    @torch.no_grad()
+    def on_train_batch_end(
+        self,
+        trainer: lightning.pytorch.Trainer,
+        pl_module: lightning.pytorch.LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        if self.batch_size is None:
+            self.batch_size = lightning.pytorch.utilities.data.extract_batch_size(batch)
+        if self.seq_len is None:
+            self.seq_len = extract_seq_len(batch)
+        if self.num_params is None:
+            self.num_params = self._count_trainable_parameters(pl_module)
+
+        time_per_batch = trainer.callback_metrics.get(self.time_per_batch_logname)
+        if time_per_batch is None:
+            return
+        if self._monitoring is not None:
+            # the time per batch was not logged again since the previous step
+            if self._monitoring.num_log_events == self._num_log_events:
+                return
+            self._num_log_events = self._monitoring.num_log_events
+
+        samples_per_sec = self.batch_size * trainer.world_size / time_per_batch
+        metrics = {self.samples_per_sec_logname: samples_per_sec}
+        if self.seq_len is not None:
+            tokens_per_sec = samples_per_sec * self.seq_len
+            metrics[self.tokens_per_sec_logname] = tokens_per_sec
+            if self.peak_flops is not None and self.num_params:
+                metrics[self.mfu_logname] = (
+                    6 * self.num_params * tokens_per_sec / (self.peak_flops * trainer.world_size)
+                )
+
+        pl_module.log_dict(metrics, sync_dist=False, on_step=True, on_epoch=False, rank_zero_only=True)
@@ -0,0 +1,164 @@
+import concurrent.futures
+import json
+import os
+from array import array
+from typing import Any, Dict, List, Optional, Sequence
+
+import fsspec
+
+
+class TraceWriter:
+    """Records named spans of the current rank into a bounded ring buffer and periodically dumps them as Chrome trace
+    JSON, which can be opened with Perfetto (https://ui.perfetto.dev) or ``chrome://tracing``.
+
+    Recording a span only writes into preallocated arrays. Every ``dump_every_n_steps`` steps the buffer is copied and
+    serialized by a background thread to ``<dirpath>/trace_rank<rank>.json``, overwriting the previous dump, so the
+    file always holds the most recent ``capacity`` spans. Every rank is one process track (``pid``) and every ``track``
+    one thread within it. The timestamps are wall clock times, so the files of all ranks can be combined with
+    :func:`merge_traces` to compare the ranks on one timeline.
+    """
+
+    def __init__(
+        self,
+        dirpath: str,
+        capacity: int = 65536,
+        dump_every_n_steps: int = 1000,
+        track_names: Sequence[str] = ("step", "collective", "overhead"),
+    ) -> None:
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        if dump_every_n_steps < 1:
+            raise ValueError(f"dump_every_n_steps must be at least 1, got {dump_every_n_steps}")
+        self.dirpath = dirpath
+        self.capacity = capacity
+        self.dump_every_n_steps = dump_every_n_steps
+        self.track_names = tuple(track_names)
+        self.rank = 0
+
+        self._names: List[str] = []
+        self._name_ids: Dict[str, int] = {}
+        self._name_buffer = array("i", [0] * capacity)
+        self._track_buffer = array("b", [0] * capacity)
+        self._starts = array("d", [0.0] * capacity)
+        self._ends = array("d", [0.0] * capacity)
+        self._num_spans = 0
+        self._num_steps = 0
+
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._dump_future: Optional[concurrent.futures.Future] = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.dirpath, f"trace_rank{self.rank}.json")
+
+    def add_span(self, name: str, start: float, end: float, track: int = 0) -> None:
+        """Records a span between two :func:`time.time` timestamps."""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        index = self._num_spans % self.capacity
+        self._name_buffer[index] = name_id
+        self._track_buffer[index] = track
+        self._starts[index] = start
+        self._ends[index] = end
+        self._num_spans += 1
+
+    def step(self) -> None:
+        """Counts a training step and dumps the buffer every ``dump_every_n_steps`` steps."""
+        self._num_steps += 1
+        if self._num_steps % self.dump_every_n_steps == 0:
+            self.dump()
+
+    def dump(self, blocking: bool = False) -> None:
+        """Copies the buffer and writes it from a background thread.
+
+        The dump is skipped if the previous one is still being written.
+        """
+        if self._dump_future is not None and not self._dump_future.done():
+            if not blocking:
+                return
+            self._dump_future.result()
+
+        # copies of the buffers in the order of recording, which the background thread can read while the buffers keep
+        # being written to
+        if self._num_spans <= self.capacity:
+            oldest, num_spans = 0, self._num_spans
+        else:
+            oldest, num_spans = self._num_spans % self.capacity, self.capacity
+
+        def in_order(buffer: Any) -> Any:
+            return (buffer[oldest:] + buffer[:oldest])[:num_spans]
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="TraceWriter")
+        self._dump_future = self._executor.submit(
+            self._write,
+            self.path,
+            self.rank,
+            self.track_names,
+            list(self._names),
+            in_order(self._name_buffer),
+            in_order(self._track_buffer),
+            in_order(self._starts),
+            in_order(self._ends),
+        )
+        if blocking:
+            self._dump_future.result()
+
+    def close(self) -> None:
+        """Dumps all recorded spans and stops the background thread."""
+        if self._num_spans:
+            self.dump(blocking=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    @staticmethod
+    def _write(
+        path: str,
+        rank: int,
+        track_names: Sequence[str],
+        names: List[str],
+        name_ids: Sequence[int],
+        tracks: Sequence[int],
+        starts: Sequence[float],
+        ends: Sequence[float],
+    ) -> None:
+        events: List[Dict[str, Any]] = [
+            {"name": "process_name", "ph": "M", "pid": rank, "args": {"name": f"rank {rank}"}}
+        ]
+        events.extend(
+            {"name": "thread_name", "ph": "M", "pid": rank, "tid": tid, "args": {"name": track_name}}
+            for tid, track_name in enumerate(track_names)
+        )
+        # complete events with timestamps and durations in microseconds
+        events.extend(
+            {
+                "name": names[name_id],
+                "ph": "X",
+                "pid": rank,
+                "tid": track,
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+            }
+            for name_id, track, start, end in zip(name_ids, tracks, starts, ends)
+        )
+
+        fs, _ = fsspec.core.url_to_fs(path)
+        fs.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that readers never see a partial trace
+        tmp_path = f"{path}.tmp"
+        with fs.open(tmp_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        fs.mv(tmp_path, path)
+
+
+def merge_traces(paths: Sequence[str], output_path: str) -> None:
+    """Combines the Chrome traces of several ranks into a single file with one process track per rank."""
+    events = []
+    for path in paths:
+        with fsspec.open(path, "r") as f:
+            events.extend(json.load(f)["traceEvents"])
+    with fsspec.open(output_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,82 @@
+import threading
+from array import array
+from typing import Callable, Optional, Tuple
+
+# returns the current utilization in percent and the current memory usage in bytes
+Sensor = Callable[[], Tuple[float, float]]
+
+
+class UtilizationSampler:
+    """Polls a sensor at a fixed rate from a daemon thread.
+
+    The samples are written into preallocated ring buffers by the sampling thread only, which publishes them by
+    incrementing a counter afterwards. Readers therefore never need a lock: they only consider samples below the
+    published counter and keep track of how far they have read.
+    """
+
+    def __init__(self, sensor: Sensor, interval: float = 0.1, capacity: int = 1024) -> None:
+        if interval <= 0:
+            raise ValueError(f"The sampling interval must be positive, got {interval}")
+
+        self.sensor = sensor
+        self.interval = interval
+        self.capacity = capacity
+
+        self._utilizations = array("d", [0.0] * capacity)
+        self._memories = array("d", [0.0] * capacity)
+        self._num_samples = 0
+        self._num_read = 0
+
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="UtilizationSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def sample(self) -> None:
+        """Take a single sample.
+
+        Must only be called from one thread at a time.
+        """
+        utilization, memory = self.sensor()
+        index = self._num_samples % self.capacity
+        self._utilizations[index] = utilization
+        self._memories[index] = memory
+        # publish the sample only after it was written
+        self._num_samples += 1
+
+    def read(self) -> Optional[Tuple[float, float]]:
+        """Mean utilization and peak memory of all samples taken since the last read.
+
+        Returns ``None`` if no new sample was taken. If the reader falls behind by more than ``capacity`` samples, only
+        the most recent ``capacity`` samples are considered.
+        """
+        num_samples = self._num_samples
+        start = max(self._num_read, num_samples - self.capacity)
+        self._num_read = num_samples
+        if start >= num_samples:
+            return None
+
+        indices = [i % self.capacity for i in range(start, num_samples)]
+        utilization = sum(self._utilizations[i] for i in indices) / len(indices)
+        memory = max(self._memories[i] for i in indices)
+        return utilization, memory
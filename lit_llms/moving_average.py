@@ -1,34 +1,227 @@
-from typing import Any, List
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import torch
 import torchmetrics
 
 
 class MovingAverage(torchmetrics.Metric):
-    # TODO: implement this with collections.deque once other iterables are allowed as state.
-    sliding_window: List[torch.Tensor]
-    current_average: torch.Tensor
+    """Average over the last ``window_size`` values.
 
-    def __init__(self, window_size: int, **kwargs: Any) -> None:
+    The values are kept in a preallocated ring buffer together with a running sum, so that both ``update`` and
+    ``compute`` are O(1) and do not allocate per step. To avoid accumulating floating point error in the running sum
+    it is recomputed from the buffer once every ``window_size`` updates.
+
+    If ``num_streams`` is given, ``num_streams`` independent averages are tracked in a single
+    ``[num_streams, window_size]`` buffer. ``update`` then expects a vector with one value per stream (e.g. the
+    all-gathered per-rank values) and ``compute`` returns all averages at once (squeezed by torchmetrics if
+    ``num_streams == 1``).
+
+    With ``sync_on_compute=True`` the running sums and counts of all ranks are packed into one tensor and summed with a
+    single ``all_reduce``, so ``compute`` returns the average over the windows of all ranks. The ring buffer itself
+    stays local to every rank and ``dist_sync_fn`` is not used.
+    """
+
+    # fixed-shape states which are summed across ranks on sync
+    _summed_states: Tuple[str, ...] = ("running_sum", "num_values")
+
+    sliding_window: torch.Tensor
+    running_sum: torch.Tensor
+    num_values: torch.Tensor
+    write_index: torch.Tensor
+
+    def __init__(self, window_size: int, num_streams: Optional[int] = None, **kwargs: Any) -> None:
         super().__init__(**kwargs)
 
-        self.add_state("sliding_window", [], persistent=True)
         self.window_size = window_size
+        self.num_streams = num_streams
+
+        self.add_state("sliding_window", self._empty_window(), persistent=True)
+        self.add_state("running_sum", torch.zeros(self._stream_shape), persistent=True)
+        self.add_state("num_values", torch.tensor(0, dtype=torch.long), persistent=True)
+        self.add_state("write_index", torch.tensor(0, dtype=torch.long), persistent=True)
+        self._updates_since_resum = 0
+
+    @property
+    def _stream_shape(self) -> Tuple[int, ...]:
+        return () if self.num_streams is None else (self.num_streams,)
+
+    def _empty_window(self, dtype: torch.dtype = torch.float) -> torch.Tensor:
+        return torch.zeros(*self._stream_shape, self.window_size, dtype=dtype)
+
+    def update(self, value: torch.Tensor) -> None:
+        value = value.detach().to(device=self.sliding_window.device, dtype=self.sliding_window.dtype)
+        value = value.reshape(*self._stream_shape, 1)
+
+        # swap the oldest value for the new one without leaving the device
+        self.running_sum += (value - self.sliding_window.index_select(-1, self.write_index.reshape(1))).reshape(
+            self._stream_shape
+        )
+        self._write(value)
+
+    def _write(self, value: torch.Tensor) -> None:
+        """Writes ``value`` of shape ``[*stream_shape, 1]`` to the ring buffer and advances it in place."""
+        self.sliding_window.index_copy_(self.sliding_window.dim() - 1, self.write_index.reshape(1), value)
+        self.write_index.add_(1).remainder_(self.window_size)
+        self.num_values.add_(1).clamp_(max=self.window_size)
+
+        self._updates_since_resum += 1
+        if self._updates_since_resum >= self.window_size:
+            self._resum()
+            self._updates_since_resum = 0
+
+    def _resum(self) -> None:
+        self.running_sum = self.sliding_window.sum(-1)
+
+    def compute(self) -> torch.Tensor:
+        if not self.num_values:
+            raise ZeroDivisionError("Cannot compute the moving average before any value was added")
+        return self.running_sum / self.num_values
+
+    def reset(self) -> None:
+        super().reset()
+        self._updates_since_resum = 0
+
+    def _sync_dist(self, dist_sync_fn: Optional[Callable] = None, process_group: Optional[Any] = None) -> None:
+        states = [getattr(self, name) for name in self._summed_states]
+        packed = torch.cat([state.reshape(-1).to(self.sliding_window.dtype) for state in states])
+        torch.distributed.all_reduce(packed, group=process_group or self.process_group)
+
+        for name, state, reduced in zip(self._summed_states, states, packed.split([state.numel() for state in states])):
+            setattr(self, name, reduced.reshape(state.shape).to(state.dtype))
+
+    def get_extra_state(self) -> Any:
+        return {"window_size": self.window_size, "num_streams": self.num_streams}
+
+    def set_extra_state(self, state: Any) -> None:
+        self.window_size = state["window_size"]
+        self.num_streams = state.get("num_streams")
+        # the buffers loaded from the state dict may have a different shape than the ones this metric was created with
+        self._defaults["sliding_window"] = self._empty_window(self.sliding_window.dtype)
+        self._defaults["running_sum"] = torch.zeros(self._stream_shape, dtype=self.running_sum.dtype)
+        self._updates_since_resum = 0
+
+    def _load_from_state_dict(self, state_dict: Dict[str, Any], prefix: str, *args: Any, **kwargs: Any) -> None:
+        window = state_dict.get(prefix + "sliding_window")
+        if isinstance(window, list):
+            self._load_list_window(state_dict.pop(prefix + "sliding_window"), state_dict.get(prefix + "_extra_state"))
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def _load_list_window(self, values: List[torch.Tensor], extra_state: Optional[Dict[str, Any]]) -> None:
+        """Converts the state of the former list based window, which only kept the last values and the window size,
+        by adding these values to an empty ring buffer."""
+        if not extra_state or "window_size" not in extra_state:
+            raise ValueError("Cannot load a list based moving average state without its window size")
+        if self.num_streams is not None or any(value.numel() != 1 for value in values):
+            raise ValueError(
+                "A list based moving average state of scalar values can only be loaded into a single stream "
+                f"MovingAverage, not one with num_streams={self.num_streams}"
+            )
+        self.set_extra_state({"window_size": extra_state["window_size"]})
+        self.reset()
+        for value in values[-self.window_size:]:
+            self.update(value)
+
+
+class MultiWindowMovingAverage(MovingAverage):
+    """Averages over several window sizes (and optionally exponential moving averages) of the same signal.
+
+    All windows share a single ring buffer sized to the largest window. Each window keeps its own running sum, which is
+    updated by adding the new value and subtracting the value that just left that window, so a single ``compute``
+    returns all averages at once: the windows in the order of ``window_sizes`` followed by the EMAs in the order of
+    ``ema_decays``, stacked along the first dimension. The running sum of :class:`MovingAverage` is not maintained.
+    """
+
+    _summed_states = ("num_values", "window_sums", "window_counts", "ema")
+
+    window_sums: torch.Tensor
+    window_counts: torch.Tensor
+    ema: torch.Tensor
+    num_updates: torch.Tensor
+    _window_lengths: torch.Tensor
+    _decays: torch.Tensor
+
+    def __init__(
+        self,
+        window_sizes: Sequence[int],
+        ema_decays: Sequence[float] = (),
+        num_streams: Optional[int] = None,
+        **kwargs: Any,
+    ) -> None:
+        if not window_sizes:
+            raise ValueError("At least one window size is required")
+
+        super().__init__(window_size=max(window_sizes), num_streams=num_streams, **kwargs)
+        self.window_sizes = tuple(window_sizes)
+        self.ema_decays = tuple(ema_decays)
+
+        self.register_buffer("_window_lengths", torch.tensor(self.window_sizes, dtype=torch.long), persistent=False)
+        self.register_buffer("_decays", torch.tensor(self.ema_decays, dtype=torch.float), persistent=False)
+        self.add_state("window_sums", self._empty_windows(), persistent=True)
+        self.add_state("window_counts", torch.zeros(len(self.window_sizes), dtype=torch.long), persistent=True)
+        self.add_state("ema", self._empty_emas(), persistent=True)
+        self.add_state("num_updates", torch.tensor(0, dtype=torch.long), persistent=True)
+
+    def _empty_windows(self, dtype: torch.dtype = torch.float) -> torch.Tensor:
+        return torch.zeros(len(self.window_sizes), *self._stream_shape, dtype=dtype)
+
+    def _empty_emas(self, dtype: torch.dtype = torch.float) -> torch.Tensor:
+        return torch.zeros(len(self.ema_decays), *self._stream_shape, dtype=dtype)
 
     def update(self, value: torch.Tensor) -> None:
-        self.sliding_window.append(value.detach())
+        value = value.detach().to(device=self.sliding_window.device, dtype=self.sliding_window.dtype)
+        value = value.reshape(*self._stream_shape, 1)
+
+        # slots that have not been written yet are zero, so this also holds while the windows fill up
+        leaving = self.sliding_window.index_select(-1, (self.write_index - self._window_lengths) % self.window_size)
+        self.window_sums += (value - leaving).movedim(-1, 0)
+        self.window_counts = torch.minimum(self.window_counts + 1, self._window_lengths)
+
+        decays = self._decays.reshape(-1, *(1 for _ in self._stream_shape))
+        self.ema.mul_(decays).add_((1 - decays) * value.reshape(self._stream_shape))
+        self.num_updates += 1
 
-        if len(self.sliding_window) > self.window_size:
-            self.sliding_window.pop(0)
+        self._write(value)
+
+    def _resum(self) -> None:
+        # age of every slot in the ring buffer, 0 being the value written last
+        slots = torch.arange(self.window_size, device=self.write_index.device)
+        ages = (self.write_index - 1 - slots) % self.window_size
+        mask = ages.unsqueeze(0) < self._window_lengths.unsqueeze(1)
+        self.window_sums = (self.sliding_window.unsqueeze(-2) * mask).sum(-1).movedim(-1, 0)
 
     def compute(self) -> torch.Tensor:
-        result = sum(self.sliding_window) / len(self.sliding_window)
-        if not isinstance(result, torch.Tensor):
-            result = torch.tensor(result, device=self.device, dtype=torch.float)
-        return result
+        if not self.num_values:
+            raise ZeroDivisionError("Cannot compute the moving average before any value was added")
+
+        shape = (-1, *(1 for _ in self._stream_shape))
+        window_averages = self.window_sums / self.window_counts.reshape(shape)
+        # bias correction for the zero initialization of the EMAs
+        emas = self.ema / (1 - self._decays**self.num_updates).reshape(shape)
+        return torch.cat([window_averages, emas])
+
+    def _sync_dist(self, dist_sync_fn: Optional[Callable] = None, process_group: Optional[Any] = None) -> None:
+        super()._sync_dist(dist_sync_fn, process_group)
+        # report the mean of the EMAs of all ranks
+        self.ema = self.ema / torch.distributed.get_world_size(process_group or self.process_group)
 
     def get_extra_state(self) -> Any:
-        return {"window_size": self.window_size}
+        return {
+            **super().get_extra_state(),
+            "window_sizes": list(self.window_sizes),
+            "ema_decays": list(self.ema_decays),
+        }
 
     def set_extra_state(self, state: Any) -> None:
-        self.window_size = state.pop("window_size")
+        self.window_sizes = tuple(state["window_sizes"])
+        self.ema_decays = tuple(state["ema_decays"])
+        super().set_extra_state(state)
+
+        device = self.sliding_window.device
+        self._window_lengths = torch.tensor(self.window_sizes, dtype=torch.long, device=device)
+        self._decays = torch.tensor(self.ema_decays, dtype=self._decays.dtype, device=device)
+        self._defaults["window_sums"] = self._empty_windows(self.window_sums.dtype)
+        self._defaults["window_counts"] = torch.zeros(len(self.window_sizes), dtype=torch.long)
+        self._defaults["ema"] = self._empty_emas(self.ema.dtype)
+
+    def _load_list_window(self, values: List[torch.Tensor], extra_state: Optional[Dict[str, Any]]) -> None:
+        raise ValueError("A list based moving average state cannot be loaded into a MultiWindowMovingAverage")
@@ -0,0 +1,99 @@
+import math
+from typing import Any, Optional, Sequence, Tuple
+
+import torch
+import torchmetrics
+
+
+class StreamingQuantile(torchmetrics.Metric):
+    """Constant memory estimate of quantiles over all values seen since the last reset.
+
+    The values are counted in logarithmically spaced buckets (as in DDSketch), so every returned quantile is within
+    ``relative_accuracy`` of the true quantile for values in ``[min_value, max_value]``. Values below ``min_value``
+    are counted as zero and values above ``max_value`` as ``max_value``. Since the state is just a histogram of counts,
+    sketches of different ranks are merged by summing them.
+
+    If ``num_streams`` is given, ``update`` expects one value per stream and ``compute`` returns the quantiles of every
+    stream. The result is stacked along the first dimension in the order of ``quantiles``.
+    """
+
+    full_state_update = False
+
+    counts: torch.Tensor
+
+    def __init__(
+        self,
+        quantiles: Sequence[float] = (0.5, 0.95, 0.99),
+        relative_accuracy: float = 0.01,
+        min_value: float = 1e-4,
+        max_value: float = 1e4,
+        num_streams: Optional[int] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        if not all(0 <= q <= 1 for q in quantiles):
+            raise ValueError(f"Quantiles must be within [0, 1], got {quantiles}")
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"relative_accuracy must be within (0, 1), got {relative_accuracy}")
+        if not 0 < min_value < max_value:
+            raise ValueError(f"Expected 0 < min_value < max_value, got {min_value} and {max_value}")
+
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.num_streams = num_streams
+
+        self._log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        # bucket 0 collects everything below min_value, bucket i covers (min_value * gamma^(i-1), min_value * gamma^i]
+        self.num_buckets = math.ceil(math.log(max_value / min_value) / self._log_gamma) + 1
+
+        self.add_state(
+            "counts", torch.zeros(*self._stream_shape, self.num_buckets), dist_reduce_fx="sum", persistent=True
+        )
+
+    @property
+    def _stream_shape(self) -> Tuple[int, ...]:
+        return () if self.num_streams is None else (self.num_streams,)
+
+    def update(self, value: torch.Tensor) -> None:
+        value = value.detach().to(device=self.counts.device, dtype=self.counts.dtype).reshape(*self._stream_shape, 1)
+        index = torch.ceil(torch.log(value.clamp(min=self.min_value) / self.min_value) / self._log_gamma)
+        index = torch.where(value < self.min_value, torch.zeros_like(index), index.clamp(1, self.num_buckets - 1))
+        self.counts.scatter_add_(-1, index.long(), torch.ones_like(value))
+
+    def compute(self) -> torch.Tensor:
+        cumulative_counts = self.counts.cumsum(-1)
+        total = cumulative_counts[..., -1:]
+        if not total.all():
+            raise ZeroDivisionError("Cannot compute quantiles before any value was added")
+
+        quantiles = torch.tensor(self.quantiles, device=self.counts.device, dtype=self.counts.dtype)
+        ranks = (quantiles * (total - 1)).contiguous()
+        index = torch.searchsorted(cumulative_counts.contiguous(), ranks, right=True)
+
+        # the representative value of a bucket has the same relative distance to both of its bounds
+        gamma = math.exp(self._log_gamma)
+        values = self.min_value * torch.exp(index.to(self.counts.dtype) * self._log_gamma) * 2 / (gamma + 1)
+        values = torch.where(index == 0, torch.zeros_like(values), values.clamp(max=self.max_value))
+        return values.movedim(-1, 0)
+
+    def get_extra_state(self) -> Any:
+        return {
+            "quantiles": list(self.quantiles),
+            "relative_accuracy": self.relative_accuracy,
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "num_streams": self.num_streams,
+        }
+
+    def set_extra_state(self, state: Any) -> None:
+        self.quantiles = tuple(state["quantiles"])
+        self.relative_accuracy = state["relative_accuracy"]
+        self.min_value = state["min_value"]
+        self.max_value = state["max_value"]
+        self.num_streams = state["num_streams"]
+
+        self._log_gamma = math.log((1 + self.relative_accuracy) / (1 - self.relative_accuracy))
+        self.num_buckets = self.counts.size(-1)
+        self._defaults["counts"] = torch.zeros(*self._stream_shape, self.num_buckets, dtype=self.counts.dtype)
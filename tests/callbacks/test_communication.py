@@ -0,0 +1,147 @@
+from unittest import mock
+
+import pytest
+import torch
+
+from lit_llms.callbacks import CommunicationMonitor
+from lit_llms.callbacks.communication import _union_length
+from tests.helpers import setup_ddp
+
+try:
+    from lightning.lite.utilities.distributed import _all_gather_ddp_if_available
+except ImportError:
+    from lightning.fabric.utilities.distributed import _all_gather_ddp_if_available
+
+
+def test_union_length():
+    assert _union_length([]) == 0.0
+    assert _union_length([(0.0, 1.0), (0.5, 2.0), (3.0, 4.0), (3.5, 3.75)]) == 3.0
+
+
+def _communication_monitor_ddp(rank, world_size):
+    setup_ddp(rank, world_size)
+    torch.manual_seed(rank)
+
+    # several buckets of about 1 MB
+    model = torch.nn.parallel.DistributedDataParallel(
+        torch.nn.Sequential(*(torch.nn.Linear(256, 256) for _ in range(4))), bucket_cap_mb=1
+    )
+    callback = CommunicationMonitor(every_n_steps=2)
+    callback.attach(model)
+
+    trainer = mock.MagicMock()
+    trainer.world_size = world_size
+    trainer.strategy.root_device = torch.device("cpu")
+    trainer.strategy.all_gather = mock.Mock(side_effect=_all_gather_ddp_if_available)
+    module = mock.MagicMock()
+
+    for batch_idx in range(4):
+        model(torch.randn(8, 256)).sum().backward()
+        callback.on_train_batch_end(trainer, module, None, None, batch_idx)
+    assert trainer.strategy.all_gather.call_count == 2
+
+    # the gradients are still averaged over the ranks
+    grads = [param.grad.clone() for param in model.parameters()]
+    for grad in grads:
+        gathered = _all_gather_ddp_if_available(grad)
+        assert torch.allclose(gathered[0], gathered[-1])
+
+    metrics = module.log_dict.call_args[0][0]
+    num_bytes = sum(param.numel() * param.element_size() for param in model.parameters())
+    for i in range(world_size):
+        assert metrics[f"comm/bytes_rank{i}"] == num_bytes
+        assert metrics[f"comm/time_rank{i}"] > 0
+        assert metrics[f"comm/bus_bandwidth_rank{i}"] > 0
+        assert 0 <= metrics[f"comm/overlap_rank{i}"] <= 1
+
+
+@pytest.mark.parametrize("world_size", [2, 3])
+def test_communication_monitor_ddp(world_size):
+    torch.multiprocessing.spawn(_communication_monitor_ddp, args=(world_size,), nprocs=world_size)
+
+
+def test_communication_monitor_without_ddp():
+    trainer = mock.MagicMock()
+    trainer.strategy.model = torch.nn.Linear(2, 2)
+    with pytest.warns(UserWarning, match="only measures the communication of DDP"):
+        CommunicationMonitor().on_fit_start(trainer, mock.MagicMock())
+
+
+def test_communication_monitor_without_communication():
+    trainer = mock.MagicMock()
+    trainer.world_size = 1
+    trainer.strategy.root_device = torch.device("cpu")
+    trainer.strategy.all_gather = lambda x: x.unsqueeze(0)
+    module = mock.MagicMock()
+    callback = CommunicationMonitor(every_n_steps=1)
+    callback.on_train_batch_end(trainer, module, None, None, 0)
+
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics == {
+        "comm/time_rank0": 0.0,
+        "comm/bytes_rank0": 0.0,
+        "comm/bus_bandwidth_rank0": 0.0,
+        "comm/overlap_rank0": 0.0,
+    }
+
+
+class _DeviceEvent:
+    """Stands in for a CUDA event, which is recorded at the next of the scripted device times in seconds."""
+
+    times: list = []
+    events: list = []
+
+    def __init__(self, enable_timing=False):
+        self.time = None
+        self.synchronized = False
+        _DeviceEvent.events.append(self)
+
+    def record(self, stream=None):
+        self.time = _DeviceEvent.times.pop(0)
+
+    def synchronize(self):
+        self.synchronized = True
+
+    def elapsed_time(self, end):
+        return (end.time - self.time) * 1000
+
+
+def _gpu_bucket(num_bytes):
+    bucket = mock.MagicMock()
+    bucket.buffer.return_value = mock.Mock(is_cuda=True, numel=lambda: num_bytes // 4, element_size=lambda: 4)
+    return bucket
+
+
+@mock.patch("torch.cuda.Event", _DeviceEvent)
+def test_communication_monitor_device_timing():
+    def enqueued_hook(state, bucket):
+        # like NCCL, the future completes as soon as the collective is enqueued
+        fut = torch.futures.Future()
+        fut.set_result(torch.zeros(1))
+        return fut
+
+    trainer = mock.MagicMock()
+    trainer.world_size = 1
+    trainer.strategy.root_device = torch.device("cpu")
+    trainer.strategy.all_gather = lambda x: x.unsqueeze(0)
+    module = mock.MagicMock()
+    callback = CommunicationMonitor(every_n_steps=2, comm_hook=enqueued_hook)
+    _DeviceEvent.events = []
+    # start and end of two buckets on the device in the first step and of one in the second
+    _DeviceEvent.times = [0.0, 0.3, 0.1, 0.5, 1.0, 1.2]
+
+    callback._timed_hook(None, _gpu_bucket(1024))
+    callback._timed_hook(None, _gpu_bucket(1024))
+    callback.on_train_batch_end(trainer, module, None, None, 0)
+    # the events are not read in the step which enqueued the collectives
+    assert not any(event.synchronized for event in _DeviceEvent.events)
+
+    callback._timed_hook(None, _gpu_bucket(2048))
+    callback.on_train_batch_end(trainer, module, None, None, 1)
+    assert [event.synchronized for event in _DeviceEvent.events] == [False, True, False, True, False, False]
+
+    # the device times of the first step, not the host time until the futures completed
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["comm/time_rank0"].item() == pytest.approx(0.5)
+    assert metrics["comm/bytes_rank0"].item() == 2048
+    assert metrics["comm/overlap_rank0"].item() == pytest.approx(1 - 0.4 / 0.5)
@@ -0,0 +1,77 @@
+import json
+from unittest import mock
+
+import pytest
+import torch
+
+from lit_llms.callbacks.forecast import GPU_HOUR_PRICES, price_for_device, TimeToTrainForecaster, write_report
+
+
+def test_forecaster_validation():
+    with pytest.raises(ValueError, match="max_samples must be at least 1"):
+        TimeToTrainForecaster(max_samples=0)
+    with pytest.raises(ValueError, match="quantiles must be in"):
+        TimeToTrainForecaster(quantiles=(0.0, 0.5))
+    with pytest.raises(ValueError, match="without any step times"):
+        TimeToTrainForecaster().forecast(100, num_gpus=1)
+
+
+def test_forecast_constant_step_time():
+    forecaster = TimeToTrainForecaster()
+    for _ in range(20):
+        forecaster.update(0.5)
+    forecast = forecaster.forecast(7200, num_gpus=8, overhead_per_step=0.25, price_per_gpu_hour=2.0)
+    # without any variance all quantiles are the expected time of 7200 * 0.75 seconds
+    for q in ("p10", "p50", "p90"):
+        assert forecast[f"hours_{q}"] == pytest.approx(1.5)
+        assert forecast[f"gpu_hours_{q}"] == pytest.approx(12.0)
+        assert forecast[f"cost_{q}"] == pytest.approx(24.0)
+    assert forecast["seconds_per_step"] == pytest.approx(0.5)
+    assert "cost_p50" not in forecaster.forecast(7200, num_gpus=8)
+
+
+def test_forecast_quantiles():
+    torch.manual_seed(0)
+    forecaster = TimeToTrainForecaster(quantiles=(0.1, 0.5, 0.9))
+    for step_time in 1 + 0.1 * torch.randn(500):
+        forecaster.update(step_time)
+    forecast = forecaster.forecast(36000, num_gpus=1)
+    assert forecast["hours_p10"] < forecast["hours_p50"] < forecast["hours_p90"]
+    assert forecast["hours_p50"] == pytest.approx(10 * forecast["seconds_per_step"])
+    # the spread comes from the uncertainty of the mean step time, which shrinks with more samples
+    assert forecast["hours_p90"] - forecast["hours_p10"] < 0.5
+
+
+def test_forecaster_standard_error_of_correlated_step_times():
+    independent = TimeToTrainForecaster()
+    correlated = TimeToTrainForecaster()
+    for i in range(200):
+        independent.update(1.0 + 0.1 * (-1) ** i)
+        # slow drifts of the step time over 50 steps
+        correlated.update(1.0 + 0.1 * (-1) ** (i // 50))
+    assert independent.standard_error() == pytest.approx(0.0)
+    assert correlated.standard_error() > 0.02
+
+
+def test_forecaster_truncate():
+    forecaster = TimeToTrainForecaster(max_samples=5)
+    for i in range(10):
+        forecaster.update(i)
+    assert list(forecaster.step_times) == [5, 6, 7, 8, 9]
+    forecaster.truncate(2)
+    assert list(forecaster.step_times) == [8, 9]
+
+
+def test_price_for_device():
+    with mock.patch("torch.cuda.get_device_name", lambda device: "NVIDIA A100-SXM4-80GB"):
+        assert price_for_device(torch.device("cuda", 0)) == GPU_HOUR_PRICES["a100"]
+        assert price_for_device(torch.device("cuda", 0), {"a100-sxm4": 1.0}) == 1.0
+    assert price_for_device(torch.device("cpu")) is None
+
+
+def test_write_report(tmp_path):
+    path = str(tmp_path / "reports" / "forecast.json")
+    write_report(path, {"hours_p50": 1.0}, world_size=8)
+    with open(path) as f:
+        assert json.load(f) == {"forecast": {"hours_p50": 1.0}, "world_size": 8}
+    assert not (tmp_path / "reports" / "forecast.json.tmp").exists()
@@ -0,0 +1,78 @@
+import math
+
+import pytest
+import torch
+
+from lit_llms.callbacks.loss_curve import LossCurve, LossCurveFitter
+
+
+def test_loss_curve_fitter_validation():
+    with pytest.raises(ValueError, match="Expected 0 < min_exponent < max_exponent"):
+        LossCurveFitter(min_exponent=1.0, max_exponent=0.5)
+    with pytest.raises(ValueError, match="num_exponents must be at least 2"):
+        LossCurveFitter(num_exponents=1)
+    with pytest.raises(ValueError, match="min_samples must be at least 3"):
+        LossCurveFitter(min_samples=2)
+
+
+def test_loss_curve():
+    curve = LossCurve(irreducible=2.0, scale=8.0, exponent=0.5, rmse=0.0, num_samples=10)
+    assert curve.loss_at(16) == pytest.approx(4.0)
+    assert curve.steps_to_target(4.0) == pytest.approx(16)
+    assert curve.steps_to_target(2.0) == math.inf
+
+
+def test_loss_curve_fitter_exact_curve():
+    fitter = LossCurveFitter(min_samples=10)
+    exponent = fitter.exponents[60].item()
+    for step in range(1, 200):
+        fitter.update(step, 2.0 + 8.0 * step**-exponent)
+    curve = fitter.fit()
+    assert curve.exponent == pytest.approx(exponent)
+    assert curve.irreducible == pytest.approx(2.0)
+    assert curve.scale == pytest.approx(8.0)
+    assert curve.rmse == pytest.approx(0.0, abs=1e-6)
+    assert curve.num_samples == 199
+    assert fitter.steps_to_target(2.0 + 8.0 * 5000**-exponent) == pytest.approx(5000)
+
+
+def test_loss_curve_fitter_noisy_curve():
+    torch.manual_seed(0)
+    fitter = LossCurveFitter()
+    steps = torch.arange(1, 2001, dtype=torch.float64)
+    losses = 1.8 + 6.0 * steps**-0.3 + 0.02 * torch.randn(len(steps), dtype=torch.float64)
+    for step, loss in zip(steps.tolist(), losses.tolist()):
+        fitter.update(int(step), loss)
+    curve = fitter.fit()
+    # the fitted exponent is on the grid of exponents
+    assert curve.exponent == pytest.approx(0.3, rel=0.1)
+    assert curve.rmse == pytest.approx(0.02, rel=0.2)
+    target_loss = 1.8 + 6.0 * 10000**-0.3
+    assert fitter.steps_to_target(target_loss) == pytest.approx(10000, rel=0.25)
+
+
+def test_loss_curve_fitter_skips_losses():
+    fitter = LossCurveFitter(min_samples=3, min_step=10)
+    for step in range(10):
+        fitter.update(step, 5.0)
+    fitter.update(10, math.nan)
+    assert fitter.num_samples == 0
+    assert fitter.fit() is None
+
+    for step in range(10, 12):
+        fitter.update(step, 10.0 / step)
+    assert fitter.steps_to_target(0.5) is None
+    fitter.update(12, 10.0 / 12)
+    assert fitter.fit() is not None
+
+    fitter.reset()
+    assert fitter.num_samples == 0
+    assert fitter.fit() is None
+
+
+def test_loss_curve_fitter_increasing_loss():
+    fitter = LossCurveFitter(min_samples=3)
+    for step in range(1, 10):
+        fitter.update(step, float(step))
+    # no curve decreasing with the steps fits
+    assert fitter.fit() is None
@@ -0,0 +1,70 @@
+from unittest import mock
+
+import pytest
+import torch
+
+from lit_llms.callbacks import MemoryStatsCallback
+
+FAKE_STATS = {
+    "allocated_bytes.all.current": 600,
+    "reserved_bytes.all.current": 1000,
+    "active_bytes.all.current": 700,
+    "inactive_split_bytes.all.current": 250,
+    "num_alloc_retries": 3,
+    "num_ooms": 1,
+}
+
+
+def _trainer(world_size):
+    trainer = mock.MagicMock()
+    trainer.world_size = world_size
+    trainer.strategy.root_device = torch.device("cpu")
+    # rank r reports r + 1 times the stats
+    trainer.strategy.all_gather = mock.Mock(side_effect=lambda x: torch.stack([x * (r + 1) for r in range(world_size)]))
+    return trainer, mock.MagicMock()
+
+
+def test_memory_stats_callback():
+    trainer, module = _trainer(world_size=2)
+    callback = MemoryStatsCallback(every_n_steps=3, stats_provider=lambda: FAKE_STATS)
+    callback.on_train_start(trainer, module)
+
+    for batch_idx in range(7):
+        callback.on_train_batch_end(trainer, module, None, None, batch_idx)
+    # only every third step
+    assert trainer.strategy.all_gather.call_count == 2
+    assert module.log_dict.call_count == 2
+
+    metrics = module.log_dict.call_args[0][0]
+    assert len(metrics) == 2 * 7
+    assert metrics["memory/reserved_bytes_rank0"] == 1000
+    assert metrics["memory/reserved_bytes_rank1"] == 2000
+    assert metrics["memory/inactive_split_bytes_rank1"] == 500
+    assert metrics["memory/num_alloc_retries_rank0"] == 3
+    assert metrics["memory/num_ooms_rank1"] == 2
+    assert metrics["memory/fragmentation_rank0"] == pytest.approx(0.25)
+    assert metrics["memory/fragmentation_rank1"] == pytest.approx(0.25)
+
+
+def test_memory_stats_callback_empty_stats():
+    trainer, module = _trainer(world_size=1)
+    callback = MemoryStatsCallback(every_n_steps=1, stats_provider=dict)
+    callback.on_train_batch_end(trainer, module, None, None, 0)
+
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["memory/reserved_bytes_rank0"] == 0
+    assert metrics["memory/fragmentation_rank0"] == 0
+
+
+def test_memory_stats_callback_without_cuda():
+    trainer, module = _trainer(world_size=1)
+    callback = MemoryStatsCallback(every_n_steps=1)
+    with pytest.warns(UserWarning, match="No CUDA allocator statistics"):
+        callback.on_train_start(trainer, module)
+    callback.on_train_batch_end(trainer, module, None, None, 0)
+    module.log_dict.assert_not_called()
+
+
+def test_memory_stats_callback_every_n_steps_validation():
+    with pytest.raises(ValueError, match="every_n_steps"):
+        MemoryStatsCallback(every_n_steps=0)
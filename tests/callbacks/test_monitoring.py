@@ -1,11 +1,17 @@
+import itertools
+import json
 import random
+import re
 from unittest import mock
 
 import pytest
 import torch
 
-from lit_llms.callbacks import GPUMonitoringCallback
-from lit_llms.moving_average import MovingAverage
+from lit_llms.callbacks import GPUMonitoringCallback, SteadyStateDetection, ThroughputCallback
+from lit_llms.callbacks.sensor_backends import FakeSensorBackend
+from lit_llms.callbacks.step_timer import PerfCounterTimer, StepTimer
+from lit_llms.callbacks.trace_writer import TraceWriter
+from lit_llms.moving_average import MultiWindowMovingAverage
 from tests.helpers import setup_ddp
 
 try:
@@ -17,33 +23,28 @@ except ImportError:
 def test_custom_monitoring_callback_init():
     callback = GPUMonitoringCallback()
     assert callback.last_batch_start_time is None
-    assert callback.gpu_utilizations10 == []
-    assert callback.gpu_utilizations100 == []
+    assert callback.gpu_utilization_averages is None
     assert callback.running_utilizations_per_batch == []
-    assert isinstance(callback.seconds_per_iter10, MovingAverage)
-    assert isinstance(callback.seconds_per_iter100, MovingAverage)
-    assert callback.seconds_per_iter10.window_size == 10
-    assert callback.seconds_per_iter100.window_size == 100
-    assert not callback.seconds_per_iter10.sync_on_compute
-    assert not callback.seconds_per_iter100.sync_on_compute
+    assert isinstance(callback.seconds_per_iter_averages, MultiWindowMovingAverage)
+    assert callback.seconds_per_iter_averages.window_sizes == (10, 100)
+    assert not callback.seconds_per_iter_averages.sync_on_compute
 
     callback._init_gpu_util_trackers(15)
-    assert len(callback.gpu_utilizations10) == 15
-    assert len(callback.gpu_utilizations100) == 15
-    for i in range(15):
-        assert isinstance(callback.gpu_utilizations10[i], MovingAverage)
-        assert isinstance(callback.gpu_utilizations100[i], MovingAverage)
-        assert callback.gpu_utilizations10[i].window_size == 10
-        assert callback.gpu_utilizations100[i].window_size == 100
-        assert not callback.gpu_utilizations10[i].sync_on_compute
-        assert not callback.gpu_utilizations100[i].sync_on_compute
+    assert isinstance(callback.gpu_utilization_averages, MultiWindowMovingAverage)
+    assert callback.gpu_utilization_averages.num_streams == 15
+    assert callback.gpu_utilization_averages.window_sizes == (10, 100)
+    # a single buffer sized to the largest window is shared by all windows
+    assert callback.gpu_utilization_averages.sliding_window.shape == (15, 100)
+    assert not callback.gpu_utilization_averages.sync_on_compute
+
+    callback = GPUMonitoringCallback(average_windows=(5,))
+    assert callback.seconds_per_iter_averages.window_sizes == (5,)
 
 
 def _step(callback, trainer, module, batch_idx, world_size):
     callback.on_train_batch_start(trainer, module, None, batch_idx)
     assert callback.last_batch_start_time is not None
-    assert len(callback.gpu_utilizations10) == world_size
-    assert len(callback.gpu_utilizations100) == world_size
+    assert callback.gpu_utilization_averages.num_streams == world_size
     assert len(callback.running_utilizations_per_batch) == 1
     callback.on_train_batch_end(trainer, module, None, None, batch_idx)
     assert len(callback.running_utilizations_per_batch) == 2
@@ -70,7 +71,7 @@ def _custom_monitoring_callback_train_mock(
     trainer.global_rank = rank
     strategy = mock.MagicMock()
     strategy.root_device = torch.device("cpu")
-    strategy.all_gather = _all_gather_ddp_if_available
+    strategy.all_gather = mock.Mock(side_effect=_all_gather_ddp_if_available)
     trainer.strategy = strategy
 
     logger = mock.MagicMock()
@@ -87,25 +88,22 @@ def _custom_monitoring_callback_train_mock(
     )
 
     _step(callback, trainer, module, 0, world_size)
-    for i in range(world_size):
-        assert len(callback.gpu_utilizations10[i].sliding_window) == 0
-        assert len(callback.gpu_utilizations100[i].sliding_window) == 0
+    assert callback.gpu_utilization_averages.num_values == 0
 
     assert logger.log_metrics.call_count == 1
 
-    # max memory per rank
-    assert len(logger.log_metrics.call_args[-1]["metrics"]) == world_size
+    # max memory and validation and checkpoint overhead per rank
+    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 3 * world_size
     for i in range(world_size):
         assert f"{gpu_memory_logname}_rank{i}" in logger.log_metrics.call_args[-1]["metrics"]
 
     _step(callback, trainer, module, 1, world_size)
-    for i in range(world_size):
-        assert len(callback.gpu_utilizations10[i].sliding_window) == 1
-        assert len(callback.gpu_utilizations100[i].sliding_window) == 1
+    assert callback.gpu_utilization_averages.num_values == 1
 
     assert logger.log_metrics.call_count == 2
     # three times seconds per iter (current, averaged10, averaged100) + utilization per rank + max memory per rank
-    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 2 * world_size + 3
+    # + data wait, compute, phase (forward, backward, optimizer) and overhead times per rank + data bound fraction
+    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 9 * world_size + 4
     assert time_per_batch_logname in logger.log_metrics.call_args[-1]["metrics"]
     assert f"{time_per_batch_logname}_averaged10" in logger.log_metrics.call_args[-1]["metrics"]
     assert f"{time_per_batch_logname}_averaged100" in logger.log_metrics.call_args[-1]["metrics"]
@@ -115,15 +113,13 @@ def _custom_monitoring_callback_train_mock(
 
     _step(callback, trainer, module, 2, world_size)
     assert callback.last_batch_start_time is not None
-    assert len(callback.gpu_utilizations10) == world_size
-    assert len(callback.gpu_utilizations100) == world_size
-    for i in range(world_size):
-        assert len(callback.gpu_utilizations10[i].sliding_window) == 2
-        assert len(callback.gpu_utilizations100[i].sliding_window) == 2
+    assert callback.gpu_utilization_averages.num_streams == world_size
+    assert callback.gpu_utilization_averages.num_values == 2
 
     assert logger.log_metrics.call_count == 3
     # three times seconds per iter (current, averaged10, averaged100) + utilization per rank + max memory per rank
-    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 2 * world_size + 3
+    # + data wait, compute, phase (forward, backward, optimizer) and overhead times per rank + data bound fraction
+    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 9 * world_size + 4
     assert time_per_batch_logname in logger.log_metrics.call_args[-1]["metrics"]
     assert f"{time_per_batch_logname}_averaged10" in logger.log_metrics.call_args[-1]["metrics"]
     assert f"{time_per_batch_logname}_averaged100" in logger.log_metrics.call_args[-1]["metrics"]
@@ -135,16 +131,14 @@ def _custom_monitoring_callback_train_mock(
         _step(callback, trainer, module, i + 3, world_size)
 
     assert callback.last_batch_start_time is not None
-    assert len(callback.gpu_utilizations10) == world_size
-    assert len(callback.gpu_utilizations100) == world_size
-    for i in range(world_size):
-        assert len(callback.gpu_utilizations10[i].sliding_window) == 10
-        assert len(callback.gpu_utilizations100[i].sliding_window) == 12
+    assert callback.gpu_utilization_averages.num_streams == world_size
+    assert callback.gpu_utilization_averages.num_values == 12
 
     assert logger.log_metrics.call_count == 13
     # three times seconds per iter (current, averaged10, averaged100) + utilization per rank + max memory per rank
-    # + utilization averaged10 per rank
-    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 3 * world_size + 3
+    # + data wait, compute, phase (forward, backward, optimizer) and overhead times per rank + data bound fraction
+    # + utilization, data wait, compute, phase and overhead times averaged10 per rank + data bound fraction averaged10
+    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 17 * world_size + 5
     assert time_per_batch_logname in logger.log_metrics.call_args[-1]["metrics"]
     assert f"{time_per_batch_logname}_averaged10" in logger.log_metrics.call_args[-1]["metrics"]
     assert f"{time_per_batch_logname}_averaged100" in logger.log_metrics.call_args[-1]["metrics"]
@@ -157,16 +151,15 @@ def _custom_monitoring_callback_train_mock(
         _step(callback, trainer, module, i + 13, world_size)
 
     assert callback.last_batch_start_time is not None
-    assert len(callback.gpu_utilizations10) == world_size
-    assert len(callback.gpu_utilizations100) == world_size
-    for i in range(world_size):
-        assert len(callback.gpu_utilizations10[i].sliding_window) == 10
-        assert len(callback.gpu_utilizations100[i].sliding_window) == 100
+    assert callback.gpu_utilization_averages.num_streams == world_size
+    assert callback.gpu_utilization_averages.num_values == 100
 
     assert logger.log_metrics.call_count == 113
     # three times seconds per iter (current, averaged10, averaged100) + utilization per rank + max memory per rank
-    # + utilization averaged10 per rank + utilization averaged100 per rank
-    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 4 * world_size + 3
+    # + data wait, compute, phase (forward, backward, optimizer) and overhead times per rank + data bound fraction
+    # + utilization, data wait, compute, phase and overhead times averaged10 and averaged100 per rank
+    # + data bound fraction averaged10 and averaged100
+    assert len(logger.log_metrics.call_args[-1]["metrics"]) == 25 * world_size + 6
     assert time_per_batch_logname in logger.log_metrics.call_args[-1]["metrics"]
     assert f"{time_per_batch_logname}_averaged10" in logger.log_metrics.call_args[-1]["metrics"]
     assert f"{time_per_batch_logname}_averaged100" in logger.log_metrics.call_args[-1]["metrics"]
@@ -177,7 +170,10 @@ def _custom_monitoring_callback_train_mock(
 
         assert f"{gpu_util_logname}_rank{i}_averaged100" in logger.log_metrics.call_args[-1]["metrics"]
 
-    print("")
+    # a single collective per step and no barrier
+    assert strategy.all_gather.call_count == 113
+    strategy.barrier.assert_not_called()
+    strategy.reduce.assert_not_called()
 
 
 @pytest.mark.parametrize("world_size", [1, 2, 4, 8])
@@ -200,50 +196,681 @@ def test_monitoring_checkpoint(world_size):
     cb._init_gpu_util_trackers(trainer.world_size)
     ckpt = {}
     cb.on_save_checkpoint(mock.MagicMock(), mock.MagicMock(), ckpt)
-    assert len(ckpt) == 4  # gpu_utilizations10, gpu_utilizations100, seconds_per_iter10, seconds_per_iter100
+    # gpu_utilization_averages, seconds_per_iter_averages, step_timing_averages, phase_timing_averages,
+    # overhead_timing_averages
+    assert len(ckpt) == 5
 
-    assert len(ckpt["gpu_utilizations10"]) == world_size
-    assert len(ckpt["gpu_utilizations100"]) == world_size
+    assert ckpt["gpu_utilization_averages"]["sliding_window"].shape == (world_size, 100)
+    assert ckpt["gpu_utilization_averages"]["window_sums"].shape == (2, world_size)
 
     cb2 = GPUMonitoringCallback()
-    assert not cb2.gpu_utilizations10
-    assert not cb2.gpu_utilizations100
-    assert not cb2.seconds_per_iter10.sliding_window
-    assert not cb2.seconds_per_iter100.sliding_window
+    assert cb2.gpu_utilization_averages is None
+    assert cb2.seconds_per_iter_averages.num_values == 0
+
+    cb2.on_load_checkpoint(trainer, mock.MagicMock(), ckpt)
+    assert cb2.gpu_utilization_averages.num_streams == world_size
+    assert cb2.gpu_utilization_averages.num_values == 0
+    assert cb2.seconds_per_iter_averages.window_sizes == (10, 100)
+    assert cb2.seconds_per_iter_averages.num_values == 0
+
+    cb.seconds_per_iter_averages.update(torch.tensor(42.0))
+    cb.gpu_utilization_averages.update(torch.full((world_size,), 42.0))
+
+    ckpt2 = {}
+    cb.on_save_checkpoint(trainer, mock.MagicMock(), ckpt2)
+    assert len(ckpt2) == 5
+
+    cb2.on_load_checkpoint(trainer, mock.MagicMock(), ckpt2)
+    assert cb2.gpu_utilization_averages.num_streams == world_size
+    assert cb2.seconds_per_iter_averages.window_sizes == (10, 100)
+
+    assert cb2.gpu_utilization_averages.num_values == 1
+    assert cb2.seconds_per_iter_averages.num_values == 1
+    assert torch.equal(cb2.gpu_utilization_averages.compute().reshape(2, world_size), torch.full((2, world_size), 42.0))
 
+
+def test_monitoring_checkpoint_world_size_changed():
+    trainer = mock.MagicMock()
+    trainer.world_size = 2
+    cb = GPUMonitoringCallback()
+    cb._init_gpu_util_trackers(trainer.world_size)
+    cb.gpu_utilization_averages.update(torch.tensor([1.0, 2.0]))
+    ckpt = {}
+    cb.on_save_checkpoint(trainer, mock.MagicMock(), ckpt)
+
+    # per-rank averages cannot be mapped onto a different number of ranks
+    trainer.world_size = 4
+    cb2 = GPUMonitoringCallback()
     cb2.on_load_checkpoint(trainer, mock.MagicMock(), ckpt)
-    assert len(cb2.gpu_utilizations10) == world_size
-    assert len(cb2.gpu_utilizations100) == world_size
-    assert cb2.seconds_per_iter10.window_size == 10
-    assert cb2.seconds_per_iter100.window_size == 100
+    assert cb2.gpu_utilization_averages.num_streams == 4
+    assert cb2.gpu_utilization_averages.num_values == 0
+
+
+def _former_average_state(values, window_size):
+    return {
+        "sliding_window": [torch.tensor(float(value)) for value in values],
+        "_extra_state": {"window_size": window_size},
+    }
+
+
+def test_monitoring_checkpoint_former_averages():
+    trainer = mock.MagicMock()
+    trainer.world_size = 2
+    # the single window averages of former versions, with one utilization average per rank
+    ckpt = {
+        "seconds_per_iter10": _former_average_state(range(6, 16), 10),
+        "seconds_per_iter100": _former_average_state(range(1, 16), 100),
+        "gpu_utilizations10": [_former_average_state([rank + 1.0] * 10, 10) for rank in range(2)],
+        "gpu_utilizations100": [_former_average_state([rank + 1.0] * 12, 100) for rank in range(2)],
+    }
+    cb = GPUMonitoringCallback()
+    cb.on_load_checkpoint(trainer, mock.MagicMock(), ckpt)
+    assert not ckpt
 
+    assert cb.seconds_per_iter_averages.num_values == 15
+    assert cb.seconds_per_iter_averages.compute().tolist() == [10.5, 8.0]
+    assert cb.gpu_utilization_averages.num_values == 12
+    assert torch.equal(cb.gpu_utilization_averages.compute(), torch.tensor([[1.0, 2.0], [1.0, 2.0]]))
+
+    # per-rank averages cannot be mapped onto a different number of ranks
+    ckpt = {"gpu_utilizations10": [_former_average_state([1.0], 10)] * 4}
+    cb = GPUMonitoringCallback()
+    with pytest.warns(UserWarning, match="gpu_utilizations10 and gpu_utilizations100 averages"):
+        cb.on_load_checkpoint(trainer, mock.MagicMock(), ckpt)
+    assert not ckpt
+    assert cb.gpu_utilization_averages.num_values == 0
+
+
+def test_monitoring_callback_trackers_on_root_device():
+    device = torch.device("meta")
+    cb = GPUMonitoringCallback(percentiles=(50,), sensor_backend=FakeSensorBackend(stats={"host/disk_read": 5.0}))
+    cb._init_gpu_util_trackers(2, device)
+    for name_str in (
+        "gpu_utilization_averages",
+        "gpu_utilization_quantiles",
+        "seconds_per_iter_averages",
+        "seconds_per_iter_quantiles",
+        "step_timing_averages",
+        "phase_timing_averages",
+        "overhead_timing_averages",
+        "sensor_stat_averages",
+    ):
+        assert getattr(cb, name_str).device == device, name_str
+
+
+def _single_process_trainer(world_size):
+    """Trainer whose strategy simulates ``world_size`` ranks that all report the values of the current process."""
+    trainer = mock.MagicMock()
+    trainer.world_size = world_size
+    trainer.strategy.root_device = torch.device("cpu")
+    trainer.strategy.all_gather = mock.Mock(side_effect=lambda x: x.unsqueeze(0).expand(world_size, *x.shape).clone())
+    module = mock.MagicMock()
+    return trainer, module
+
+
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_percentiles():
+    world_size = 3
+    trainer, module = _single_process_trainer(world_size)
+    callback = GPUMonitoringCallback(percentiles=(50, 99.9))
+    assert callback.seconds_per_iter_quantiles.quantiles == pytest.approx((0.5, 0.999))
+
+    for batch_idx in range(3):
+        _step(callback, trainer, module, batch_idx, world_size)
+
+    metrics = module.log_dict.call_args[0][0]
+    assert "time/seconds_per_iter_p50" in metrics
+    assert "time/seconds_per_iter_p99.9" in metrics
     for i in range(world_size):
-        assert len(cb2.gpu_utilizations10[i].sliding_window) == 0
-        assert len(cb2.gpu_utilizations100[i].sliding_window) == 0
-        assert len(cb2.seconds_per_iter10.sliding_window) == 0
-        assert len(cb2.seconds_per_iter100.sliding_window) == 0
+        assert metrics[f"gpu_stats/utilization_rank{i}_p50"] == pytest.approx(50, rel=0.01)
+        assert metrics[f"gpu_stats/utilization_rank{i}_p99.9"] == pytest.approx(50, rel=0.01)
+
+    ckpt = {}
+    callback.on_save_checkpoint(trainer, module, ckpt)
+    assert "gpu_utilization_quantiles" in ckpt
+    assert "seconds_per_iter_quantiles" in ckpt
+
+    callback2 = GPUMonitoringCallback(percentiles=(50, 99.9))
+    callback2.on_load_checkpoint(trainer, module, ckpt)
+    assert torch.equal(callback2.gpu_utilization_quantiles.counts, callback.gpu_utilization_quantiles.counts)
+    assert callback2.gpu_utilization_quantiles.counts.sum() == 2 * world_size
 
-    cb.seconds_per_iter10.update(torch.tensor(42.0))
-    cb.seconds_per_iter100.update(torch.tensor(42.0))
+
+def test_monitoring_callback_no_percentiles_by_default():
+    callback = GPUMonitoringCallback()
+    callback._init_gpu_util_trackers(4)
+    assert callback.seconds_per_iter_quantiles is None
+    assert callback.gpu_utilization_quantiles is None
+
+
+@mock.patch("torch.cuda.utilization", mock.Mock(side_effect=AssertionError("queried NVML from a training hook")))
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_utilization_sampler():
+    world_size = 2
+    trainer, module = _single_process_trainer(world_size)
+    sensor = mock.Mock(return_value=(42.0, 0.0))
+    # the interval is long enough that only the synchronous first sample and manual ones are taken
+    callback = GPUMonitoringCallback(utilization_sampling_interval=1000, utilization_sensor=sensor)
+
+    callback.on_train_start(trainer, module)
+    assert callback.utilization_sampler.is_running
+    sensor.assert_called()
+
+    for batch_idx in range(3):
+        callback.on_train_batch_start(trainer, module, None, batch_idx)
+        callback.on_train_batch_end(trainer, module, None, None, batch_idx)
+        callback.on_before_backward(trainer, module, None)
+        callback.on_after_backward(trainer, module)
+        callback.on_before_optimizer_step(trainer, module, None, 0)
+        callback.on_before_zero_grad(trainer, module, None)
+        assert callback.running_utilizations_per_batch == []
+
+        metrics = module.log_dict.call_args[0][0]
+        for i in range(world_size):
+            assert metrics[f"gpu_stats/utilization_rank{i}"] == 42.0
+
+    sensor.return_value = (7.0, 0.0)
+    callback.utilization_sampler.sample()
+    callback.on_train_batch_start(trainer, module, None, 3)
+    assert module.log_dict.call_args[0][0]["gpu_stats/utilization_rank0"] == 7.0
+
+    callback.on_train_end(trainer, module)
+    assert callback.utilization_sampler is None
+
+
+@mock.patch("torch.cuda.memory_allocated")
+@mock.patch("torch.cuda.utilization")
+def test_monitoring_callback_sampler_device(utilization, memory_allocated):
+    utilization.return_value = 50
+    memory_allocated.return_value = 1024**3
+    trainer, module = _single_process_trainer(2)
+    trainer.strategy.root_device = torch.device("cuda", 1)
+    callback = GPUMonitoringCallback(utilization_sampling_interval=1000)
+
+    callback.setup(trainer, module, "fit")
+    callback.on_train_start(trainer, module)
+    # the sampler thread queries the device of the rank instead of its current device
+    utilization.assert_called_with(torch.device("cuda", 1))
+    memory_allocated.assert_called_with(torch.device("cuda", 1))
+    callback._stop_utilization_sampler()
+
+
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 2 * 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_single_collective():
+    world_size = 4
+    trainer, module = _single_process_trainer(world_size)
+    callback = GPUMonitoringCallback()
+
+    for batch_idx in range(3):
+        _step(callback, trainer, module, batch_idx, world_size)
+        assert trainer.strategy.all_gather.call_count == batch_idx + 1
+
+    # memory, step time, utilization, data wait, compute, phase and overhead times are packed into one tensor
+    (payload,) = trainer.strategy.all_gather.call_args[0]
+    assert payload.shape == (10,)
+    trainer.strategy.barrier.assert_not_called()
+
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["time/seconds_per_iter"] > 0
     for i in range(world_size):
-        cb.gpu_utilizations10[i].update(torch.tensor(42.0))
-        cb.gpu_utilizations100[i].update(torch.tensor(42.0))
+        assert metrics[f"gpu_stats/max_memory_rank{i}"] == 2.0
+        assert metrics[f"gpu_stats/utilization_rank{i}"] == 50.0
 
-    ckpt2 = {}
-    cb.on_save_checkpoint(trainer, mock.MagicMock(), ckpt2)
-    assert len(ckpt2) == 4  # gpu_utilizations10, gpu_utilizations100, seconds_per_iter10, seconds_per_iter100
 
-    assert len(ckpt2["gpu_utilizations10"]) == world_size
-    assert len(ckpt2["gpu_utilizations100"]) == world_size
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_log_every_n_steps():
+    world_size = 2
+    num_steps = 24
+
+    def run(log_every_n_steps):
+        trainer, module = _single_process_trainer(world_size)
+        callback = GPUMonitoringCallback(log_every_n_steps=log_every_n_steps)
+        with mock.patch("torch.cuda.utilization", mock.Mock(side_effect=itertools.count())):
+            for batch_idx in range(num_steps):
+                _step(callback, trainer, module, batch_idx, world_size)
+        return callback, trainer, module
+
+    callback_every_step, _, _ = run(1)
+    callback, trainer, module = run(4)
+
+    # one collective and one log event per 4 steps
+    assert trainer.strategy.all_gather.call_count == num_steps // 4
+    assert module.log_dict.call_count == num_steps // 4
+
+    # the averages are still updated once per step
+    assert callback.seconds_per_iter_averages.num_values == num_steps - 1
+    assert callback.gpu_utilization_averages.num_values == num_steps - 1
+    assert torch.allclose(
+        callback.gpu_utilization_averages.compute(), callback_every_step.gpu_utilization_averages.compute()
+    )
+
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["time/seconds_per_iter_min"] <= metrics["time/seconds_per_iter"]
+    assert metrics["time/seconds_per_iter"] <= metrics["time/seconds_per_iter_max"]
+    # utilization of the last 4 steps, each of which is the mean over the 6 hooks of the step before
+    assert metrics["gpu_stats/utilization_rank0"] == pytest.approx(sum(range(6 * 19, 6 * 23)) / 24)
+    for i in range(world_size):
+        assert f"gpu_stats/utilization_rank{i}_averaged10" in metrics
+        assert f"gpu_stats/max_memory_rank{i}" in metrics
+
+
+def test_monitoring_callback_log_every_n_steps_consumers():
+    trainer, module = _single_process_trainer(2)
+    trainer.callback_metrics = {}
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    module.log_dict = mock.Mock(side_effect=lambda metrics, **kwargs: trainer.callback_metrics.update(metrics))
+    monitoring = GPUMonitoringCallback(log_every_n_steps=4, sensor_backend=FakeSensorBackend())
+    steady_state = SteadyStateDetection(num_params=1, moving_average_window=3, steady_state_steps_before_stop=0)
+    throughput = ThroughputCallback(num_params=1, peak_flops=1.0)
+    trainer.callbacks = [monitoring, steady_state, throughput]
+    steady_state.on_fit_start(trainer, module)
+    throughput.on_fit_start(trainer, module)
+
+    # every step takes the same time, so the same step time is logged every 4 steps
+    with mock.patch("time.time", mock.Mock(side_effect=itertools.count(0.0, 0.25))):
+        for batch_idx in range(12):
+            monitoring.on_train_batch_start(trainer, module, None, batch_idx)
+            num_log_dict_calls = module.log_dict.call_count
+            batch = torch.zeros(2, 8)
+            steady_state.on_train_batch_end(trainer, module, None, batch, batch_idx)
+            throughput.on_train_batch_end(trainer, module, None, batch, batch_idx)
+            # the throughput is only logged together with a new step time
+            assert module.log_dict.call_count - num_log_dict_calls == (batch_idx % 4 == 3)
+            monitoring.on_train_batch_end(trainer, module, None, None, batch_idx)
+            # the steady state is decided on the step times of the log events, not on copies of the last one
+            assert len(steady_state.iteration_speeds) == monitoring.num_log_events
+            assert steady_state.steady_state_achieved == (batch_idx == 11)
+
+    assert monitoring.num_log_events == 3
+
+
+def test_monitoring_callback_log_every_n_steps_invalid():
+    with pytest.raises(ValueError, match="log_every_n_steps must be at least 1"):
+        GPUMonitoringCallback(log_every_n_steps=0)
+
+
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_async_collectives():
+    world_size = 2
+    num_steps = 5
+
+    def run(async_collectives):
+        trainer, module = _single_process_trainer(world_size)
+        callback = GPUMonitoringCallback(async_collectives=async_collectives)
+        with mock.patch("torch.cuda.utilization", mock.Mock(side_effect=itertools.count())):
+            for batch_idx in range(num_steps):
+                _step(callback, trainer, module, batch_idx, world_size)
+            callback.on_train_end(trainer, module)
+        return callback, module
+
+    callback_sync, module_sync = run(False)
+    callback, module = run(True)
+
+    # the metrics of every step are logged at the start of the next one
+    assert module.log_dict.call_count == num_steps - 1
+    for sync_call, async_call in zip(module_sync.log_dict.call_args_list, module.log_dict.call_args_list):
+        sync_metrics, async_metrics = sync_call[0][0], async_call[0][0]
+        assert sync_metrics.keys() == async_metrics.keys()
+        for i in range(world_size):
+            assert sync_metrics[f"gpu_stats/max_memory_rank{i}"] == async_metrics[f"gpu_stats/max_memory_rank{i}"]
+            if f"gpu_stats/utilization_rank{i}" in sync_metrics:
+                assert sync_metrics[f"gpu_stats/utilization_rank{i}"] == async_metrics[f"gpu_stats/utilization_rank{i}"]
+
+    # the last gather is still consumed at the end of training
+    assert callback._pending_gather is None
+    assert callback.gpu_utilization_averages.num_values == callback_sync.gpu_utilization_averages.num_values
+    assert torch.equal(callback.gpu_utilization_averages.compute(), callback_sync.gpu_utilization_averages.compute())
+
+
+@mock.patch("torch.cuda.utilization", lambda: 10 * torch.distributed.get_rank())
+@mock.patch("torch.cuda.max_memory_allocated", lambda: (torch.distributed.get_rank() + 1) * 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def _async_monitoring_callback_train_mock(rank, world_size):
+    setup_ddp(rank, world_size)
+
+    trainer = mock.MagicMock()
+    trainer.world_size = world_size
+    trainer.strategy.root_device = torch.device("cpu")
+    trainer.strategy.all_gather = _all_gather_ddp_if_available
+    module = mock.MagicMock()
+    callback = GPUMonitoringCallback(async_collectives=True)
+
+    with mock.patch(
+        "torch.distributed.all_gather_into_tensor", wraps=torch.distributed.all_gather_into_tensor
+    ) as all_gather_into_tensor:
+        for batch_idx in range(3):
+            _step(callback, trainer, module, batch_idx, world_size)
+        assert all_gather_into_tensor.call_count == 3
+        assert all(call.kwargs["async_op"] for call in all_gather_into_tensor.call_args_list)
+
+    assert module.log_dict.call_count == 2
+    metrics = module.log_dict.call_args[0][0]
+    for i in range(world_size):
+        assert metrics[f"gpu_stats/max_memory_rank{i}"] == i + 1
+        assert metrics[f"gpu_stats/utilization_rank{i}"] == 10 * i
+
+    callback.on_train_end(trainer, module)
+    assert callback._pending_gather is None
 
-    cb2.on_load_checkpoint(trainer, mock.MagicMock(), ckpt2)
-    assert len(cb2.gpu_utilizations10) == world_size
-    assert len(cb2.gpu_utilizations100) == world_size
-    assert cb2.seconds_per_iter10.window_size == 10
-    assert cb2.seconds_per_iter100.window_size == 100
 
+@pytest.mark.parametrize("world_size", [1, 2])
+def test_monitoring_callback_async_collectives_distributed(world_size):
+    torch.multiprocessing.spawn(_async_monitoring_callback_train_mock, args=(world_size,), nprocs=world_size)
+
+
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_data_wait_and_compute_time():
+    world_size = 2
+    trainer, module = _single_process_trainer(world_size)
+    callback = GPUMonitoringCallback(average_windows=(2,))
+    assert callback.step_timing_averages is None
+
+    # the start of every step is read twice (for the step and after the hooks of the callback)
+    clock = iter([0.0, 0.0, 2.0, 3.0, 3.0, 7.0, 8.0, 8.0, 10.0, 13.0, 13.0])
+    with mock.patch("time.time", lambda: next(clock)):
+        for batch_idx in range(3):
+            callback.on_train_batch_start(trainer, module, None, batch_idx)
+            callback.on_train_batch_end(trainer, module, None, None, batch_idx)
+        callback.on_train_batch_start(trainer, module, None, 3)
+
+    assert callback.step_timing_averages.num_streams == 2 * world_size
+    metrics = module.log_dict.call_args[0][0]
+    # the last step took 5 seconds of which 3 were spent waiting for data
+    assert metrics["time/seconds_per_iter"] == 5.0
+    for i in range(world_size):
+        assert metrics[f"time/data_wait_rank{i}"] == 3.0
+        assert metrics[f"time/compute_rank{i}"] == 2.0
+        assert metrics[f"time/data_wait_rank{i}_averaged2"] == 2.0
+        assert metrics[f"time/compute_rank{i}_averaged2"] == 3.0
+    assert metrics["time/data_bound_fraction"] == pytest.approx(0.6)
+    assert metrics["time/data_bound_fraction_averaged2"] == pytest.approx(0.4)
+
+
+class FakeStepTimer(StepTimer):
+    """Reports the number of marks recorded in the previous step as the duration of every phase."""
+
+    def __init__(self):
+        self.marks = []
+        self.previous_marks = []
+
+    def record(self, mark):
+        self.marks.append(mark)
+
+    def next_step(self):
+        self.previous_marks, self.marks = self.marks, []
+
+    def durations(self, phases):
+        if not self.previous_marks:
+            return None
+        return [float(len(self.previous_marks))] * len(phases)
+
+
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_phase_timings():
+    world_size = 2
+    trainer, module = _single_process_trainer(world_size)
+    timer = FakeStepTimer()
+    callback = GPUMonitoringCallback(average_windows=(2,), step_timer=timer)
+
+    for batch_idx in range(3):
+        _step(callback, trainer, module, batch_idx, world_size)
+        assert timer.marks == ["batch_start", "batch_end", "before_backward", "after_backward", "before_optimizer_step"]
+    callback.on_train_batch_start(trainer, module, None, 3)
+
+    assert callback.phase_timing_averages.num_streams == 3 * world_size
+    metrics = module.log_dict.call_args[0][0]
     for i in range(world_size):
-        assert len(cb2.gpu_utilizations10[i].sliding_window) == 1
-        assert len(cb2.gpu_utilizations100[i].sliding_window) == 1
-        assert len(cb2.seconds_per_iter10.sliding_window) == 1
-        assert len(cb2.seconds_per_iter100.sliding_window) == 1
+        for phase in ("forward", "backward", "optimizer"):
+            assert metrics[f"time/phase_{phase}_rank{i}"] == 5.0
+            assert metrics[f"time/phase_{phase}_rank{i}_averaged2"] == 5.0
+
+
+def test_monitoring_callback_default_step_timer():
+    trainer, module = _single_process_trainer(1)
+    callback = GPUMonitoringCallback()
+    with mock.patch("torch.cuda.max_memory_allocated", lambda: 0), mock.patch(
+        "torch.cuda.reset_max_memory_allocated", lambda: None
+    ), mock.patch("torch.cuda.utilization", lambda: 0):
+        callback.on_train_batch_start(trainer, module, None, 0)
+    assert isinstance(callback.step_timer, PerfCounterTimer)
+
+
+def _scaled_ranks_trainer(world_size, num_nodes):
+    """Trainer whose strategy simulates ``world_size`` ranks reporting ``rank + 1`` times the local values."""
+    trainer, module = _single_process_trainer(world_size)
+    trainer.num_nodes = num_nodes
+    trainer.strategy.all_gather = mock.Mock(side_effect=lambda x: torch.stack([x * (r + 1) for r in range(world_size)]))
+    return trainer, module
+
+
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_aggregate_ranks():
+    world_size = 4
+    trainer, module = _scaled_ranks_trainer(world_size, num_nodes=2)
+    callback = GPUMonitoringCallback(aggregate_ranks=True, top_k_ranks=2, average_windows=(2,))
+
+    for batch_idx in range(4):
+        _step(callback, trainer, module, batch_idx, world_size)
+
+    metrics = module.log_dict.call_args[0][0]
+    assert not [key for key in metrics if re.search(r"_rank\d", key)]
+
+    assert metrics["gpu_stats/max_memory_min"] == 1.0
+    assert metrics["gpu_stats/max_memory_mean"] == 2.5
+    assert metrics["gpu_stats/max_memory_max"] == 4.0
+    assert metrics["gpu_stats/max_memory_std"] == pytest.approx(torch.tensor([1.0, 2, 3, 4]).std(unbiased=False))
+    assert metrics["gpu_stats/max_memory_node0_mean"] == 1.5
+    assert metrics["gpu_stats/max_memory_node1_min"] == 3.0
+    # the highest memory is the worst
+    assert metrics["gpu_stats/max_memory_worst0"] == 4.0
+    assert metrics["gpu_stats/max_memory_worst0_rank"] == 3
+    assert metrics["gpu_stats/max_memory_worst1_rank"] == 2
+    assert "gpu_stats/max_memory_worst2" not in metrics
+
+    # the lowest utilization is the worst
+    assert metrics["gpu_stats/utilization_worst0"] == 50.0
+    assert metrics["gpu_stats/utilization_worst0_rank"] == 0
+    assert metrics["gpu_stats/utilization_averaged2_mean"] == 125.0
+    assert metrics["time/data_wait_averaged2_worst0_rank"] == 3
+    assert "time/phase_forward_max" in metrics
+
+    # 4 statistics per summary: min, mean, max, std, 3 per node and 2 per worst rank
+    num_summaries = 4 + 3 * 2 + 2 * 2
+    assert len([key for key in metrics if key.startswith("gpu_stats/max_memory")]) == num_summaries
+
+
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_aggregate_ranks_per_rank_every_n_steps():
+    world_size = 2
+    trainer, module = _scaled_ranks_trainer(world_size, num_nodes=1)
+    callback = GPUMonitoringCallback(aggregate_ranks=True, per_rank_every_n_steps=3)
+
+    with_per_rank = []
+    for batch_idx in range(7):
+        _step(callback, trainer, module, batch_idx, world_size)
+        metrics = module.log_dict.call_args[0][0]
+        with_per_rank.append("gpu_stats/max_memory_rank1" in metrics)
+        assert "gpu_stats/max_memory_mean" in metrics
+        # a single node has no per-node summaries
+        assert "gpu_stats/max_memory_node0_mean" not in metrics
+
+    assert with_per_rank == [False, False, True, False, False, True, False]
+
+
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_per_rank_histograms():
+    world_size = 4
+    trainer, module = _scaled_ranks_trainer(world_size, num_nodes=1)
+    trainer.is_global_zero = True
+    trainer.global_step = 7
+    logger = mock.MagicMock()
+    trainer.loggers = [logger, mock.Mock(spec=[])]
+    callback = GPUMonitoringCallback(aggregate_ranks=True, per_rank_every_n_steps=1, per_rank_as_histogram=True)
+
+    _step(callback, trainer, module, 0, world_size)
+
+    assert not [key for key in module.log_dict.call_args[0][0] if re.search(r"_rank\d", key)]
+    # the memory and the validation and checkpoint overhead
+    assert logger.experiment.add_histogram.call_count == 3
+    tag, values = logger.experiment.add_histogram.call_args_list[0][0]
+    assert tag == "gpu_stats/max_memory_per_rank"
+    assert torch.equal(values, torch.tensor([1.0, 2.0, 3.0, 4.0]))
+    assert logger.experiment.add_histogram.call_args[1] == {"global_step": 7}
+
+
+@mock.patch("time.time", mock.Mock(side_effect=itertools.count()))
+@mock.patch("torch.cuda.utilization", lambda: 50)
+@mock.patch("torch.cuda.max_memory_allocated", lambda: 1024**3)
+@mock.patch("torch.cuda.reset_max_memory_allocated", lambda: None)
+def test_monitoring_callback_straggler_detection():
+    world_size = 5
+    trainer, module = _single_process_trainer(world_size)
+    # rank 2 takes twice as long as all other ranks
+    trainer.strategy.all_gather = mock.Mock(
+        side_effect=lambda x: torch.stack([x * (2 if r == 2 else 1) for r in range(world_size)])
+    )
+    hook = mock.Mock()
+    callback = GPUMonitoringCallback(average_windows=(2, 4), straggler_detection=True, straggler_hook=hook)
+    assert callback.straggler_window == 2
+
+    for batch_idx in range(3):
+        _step(callback, trainer, module, batch_idx, world_size)
+        assert not [key for key in module.log_dict.call_args[0][0] if key.startswith("stragglers/")]
+    hook.assert_not_called()
+
+    _step(callback, trainer, module, 3, world_size)
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["stragglers/step_count"] == 1
+    assert metrics["stragglers/compute_count"] == 1
+    assert metrics["stragglers/step_max_slowdown"] == pytest.approx(2.0)
+    assert metrics["stragglers/step_rank2_slowdown"] == pytest.approx(2.0)
+    assert metrics["stragglers/compute_rank2_slowdown"] == pytest.approx(2.0)
+    assert not [key for key in metrics if re.search(r"stragglers/.*_rank[0134]_", key)]
+
+    hook.assert_called_once()
+    hook_trainer, stragglers = hook.call_args[0]
+    assert hook_trainer is trainer
+    assert [(s.rank, s.signal) for s in stragglers] == [(2, "step"), (2, "compute")]
+    assert stragglers[0].slowdown == pytest.approx(2.0)
+
+
+def test_monitoring_callback_straggler_window_validation():
+    with pytest.raises(ValueError, match="straggler_window"):
+        GPUMonitoringCallback(average_windows=(10, 100), straggler_window=50)
+
+
+def test_monitoring_callback_sensor_backend():
+    world_size = 2
+    trainer, module = _single_process_trainer(world_size)
+    backend = FakeSensorBackend(utilization=30, memory=2 * 1024**3, stats={"host/disk_read": 5.0})
+    callback = GPUMonitoringCallback(average_windows=(2,), sensor_backend=backend)
+
+    # no CUDA calls at all
+    with mock.patch("torch.cuda.utilization", side_effect=AssertionError), mock.patch(
+        "torch.cuda.max_memory_allocated", side_effect=AssertionError
+    ):
+        for batch_idx in range(4):
+            _step(callback, trainer, module, batch_idx, world_size)
+
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["gpu_stats/max_memory_rank1"] == 2.0
+    assert metrics["gpu_stats/utilization_rank0"] == 30.0
+    assert metrics["host/disk_read_rank0"] == 5.0
+    assert metrics["host/disk_read_rank1_averaged2"] == 5.0
+    assert callback.sensor_stat_averages.num_streams == world_size
+
+    checkpoint = {}
+    callback.on_save_checkpoint(trainer, module, checkpoint)
+    assert "sensor_stat_averages" in checkpoint
+
+
+def test_monitoring_callback_pauses_clock_for_validation_and_checkpoints():
+    world_size = 1
+    trainer, module = _single_process_trainer(world_size)
+    trainer.state.fn = "fit"
+    trainer.sanity_checking = False
+    callback = GPUMonitoringCallback(
+        average_windows=(2,), sensor_backend=FakeSensorBackend(), step_timer=PerfCounterTimer()
+    )
+
+    def train_step(batch_idx, start, end):
+        with mock.patch("time.time", lambda: start):
+            callback.on_train_batch_start(trainer, module, None, batch_idx)
+        with mock.patch("time.time", lambda: end):
+            callback.on_train_batch_end(trainer, module, None, None, batch_idx)
+
+    def at(now, hook, *args):
+        with mock.patch("time.time", lambda: now):
+            hook(trainer, module, *args)
+
+    train_step(0, 0.0, 1.0)
+    # validation from 1.5 to 11.5 and a checkpoint saved at 11.5 with training resuming at 14.5
+    at(1.5, callback.on_validation_start)
+    at(11.5, callback.on_validation_end)
+    at(11.5, callback.on_save_checkpoint, {})
+    train_step(1, 14.5, 15.5)
+
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["time/seconds_per_iter"] == pytest.approx(1.5)
+    assert metrics["time/data_wait_rank0"] == pytest.approx(0.5)
+    assert metrics["time/compute_rank0"] == pytest.approx(1.0)
+    assert metrics["time/overhead_validation_rank0"] == pytest.approx(10.0)
+    assert metrics["time/overhead_checkpoint_rank0"] == pytest.approx(3.0)
+
+    # the sanity check and checkpoints outside of fitting do not pause the clock
+    trainer.sanity_checking = True
+    at(16.0, callback.on_validation_start)
+    at(17.0, callback.on_validation_end)
+    trainer.sanity_checking = False
+    trainer.state.fn = "validate"
+    at(17.0, callback.on_save_checkpoint, {})
+    train_step(2, 17.5, 18.5)
+
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["time/seconds_per_iter"] == pytest.approx(3.0)
+    assert metrics["time/overhead_validation_rank0"] == 0.0
+    assert metrics["time/overhead_checkpoint_rank0"] == 0.0
+    # amortized per step
+    assert metrics["time/overhead_validation_rank0_averaged2"] == pytest.approx(5.0)
+
+
+@mock.patch("time.time", mock.Mock(side_effect=itertools.count()))
+def test_monitoring_callback_trace_writer(tmp_path):
+    world_size = 2
+    trainer, module = _single_process_trainer(world_size)
+    trainer.global_rank = 1
+    writer = TraceWriter(str(tmp_path), dump_every_n_steps=100)
+    callback = GPUMonitoringCallback(sensor_backend=FakeSensorBackend(), trace_writer=writer)
+
+    callback.on_train_start(trainer, module)
+    for batch_idx in range(3):
+        _step(callback, trainer, module, batch_idx, world_size)
+    callback.on_train_end(trainer, module)
+
+    with open(tmp_path / "trace_rank1.json") as f:
+        events = [event for event in json.load(f)["traceEvents"] if event["ph"] == "X"]
+    names = [event["name"] for event in events]
+    # two complete steps with their phases and a gather per step
+    for name in ("step", "compute", "data_wait", "forward", "backward", "optimizer"):
+        assert names.count(name) == 2, name
+    assert names.count("all_gather") == 3
+    assert {event["pid"] for event in events} == {1}
+    assert {event["tid"] for event in events if event["name"] == "all_gather"} == {1}
+    assert all(event["dur"] > 0 for event in events if event["name"] in ("step", "compute", "data_wait"))
@@ -0,0 +1,68 @@
+from unittest import mock
+
+import pytest
+
+from lit_llms.callbacks.sensor_backends import (
+    _PSUTIL_AVAILABLE,
+    CUDASensorBackend,
+    FakeSensorBackend,
+    HostSensorBackend,
+    SensorBackend,
+)
+
+
+def test_cuda_sensor_backend():
+    backend = CUDASensorBackend()
+    with mock.patch("torch.cuda.utilization", lambda: 42), mock.patch(
+        "torch.cuda.max_memory_allocated", lambda: 1024
+    ), mock.patch("torch.cuda.reset_max_memory_allocated") as reset, mock.patch(
+        "torch.cuda.memory_allocated", lambda: 512
+    ):
+        assert backend.utilization() == 42.0
+        assert backend.max_memory() == 1024.0
+        reset.assert_called_once_with()
+        assert backend.sensor()() == (42.0, 512.0)
+    assert backend.stats() == []
+
+
+def test_sensor_backend_is_abstract():
+    with pytest.raises(TypeError, match="abstract"):
+        SensorBackend()
+
+
+def test_fake_sensor_backend():
+    backend = FakeSensorBackend(utilization=lambda: 30, memory=2048, stats={"a": 1, "b": lambda: 2})
+    assert backend.stat_names == ("a", "b")
+    assert backend.utilization() == 30.0
+    assert backend.max_memory() == 2048.0
+    assert backend.stats() == [1.0, 2.0]
+
+
+@pytest.mark.parametrize(
+    "use_psutil", [pytest.param(True, marks=pytest.mark.skipif(not _PSUTIL_AVAILABLE, reason="requires psutil")), False]
+)
+def test_host_sensor_backend(use_psutil, tmp_path):
+    backend = HostSensorBackend(use_psutil=use_psutil)
+    assert backend.stat_names[0] == "host/disk_read_bytes_per_sec"
+
+    backend.utilization()
+    # produce some CPU load and disk writes
+    sum(i * i for i in range(100000))
+    backend.stats()
+    (tmp_path / "data.bin").write_bytes(b"0" * 1024)
+    assert 0.0 <= backend.utilization() <= 100.0
+    assert backend.max_memory() > 0
+    stats = backend.stats()
+    assert len(stats) == len(backend.stat_names)
+    assert all(value >= 0 for value in stats)
+
+
+def test_host_sensor_backend_samples_memory_once_per_step():
+    backend = HostSensorBackend(use_psutil=False)
+    with mock.patch.object(backend, "memory", wraps=backend.memory) as memory:
+        for _ in range(6):
+            backend.utilization()
+        memory.assert_not_called()
+        backend.stats()
+        memory.assert_called_once_with()
+    assert backend.max_memory() > 0
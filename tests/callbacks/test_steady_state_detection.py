@@ -1,3 +1,4 @@
+import json
 from typing import cast
 from unittest.mock import MagicMock
 
@@ -6,7 +7,9 @@ import pytest
 import torch
 from lightning_gpt import DeepSpeedNanoGPT
 
+from lit_llms.callbacks.loss_curve import LossCurveFitter
 from lit_llms.callbacks.steady_state_detection import SteadyStateDetection
+from lit_llms.callbacks.steady_state_detectors import PageHinkleyDetector, SteadyStateDetector
 from lit_llms.callbacks.steady_state_utils import chinchilla_metric_samples
 from tests.helpers import setup_ddp
 
@@ -59,7 +62,7 @@ def test_steady_state_batchsize_detection(batch_size):
     trainer = MagicMock()
     trainer.strategy = MagicMock()
     trainer.strategy.root_device = torch.device("cpu")
-    trainer.strategy.reduce = lambda x, **kwargs: x
+    trainer.strategy.broadcast = lambda obj, src=0: obj
     cb = SteadyStateDetection(target_loss=0.1)
     cb.on_train_batch_end(trainer, MagicMock(), None, torch.rand(batch_size, 1), 0)
     assert cb.batch_size == batch_size
@@ -98,7 +101,8 @@ def _test_steady_state_should_stop(
     trainer.strategy.root_device = torch.device("cpu")
     trainer.global_rank = rank
     trainer.world_size = world_size
-    trainer.strategy.reduce = lambda x, **kwargs: x
+    trainer.global_step = 0
+    trainer.strategy.broadcast = lambda obj, src=0: obj
     trainer.callback_metrics = {
         time_per_batch_logname: torch.tensor(0.1),
         f"{time_per_batch_logname}_averaged10": torch.tensor(0.1),
@@ -149,3 +153,388 @@ def test_steady_state_should_stop(
         ),
         nprocs=world_size,
     )
+
+
+@pytest.mark.parametrize("mode", ["slope", "mann_kendall", "page_hinkley", "cv", PageHinkleyDetector(window=5)])
+def test_steady_state_detector_modes(mode):
+    cb = SteadyStateDetection(target_loss=4.0, num_params=1000000000, steady_state_det_mode=mode)
+    assert isinstance(cb.detector, SteadyStateDetector)
+    window = cb.detector.window
+
+    trainer = MagicMock()
+    trainer.strategy.root_device = torch.device("cpu")
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = 1
+    trainer.global_step = 0
+    trainer.callback_metrics = {
+        "time/seconds_per_iter": torch.tensor(0.1),
+        "time/seconds_per_iter_averaged10": torch.tensor(0.1),
+    }
+    pl_module = MagicMock()
+    for i in range(window):
+        assert not cb.steady_state_achieved
+        cb.on_train_batch_end(trainer, pl_module, None, torch.rand(1, 1), i)
+    assert cb.steady_state_achieved
+    pl_module.log.assert_any_call("steady_state_confidence", torch.tensor(1.0), sync_dist=False, rank_zero_only=True)
+
+
+def test_steady_state_evaluation_interval():
+    with pytest.raises(ValueError, match="evaluate_every_n_steps must be at least 1"):
+        SteadyStateDetection(evaluate_every_n_steps=0)
+    with pytest.raises(ValueError, match="forecast_every_n_steps must be at least 1"):
+        SteadyStateDetection(forecast_every_n_steps=0)
+
+    cb = SteadyStateDetection(
+        target_loss=4.0,
+        num_params=1000000000,
+        moving_average_window=3,
+        stop_on_steady_state=False,
+        evaluate_every_n_steps=4,
+    )
+    trainer = MagicMock()
+    trainer.strategy.broadcast = MagicMock(side_effect=lambda obj, src=0: obj)
+    trainer.world_size = 2
+    trainer.global_step = 0
+    trainer.callback_metrics = {
+        "time/seconds_per_iter": torch.tensor(0.1),
+        "time/seconds_per_iter_averaged10": torch.tensor(0.1),
+    }
+    for i in range(11):
+        cb.on_train_batch_end(trainer, MagicMock(), None, torch.rand(1, 1), i)
+        # the metrics are only read and the decision is only shared every 4 steps
+        assert trainer.strategy.broadcast.call_count == (i + 1) // 4
+        assert list(cb.iteration_speeds) == [pytest.approx(0.1)] * ((i + 1) // 4)
+    assert not cb.steady_state_achieved
+
+    cb.on_train_batch_end(trainer, MagicMock(), None, torch.rand(1, 1), 11)
+    assert cb.steady_state_achieved
+    assert trainer.strategy.broadcast.call_count == 3
+    # the utilization of the ranks is not read in the iter_speed mode
+    assert not cb.gpu_metrics
+
+    # the decision cannot change anymore, so nothing is read or communicated
+    trainer.callback_metrics = MagicMock()
+    pl_module = MagicMock()
+    for i in range(12, 20):
+        cb.on_train_batch_end(trainer, pl_module, None, torch.rand(1, 1), i)
+    assert trainer.strategy.broadcast.call_count == 3
+    trainer.callback_metrics.__getitem__.assert_not_called()
+    pl_module.log.assert_not_called()
+    assert cb.steady_state_stepped == 8
+
+
+def test_steady_state_broadcasts_decision_of_rank_zero():
+    cb = SteadyStateDetection(
+        target_loss=4.0, num_params=1000000000, stop_on_steady_state=True, steady_state_steps_before_stop=0
+    )
+    trainer = MagicMock()
+    trainer.is_global_zero = False
+    trainer.should_stop = False
+    # rank 0 reached steady state and stops
+    trainer.strategy.broadcast = MagicMock(return_value=(True, True))
+    cb.on_train_batch_end(trainer, MagicMock(), None, torch.rand(1, 1), 0)
+    assert cb.steady_state_achieved
+    assert trainer.should_stop
+    trainer.callback_metrics.__getitem__.assert_not_called()
+
+    cb.on_train_batch_end(trainer, MagicMock(), None, torch.rand(1, 1), 1)
+    assert trainer.strategy.broadcast.call_count == 1
+
+
+@pytest.mark.parametrize("world_size", [1, 3, 1024])
+def test_steady_state_multi_signal(world_size):
+    with pytest.raises(ValueError, match="signal_policy must be one of"):
+        SteadyStateDetection(steady_state_det_mode="multi_signal", signal_policy="most")
+
+    cb = SteadyStateDetection(
+        target_loss=4.0, num_params=1000000000, steady_state_det_mode="multi_signal", moving_average_window=3
+    )
+    assert list(cb.signal_tolerances) == [
+        "time/seconds_per_iter",
+        "gpu_stats/utilization_rank{rank}",
+        "gpu_stats/max_memory_rank{rank}",
+        "throughput/samples_per_sec",
+    ]
+    trainer = MagicMock()
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = world_size
+    trainer.global_step = 0
+    metrics = {"time/seconds_per_iter": torch.tensor(0.1), "time/seconds_per_iter_averaged10": torch.tensor(0.1)}
+    for i in range(world_size):
+        metrics[f"gpu_stats/utilization_rank{i}"] = torch.tensor(90.0)
+        metrics[f"gpu_stats/max_memory_rank{i}"] = torch.tensor(10.0)
+    trainer.callback_metrics = metrics
+
+    pl_module = MagicMock()
+    for i in range(3):
+        assert not cb.steady_state_achieved
+        if i == 2:
+            # the utilization of the last rank changes too much
+            metrics[f"gpu_stats/utilization_rank{world_size - 1}"] = torch.tensor(80.0)
+        cb.on_train_batch_end(trainer, pl_module, None, torch.rand(1, 1), i)
+    assert not cb.steady_state_achieved
+    # without the throughput callback, the samples per second are not part of the decision
+    assert cb.multi_signal_detector.steady_signals()[0].tolist() == [True, False, True, False]
+    pl_module.log.assert_any_call("steady_state_confidence", torch.tensor(2 / 3), sync_dist=False, rank_zero_only=True)
+
+    for i in range(3, 5):
+        cb.on_train_batch_end(trainer, pl_module, None, torch.rand(1, 1), i)
+    assert cb.steady_state_achieved
+
+
+def test_steady_state_multi_signal_quorum():
+    cb = SteadyStateDetection(
+        steady_state_det_mode="multi_signal",
+        moving_average_window=3,
+        signal_tolerances={"time/seconds_per_iter": 0.01, "loss_rank{rank}": 0.01},
+        signal_policy="quorum",
+        signal_quorum=0.5,
+        stop_on_steady_state=False,
+    )
+    trainer = MagicMock()
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = 2
+    trainer.global_step = 0
+    for i in range(3):
+        trainer.callback_metrics = {
+            "time/seconds_per_iter": torch.tensor(0.1),
+            "time/seconds_per_iter_averaged10": torch.tensor(0.1),
+            "loss_rank0": torch.tensor(3.0 - i),
+            "loss_rank1": torch.tensor(3.0),
+        }
+        cb.on_train_batch_end(trainer, MagicMock(), None, torch.rand(1, 1), i)
+    assert cb.steady_state_achieved
+
+
+def test_steady_state_forecast(tmp_path):
+    report_path = str(tmp_path / "forecast.json")
+    cb = SteadyStateDetection(
+        target_loss=4.0,
+        num_params=1000000000,
+        batch_size=2,
+        moving_average_window=3,
+        stop_on_steady_state=False,
+        price_per_gpu_hour=2.0,
+        forecast_report_path=report_path,
+    )
+    trainer = MagicMock()
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = 4
+    trainer.num_nodes = 1
+    trainer.global_step = 10
+    trainer.callback_metrics = {
+        "time/seconds_per_iter": torch.tensor(0.2),
+        "time/seconds_per_iter_averaged10": torch.tensor(0.2),
+        "time/overhead_validation_rank0_averaged100": torch.tensor(0.05),
+        "time/overhead_checkpoint_averaged100_mean": torch.tensor(0.01),
+    }
+    pl_module = MagicMock()
+    for i in range(3):
+        cb.on_train_batch_end(trainer, pl_module, None, torch.rand(2, 1), i)
+    assert cb.steady_state_achieved
+
+    remaining_steps = (cb.num_samples_required - 10 * 2 * 4) / (2 * 4)
+    forecast = pl_module.log_dict.call_args.args[0]
+    assert forecast["forecast/remaining_steps"] == pytest.approx(remaining_steps)
+    assert forecast["forecast/overhead_seconds_per_step"] == pytest.approx(0.06)
+    expected_hours = remaining_steps * 0.26 / 3600
+    assert forecast["forecast/hours_p50"] == pytest.approx(expected_hours)
+    assert forecast["forecast/gpu_hours_p90"] == pytest.approx(4 * expected_hours)
+    assert forecast["forecast/cost_p10"] == pytest.approx(8 * expected_hours)
+
+    with open(report_path) as f:
+        report = json.load(f)
+    assert report["forecast"]["hours_p50"] == pytest.approx(expected_hours)
+    assert report["overhead_seconds_per_step"] == {
+        "validation": pytest.approx(0.05),
+        "checkpoint": pytest.approx(0.01),
+    }
+    assert report["world_size"] == 4
+    assert report["price_per_gpu_hour"] == 2.0
+
+
+def test_steady_state_forecast_overhead_before_average_window():
+    # with the default settings the overhead averaged over 100 steps is not logged yet
+    cb = SteadyStateDetection(target_loss=4.0, num_params=1000000000, batch_size=2, stop_on_steady_state=False)
+    trainer = MagicMock()
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = 2
+    trainer.num_nodes = 1
+    pl_module = MagicMock()
+    for i in range(20):
+        trainer.global_step = i + 1
+        trainer.callback_metrics = {
+            "time/seconds_per_iter": torch.tensor(0.2),
+            "time/seconds_per_iter_averaged10": torch.tensor(0.2),
+            "time/overhead_validation_mean": torch.tensor(0.5 if i % 5 == 4 else 0.0),
+            "time/overhead_validation_averaged10_mean": torch.tensor(0.1),
+            "time/overhead_checkpoint_averaged10_mean": torch.tensor(0.0),
+        }
+        cb.on_train_batch_end(trainer, pl_module, None, torch.rand(2, 1), i)
+    assert cb.steady_state_achieved
+    forecast = pl_module.log_dict.call_args.args[0]
+    assert forecast["forecast/overhead_seconds_per_step"] == pytest.approx(0.1)
+
+    # the configured window takes precedence once it is filled
+    trainer.callback_metrics["time/overhead_validation_averaged100_mean"] = torch.tensor(0.05)
+    assert cb._overhead_per_step(trainer.callback_metrics) == {"validation": pytest.approx(0.05), "checkpoint": 0.0}
+
+
+def test_steady_state_forecast_without_overhead():
+    cb = SteadyStateDetection(target_loss=4.0, num_params=1000000000, batch_size=2, moving_average_window=3)
+    trainer = MagicMock()
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = 1
+    trainer.num_nodes = 1
+    trainer.global_step = 10
+    trainer.callback_metrics = {
+        "time/seconds_per_iter": torch.tensor(0.2),
+        "time/seconds_per_iter_averaged10": torch.tensor(0.2),
+    }
+    pl_module = MagicMock()
+    with pytest.warns(UserWarning, match="No validation or checkpoint overhead"):
+        for i in range(3):
+            cb.on_train_batch_end(trainer, pl_module, None, torch.rand(2, 1), i)
+    assert pl_module.log_dict.call_args.args[0]["forecast/overhead_seconds_per_step"] == 0.0
+
+
+def test_steady_state_forecast_samples_since_steady_state():
+    cb = SteadyStateDetection(target_loss=4.0, num_params=1000000000, batch_size=2, moving_average_window=3)
+    trainer = MagicMock()
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = 1
+    trainer.global_step = 0
+    for i, step_time in enumerate([1.0, 0.5, 0.2, 0.2, 0.2, 0.21, 0.19]):
+        trainer.callback_metrics = {
+            "time/seconds_per_iter": torch.tensor(step_time),
+            "time/seconds_per_iter_averaged10": torch.tensor(step_time),
+        }
+        cb.on_train_batch_end(trainer, MagicMock(), None, torch.rand(2, 1), i)
+    # the step times before steady state are dropped, the ones after are kept
+    assert list(cb.forecaster.step_times) == pytest.approx([0.2, 0.2, 0.2, 0.21, 0.19])
+
+
+def _run_loss_curve_forecast(cb, exponent, irreducible=2.0):
+    trainer = MagicMock()
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = 2
+    trainer.num_nodes = 1
+    pl_module = MagicMock()
+    for i, step_time in enumerate([1.0, 0.5, 0.2, 0.2, 0.2]):
+        trainer.global_step = i + 1
+        trainer.callback_metrics = {
+            "time/seconds_per_iter": torch.tensor(step_time),
+            "time/seconds_per_iter_averaged10": torch.tensor(step_time),
+            "train_loss": torch.tensor(irreducible + 8.0 * (i + 1) ** -exponent, dtype=torch.float64),
+        }
+        cb.on_train_batch_end(trainer, pl_module, None, torch.rand(2, 1), i)
+    assert cb.steady_state_achieved
+    logged = {}
+    for call in pl_module.log_dict.call_args_list:
+        logged.update(call.args[0])
+    return logged
+
+
+def test_steady_state_forecast_from_loss_curve(tmp_path):
+    report_path = str(tmp_path / "forecast.json")
+    exponent = LossCurveFitter().exponents[60].item()
+    cb = SteadyStateDetection(
+        target_loss=2.0 + 8.0 * 1000**-exponent,
+        num_params=1000000000,
+        batch_size=2,
+        moving_average_window=3,
+        stop_on_steady_state=False,
+        forecast_report_path=report_path,
+        loss_curve_min_samples=5,
+    )
+    logged = _run_loss_curve_forecast(cb, exponent)
+
+    # the remaining steps come from the observed loss curve instead of the Chinchilla fit
+    assert logged["forecast/loss_curve_target_step"] == pytest.approx(1000)
+    assert logged["forecast/loss_curve_irreducible"] == pytest.approx(2.0)
+    assert logged["forecast/remaining_steps"] == pytest.approx(995)
+    with open(report_path) as f:
+        report = json.load(f)
+    assert report["loss_curve"]["exponent"] == pytest.approx(exponent)
+    assert report["loss_curve"]["target_step"] == pytest.approx(1000)
+
+
+def test_steady_state_forecast_loss_curve_after_steady_state(tmp_path):
+    exponent = 0.5
+    report_path = str(tmp_path / "forecast.json")
+    kwargs = dict(
+        target_loss=2.0 + 8.0 * 5000**-exponent,
+        num_params=1000000000,
+        batch_size=2,
+        moving_average_window=3,
+        stop_on_steady_state=False,
+        loss_curve_min_step=10,
+        loss_curve_min_exponent=0.25,
+        loss_curve_max_exponent=1.0,
+        loss_curve_num_exponents=3,
+    )
+    cb = SteadyStateDetection(forecast_every_n_steps=10, forecast_report_path=report_path, **kwargs)
+    # without forecast_every_n_steps nothing is read after steady state
+    cb_default = SteadyStateDetection(**kwargs)
+    assert cb.loss_curve.exponents.tolist() == pytest.approx([0.25, 0.5, 1.0])
+    trainer = MagicMock()
+    trainer.strategy.broadcast = lambda obj, src=0: obj
+    trainer.world_size = 2
+    trainer.num_nodes = 1
+    trainer.should_stop = False
+    pl_module = MagicMock()
+    for i in range(600):
+        trainer.global_step = i + 1
+        trainer.callback_metrics = {
+            "time/seconds_per_iter": torch.tensor(0.2),
+            "time/seconds_per_iter_averaged10": torch.tensor(0.2),
+            "train_loss": torch.tensor(2.0 + 8.0 * (i + 1) ** -exponent, dtype=torch.float64),
+        }
+        cb_default.on_train_batch_end(trainer, MagicMock(), None, torch.rand(2, 1), i)
+        cb.on_train_batch_end(trainer, pl_module, None, torch.rand(2, 1), i)
+        if i == 10:
+            # steady state is reached long before enough losses are fit
+            assert cb.steady_state_achieved
+            assert cb.loss_curve.fit() is None
+            assert "forecast/loss_curve_target_step" not in pl_module.log_dict.call_args.args[0]
+    assert cb_default.loss_curve.num_samples == 0
+
+    # the values copied every forecast_every_n_steps steps are read at the next refinement
+    assert cb.loss_curve.num_samples == 59
+    forecast = pl_module.log_dict.call_args_list[-2].args[0]
+    assert forecast["forecast/loss_curve_target_step"] == pytest.approx(5000)
+    assert forecast["forecast/loss_curve_exponent"] == pytest.approx(exponent)
+    assert pl_module.log_dict.call_args.args[0]["forecast/remaining_steps"] == pytest.approx(5000 - 600)
+
+    # the refined report is only written at the end of training
+    with open(report_path) as f:
+        assert json.load(f)["loss_curve"] is None
+    cb.on_train_end(trainer, pl_module)
+    with open(report_path) as f:
+        report = json.load(f)
+    assert report["global_step"] == 600
+    assert report["loss_curve"]["target_step"] == pytest.approx(5000)
+
+
+def test_steady_state_forecast_unreachable_target_loss():
+    exponent = LossCurveFitter().exponents[60].item()
+    cb = SteadyStateDetection(
+        target_loss=4.0,
+        num_params=1000000000,
+        batch_size=2,
+        moving_average_window=3,
+        stop_on_steady_state=False,
+        loss_curve_min_samples=5,
+    )
+    with pytest.warns(UserWarning, match="not above the irreducible loss"):
+        logged = _run_loss_curve_forecast(cb, exponent, irreducible=4.5)
+    assert "forecast/loss_curve_target_step" not in logged
+    assert logged["forecast/remaining_steps"] == pytest.approx((cb.num_samples_required - 5 * 2 * 2) / (2 * 2))
+
+
+def test_steady_state_forecast_without_loss_curve():
+    cb = SteadyStateDetection(
+        target_loss=4.0, num_params=1000000000, batch_size=2, moving_average_window=3, fit_loss_curve=False
+    )
+    _run_loss_curve_forecast(cb, 0.5)
+    assert cb.loss_curve.num_samples == 0
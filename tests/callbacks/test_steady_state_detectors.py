@@ -0,0 +1,180 @@
+import math
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+import torch
+
+from lit_llms.callbacks.steady_state_detectors import (
+    CVDetector,
+    MannKendallDetector,
+    MultiSignalDetector,
+    PageHinkleyDetector,
+    SlopeDetector,
+    SteadyStateDetector,
+)
+
+
+def _update(detector, values):
+    for value in values:
+        detector.update(value)
+    return detector
+
+
+@pytest.mark.parametrize("detector_cls", [SlopeDetector, MannKendallDetector, CVDetector])
+def test_detector_window_validation(detector_cls):
+    with pytest.raises(ValueError, match="window must be at least"):
+        detector_cls(window=1)
+
+
+@pytest.mark.parametrize(
+    "detector",
+    [SlopeDetector(10), MannKendallDetector(10), PageHinkleyDetector(10), CVDetector(10)],
+    ids=["slope", "mann_kendall", "page_hinkley", "cv"],
+)
+def test_detector_constant_signal(detector):
+    for i in range(9):
+        detector.update(0.5)
+        assert not detector.steady
+    detector.update(0.5)
+    assert detector.steady
+    assert detector.confidence == 1.0
+
+    detector.reset()
+    assert not detector.steady
+
+
+@pytest.mark.parametrize(
+    "detector",
+    [SlopeDetector(10), MannKendallDetector(10), PageHinkleyDetector(10), CVDetector(10)],
+    ids=["slope", "mann_kendall", "page_hinkley", "cv"],
+)
+def test_detector_drift(detector):
+    # the time per iteration keeps growing by 1% per step
+    for i in range(50):
+        detector.update(1.01**i)
+    assert not detector.steady
+    assert detector.confidence < 0.5
+
+
+def test_detector_is_abstract():
+    with pytest.raises(TypeError, match="abstract"):
+        SteadyStateDetector()
+
+
+def test_slope_detector_matches_regression():
+    rng = np.random.default_rng(0)
+    values = 1 + 0.001 * np.arange(103) + 0.002 * rng.standard_normal(103)
+    detector = _update(SlopeDetector(window=20), values)
+    assert detector.slope == pytest.approx(np.polyfit(np.arange(20), values[-20:], 1)[0])
+
+
+def test_slope_detector_noise():
+    rng = np.random.default_rng(0)
+    detector = _update(SlopeDetector(window=50, max_drift=0.015), 1 + 0.005 * rng.standard_normal(200))
+    assert detector.steady
+    assert detector.confidence > 0.95
+    # the same noise is not enough evidence for a tighter tolerance
+    detector = _update(SlopeDetector(window=50, max_drift=0.001), 1 + 0.005 * rng.standard_normal(200))
+    assert not detector.steady
+
+
+def test_mann_kendall_score():
+    rng = random.Random(0)
+    detector = MannKendallDetector(window=15)
+    window: deque = deque(maxlen=15)
+    for _ in range(60):
+        value = rng.choice([1.0, 2.0, 3.0, rng.random()])
+        detector.update(value)
+        window.append(value)
+        expected = sum(np.sign(window[k] - window[j]) for j in range(len(window)) for k in range(j + 1, len(window)))
+        assert detector.score == expected
+
+
+def test_mann_kendall_noise():
+    rng = np.random.default_rng(0)
+    detector = _update(MannKendallDetector(window=30), 1 + 0.01 * rng.standard_normal(100))
+    assert detector.steady
+    assert detector.confidence > 0.05
+
+
+def test_page_hinkley_shift():
+    detector = _update(PageHinkleyDetector(window=10, delta=0.005), [1.0] * 20)
+    assert detector.steady
+    assert detector.num_changes == 0
+
+    # a shift by 5% is detected within the window and the test restarts
+    detector = _update(detector, [1.05] * 5)
+    assert detector.num_changes == 1
+    assert not detector.steady
+    detector = _update(detector, [1.05] * 10)
+    assert detector.steady
+    assert detector.num_changes == 1
+
+    detector.reset()
+    assert detector.num_changes == 0
+    assert not detector.steady
+
+
+def test_page_hinkley_small_shift():
+    # a shift within the tolerance is not a change
+    detector = _update(PageHinkleyDetector(window=10, delta=0.005), [1.0] * 20 + [1.004] * 50)
+    assert detector.steady
+    assert detector.num_changes == 0
+
+
+def test_cv_detector():
+    rng = np.random.default_rng(0)
+    values = 1 + 0.005 * rng.standard_normal(105)
+    detector = _update(CVDetector(window=50, max_cv=0.015), values)
+    assert detector.cv == pytest.approx(np.std(values[-50:], ddof=1) / np.mean(values[-50:]))
+    assert detector.steady
+
+    detector = _update(CVDetector(window=50, max_cv=0.015), 1 + 0.1 * rng.standard_normal(100))
+    assert not detector.steady
+    assert detector.confidence < 0.05
+
+
+def test_multi_signal_detector_validation():
+    with pytest.raises(ValueError, match="policy must be one of"):
+        MultiSignalDetector([0.01], num_ranks=2, policy="most")
+
+
+@pytest.mark.parametrize(
+    ("policy", "quorum", "expected"),
+    [("all", 0.5, False), ("any", 0.5, True), ("quorum", 0.5, True), ("quorum", 0.75, False)],
+)
+def test_multi_signal_detector_policy(policy, quorum, expected):
+    num_ranks = 4
+    detector = MultiSignalDetector([0.01, 0.01, 0.5], num_ranks=num_ranks, window=5, policy=policy, quorum=quorum)
+    for step in range(5):
+        values = torch.full((3, num_ranks), math.nan, dtype=torch.float64)
+        # a steady global signal reported by rank 0 only
+        values[0, 0] = 1.0
+        # a per-rank signal which keeps growing on the last rank
+        values[1] = 1.0
+        values[1, -1] = 1.1**step
+        # a noisy per-rank signal within its tolerance
+        values[2] = 1.0 + 0.1 * (step % 2)
+        assert not detector.steady
+        detector.update(values)
+
+    steady, active = detector.steady_signals()
+    assert steady.tolist() == [True, False, True]
+    assert active.all()
+    assert detector.confidence == pytest.approx(2 / 3)
+    assert detector.steady == expected
+
+
+def test_multi_signal_detector_missing_signal():
+    detector = MultiSignalDetector([0.01, 0.01], num_ranks=2, window=3)
+    for _ in range(3):
+        detector.update(torch.tensor([[1.0, 1.0], [math.nan, math.nan]], dtype=torch.float64))
+    # the signal which is never reported is ignored
+    assert detector.steady_signals()[1].tolist() == [True, False]
+    assert detector.steady
+
+    # a rank missing a value within the window is not steady
+    detector.update(torch.tensor([[1.0, math.nan], [math.nan, math.nan]], dtype=torch.float64))
+    assert not detector.steady
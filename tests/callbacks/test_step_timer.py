@@ -0,0 +1,92 @@
+import itertools
+from unittest import mock
+
+import pytest
+import torch
+
+from lit_llms.callbacks.step_timer import CUDAEventTimer, PerfCounterTimer, StepTimer, step_timer_for_device
+
+PHASES = [("start", "middle"), ("middle", "end"), ("optional", "end")]
+
+
+def _run_step(timer, marks):
+    for mark in marks:
+        timer.record(mark)
+    timer.next_step()
+
+
+@mock.patch("time.perf_counter", mock.Mock(side_effect=itertools.count()))
+def test_perf_counter_timer():
+    timer = PerfCounterTimer()
+    assert timer.durations(PHASES) is None
+
+    _run_step(timer, ["start", "middle", "end"])
+    # the phase with a missing mark takes no time
+    assert timer.durations(PHASES) == [1.0, 1.0, 0.0]
+
+    _run_step(timer, ["start", "middle", "optional", "end"])
+    assert timer.durations(PHASES) == [1.0, 2.0, 1.0]
+
+    # a step without marks
+    timer.next_step()
+    assert timer.durations(PHASES) is None
+
+
+class FakeEvent:
+    clock = itertools.count()
+
+    def __init__(self, enable_timing=False):
+        assert enable_timing
+        self.time = None
+
+    def record(self, stream=None):
+        self.time = next(self.clock)
+
+    def synchronize(self):
+        pass
+
+    def elapsed_time(self, end):
+        return 1000.0 * (end.time - self.time)
+
+
+@mock.patch("torch.cuda.Event", FakeEvent)
+@mock.patch("torch.cuda.current_stream", lambda device=None: None)
+def test_cuda_event_timer_lags_one_step():
+    timer = CUDAEventTimer()
+
+    _run_step(timer, ["start", "middle", "end"])
+    # the events of the most recent step are not read yet
+    assert timer.durations(PHASES) is None
+
+    _run_step(timer, ["start", "middle", "optional", "end"])
+    assert timer.durations(PHASES) == [1.0, 1.0, 0.0]
+
+    _run_step(timer, ["start", "end", "middle"])
+    assert timer.durations(PHASES) == [1.0, 2.0, 1.0]
+
+    # the events are reused once all buffers have been used
+    _run_step(timer, ["start", "middle", "end"])
+    assert timer.durations(PHASES) == [2.0, -1.0, 0.0]
+    assert sum(len(events) for events in timer._events) == 4 + 3 + 3
+
+
+def test_step_timer_for_device():
+    assert isinstance(step_timer_for_device(torch.device("cpu")), PerfCounterTimer)
+    assert isinstance(step_timer_for_device(torch.device("cuda", 0)), CUDAEventTimer)
+
+
+def test_step_timer_is_abstract():
+    with pytest.raises(TypeError, match="abstract"):
+        StepTimer()
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires a GPU")
+def test_cuda_event_timer_on_gpu():
+    timer = CUDAEventTimer()
+    for _ in range(3):
+        timer.record("start")
+        torch.ones(1024, 1024, device="cuda").matmul(torch.ones(1024, 1024, device="cuda"))
+        timer.record("end")
+        timer.next_step()
+    (duration,) = timer.durations([("start", "end")])
+    assert duration > 0
@@ -0,0 +1,30 @@
+import pytest
+import torch
+
+from lit_llms.callbacks.straggler_detection import robust_outliers
+
+
+def test_robust_outliers():
+    values = torch.tensor([[1.0, 1.1, 0.9, 1.0, 3.0, 1.05], [1.0, 1.0, 1.0, 1.0, 1.0, 1.0]])
+    outliers, slowdowns, scores = robust_outliers(values)
+
+    assert outliers.tolist() == [[False, False, False, False, True, False], [False] * 6]
+    assert slowdowns[0, 4] == pytest.approx(3.0 / 1.0)
+    assert scores[0, 4] > 3.5
+    # no spread at all
+    assert torch.equal(scores[1], torch.zeros(6))
+
+
+def test_robust_outliers_min_slowdown():
+    # the MAD is zero, so any slower rank has a huge score
+    values = torch.tensor([1.0, 1.0, 1.0, 1.01, 1.2])
+    outliers, _, scores = robust_outliers(values, min_slowdown=1.05)
+    assert scores[3] > 3.5
+    assert outliers.tolist() == [False, False, False, False, True]
+
+
+def test_robust_outliers_faster_ranks():
+    # only slow ranks are stragglers
+    outliers, _, scores = robust_outliers(torch.tensor([1.0, 1.0, 1.1, 0.9, 0.1]))
+    assert scores[4] < -3.5
+    assert not outliers.any()
@@ -0,0 +1,104 @@
+from unittest import mock
+
+import pytest
+import torch
+from lightning.pytorch.demos.boring_classes import BoringModel
+
+from lit_llms.callbacks import ThroughputCallback
+from lit_llms.callbacks.throughput import extract_seq_len, PEAK_FLOPS, peak_flops_for_device
+
+
+@pytest.mark.parametrize(
+    "batch, expected",
+    [
+        (torch.zeros(4, 128), 128),
+        (torch.zeros(4), None),
+        ((torch.zeros(4), torch.zeros(4, 64, 3)), 64),
+        ({"labels": torch.zeros(4), "input_ids": torch.zeros(4, 32)}, 32),
+        ([{"input_ids": torch.zeros(4, 16)}], 16),
+        ("text", None),
+    ],
+)
+def test_extract_seq_len(batch, expected):
+    assert extract_seq_len(batch) == expected
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("NVIDIA A100-SXM4-80GB", PEAK_FLOPS["a100"]),
+        ("NVIDIA A10", PEAK_FLOPS["a10"]),
+        ("NVIDIA L4", PEAK_FLOPS["l4"]),
+        ("NVIDIA L40", PEAK_FLOPS["l40"]),
+        ("NVIDIA L40S", PEAK_FLOPS["l40s"]),
+        ("NVIDIA H100 PCIe", PEAK_FLOPS["h100 pcie"]),
+        ("NVIDIA H100 80GB HBM3", PEAK_FLOPS["h100"]),
+        ("Tesla V100-SXM2-16GB", PEAK_FLOPS["v100"]),
+        ("Some Unknown GPU", None),
+    ],
+)
+def test_peak_flops_for_device(name, expected):
+    with mock.patch("torch.cuda.get_device_name", lambda device: name):
+        assert peak_flops_for_device(torch.device("cuda", 0)) == expected
+    assert peak_flops_for_device(torch.device("cpu")) is None
+
+
+def test_peak_flops_for_device_custom_table():
+    with mock.patch("torch.cuda.get_device_name", lambda device: "My Accelerator"):
+        assert peak_flops_for_device(torch.device("cuda", 0), {"accelerator": 1e15}) == 1e15
+
+
+def _trainer(world_size, time_per_batch):
+    trainer = mock.MagicMock()
+    trainer.world_size = world_size
+    trainer.strategy.root_device = torch.device("cpu")
+    trainer.callback_metrics = {} if time_per_batch is None else {"time/seconds_per_iter": torch.tensor(time_per_batch)}
+    return trainer
+
+
+def test_throughput_callback():
+    trainer = _trainer(world_size=4, time_per_batch=0.5)
+    module = BoringModel()  # 66 parameters
+    module.log_dict = mock.MagicMock()
+    callback = ThroughputCallback(peak_flops=1e6)
+
+    callback.on_fit_start(trainer, module)
+    callback.on_train_start(trainer, module)
+    assert callback.num_params == 66
+    with mock.patch.object(module, "parameters", side_effect=AssertionError):
+        # the parameters are only counted once
+        callback.on_train_batch_end(trainer, module, None, torch.zeros(8, 32), 0)
+    assert callback.batch_size == 8
+    assert callback.seq_len == 32
+    assert callback.num_params == 66
+
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics["throughput/samples_per_sec"] == 8 * 4 / 0.5
+    assert metrics["throughput/tokens_per_sec"] == 8 * 4 * 32 / 0.5
+    assert metrics["throughput/mfu"] == pytest.approx(6 * 66 * 8 * 4 * 32 / 0.5 / (1e6 * 4))
+
+
+def test_throughput_callback_without_step_time_or_peak_flops():
+    trainer = _trainer(world_size=1, time_per_batch=None)
+    module = BoringModel()
+    module.log_dict = mock.MagicMock()
+    callback = ThroughputCallback(seq_len=16)
+
+    with pytest.warns(UserWarning, match="Unknown peak FLOPs"):
+        callback.on_train_start(trainer, module)
+    callback.on_train_batch_end(trainer, module, None, torch.zeros(2), 0)
+    module.log_dict.assert_not_called()
+
+    trainer.callback_metrics["time/seconds_per_iter"] = torch.tensor(2.0)
+    callback.on_train_batch_end(trainer, module, None, torch.zeros(2), 1)
+    metrics = module.log_dict.call_args[0][0]
+    assert metrics.keys() == {"throughput/samples_per_sec", "throughput/tokens_per_sec"}
+    assert metrics["throughput/tokens_per_sec"] == 2 * 16 / 2.0
+
+
+def test_throughput_callback_without_trainable_parameters():
+    module = BoringModel()
+    module.requires_grad_(False)
+    callback = ThroughputCallback()
+    callback.on_fit_start(_trainer(world_size=1, time_per_batch=None), module)
+    assert callback.num_params == 0
@@ -0,0 +1,64 @@
+import concurrent.futures
+import json
+
+import pytest
+
+from lit_llms.callbacks.trace_writer import merge_traces, TraceWriter
+
+
+def _complete_events(path):
+    with open(path) as f:
+        return [event for event in json.load(f)["traceEvents"] if event["ph"] == "X"]
+
+
+def test_trace_writer_ring_buffer(tmp_path):
+    writer = TraceWriter(str(tmp_path), capacity=3, dump_every_n_steps=2)
+    writer.rank = 1
+    for i in range(5):
+        writer.add_span("step" if i % 2 else "data_wait", float(i), i + 0.5, track=i % 2)
+
+    writer.step()
+    assert not (tmp_path / "trace_rank1.json").exists()
+    writer.step()
+    writer.close()
+
+    # only the most recent spans are kept
+    events = _complete_events(tmp_path / "trace_rank1.json")
+    assert [event["name"] for event in events] == ["data_wait", "step", "data_wait"]
+    assert events[0] == {"name": "data_wait", "ph": "X", "pid": 1, "tid": 0, "ts": 2e6, "dur": 0.5e6}
+    assert events[1]["tid"] == 1
+
+    with open(tmp_path / "trace_rank1.json") as f:
+        metadata = [event for event in json.load(f)["traceEvents"] if event["ph"] == "M"]
+    assert metadata[0]["args"] == {"name": "rank 1"}
+    assert [event["args"]["name"] for event in metadata[1:]] == ["step", "collective", "overhead"]
+
+
+def test_trace_writer_skips_dump_while_writing(tmp_path):
+    writer = TraceWriter(str(tmp_path), dump_every_n_steps=1)
+    writer.add_span("step", 0.0, 1.0)
+    writer._dump_future = concurrent.futures.Future()
+    writer.dump()
+    assert writer._executor is None
+
+    writer._dump_future = None
+    writer.close()
+    assert len(_complete_events(tmp_path / "trace_rank0.json")) == 1
+
+
+def test_merge_traces(tmp_path):
+    for rank in range(2):
+        writer = TraceWriter(str(tmp_path))
+        writer.rank = rank
+        writer.add_span("step", 0.0, 1.0)
+        writer.close()
+
+    merge_traces([str(tmp_path / f"trace_rank{rank}.json") for rank in range(2)], str(tmp_path / "trace.json"))
+    assert [event["pid"] for event in _complete_events(tmp_path / "trace.json")] == [0, 1]
+
+
+def test_trace_writer_validation(tmp_path):
+    with pytest.raises(ValueError, match="capacity"):
+        TraceWriter(str(tmp_path), capacity=0)
+    with pytest.raises(ValueError, match="dump_every_n_steps"):
+        TraceWriter(str(tmp_path), dump_every_n_steps=0)
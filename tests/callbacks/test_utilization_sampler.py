@@ -0,0 +1,61 @@
+import itertools
+import time
+
+import pytest
+
+from lit_llms.callbacks.utilization_sampler import UtilizationSampler
+
+
+class FakeSensor:
+    def __init__(self):
+        self.counter = itertools.count()
+
+    def __call__(self):
+        value = next(self.counter)
+        return float(value), float(10 * value)
+
+
+def test_utilization_sampler_read():
+    sampler = UtilizationSampler(FakeSensor(), capacity=8)
+    assert sampler.read() is None
+
+    for _ in range(4):
+        sampler.sample()
+    # mean utilization and peak memory of samples 0, 1, 2, 3
+    assert sampler.read() == (1.5, 30.0)
+    # nothing new since the last read
+    assert sampler.read() is None
+
+    sampler.sample()
+    assert sampler.read() == (4.0, 40.0)
+
+
+def test_utilization_sampler_overflow():
+    sampler = UtilizationSampler(FakeSensor(), capacity=4)
+    for _ in range(10):
+        sampler.sample()
+    # only the last four samples (6, 7, 8, 9) are still in the buffer
+    assert sampler.read() == (7.5, 90.0)
+
+
+def test_utilization_sampler_thread():
+    sampler = UtilizationSampler(FakeSensor(), interval=0.001)
+    assert not sampler.is_running
+    sampler.start()
+    assert sampler.is_running
+
+    deadline = time.time() + 5
+    while sampler.read() is None and time.time() < deadline:
+        time.sleep(0.01)
+
+    sampler.stop()
+    assert not sampler.is_running
+    num_samples = sampler._num_samples
+    assert num_samples > 0
+    time.sleep(0.01)
+    assert sampler._num_samples == num_samples
+
+
+def test_utilization_sampler_invalid_interval():
+    with pytest.raises(ValueError, match="sampling interval must be positive"):
+        UtilizationSampler(FakeSensor(), interval=0)
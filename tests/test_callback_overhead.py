@@ -0,0 +1,31 @@
+import pytest
+
+from benchmarks.callback_overhead import ALLOCATIONS, ALLOCATIONS_PER_CALL, LOGGED_KEYS, benchmark
+
+
+@pytest.mark.parametrize("aggregate_ranks", [True, False])
+def test_callback_overhead_does_not_scale_with_world_size(aggregate_ranks):
+    # only the counts are checked, the times depend on the machine and are left to the benchmark script. A single
+    # node, so that the per-node summaries do not add keys with the number of ranks, and at least top_k_ranks ranks, so
+    # that the same summaries over the ranks are computed at all world sizes
+    world_sizes = (4, 8, 64)
+    results = {
+        world_size: benchmark(world_size, num_steps=1, warmup_steps=110, aggregate_ranks=aggregate_ranks, num_nodes=1)
+        for world_size in world_sizes
+    }
+    allocations = {
+        world_size: {name: value for name, value in values.items() if name.endswith(ALLOCATIONS_PER_CALL)}
+        for world_size, values in results.items()
+    }
+    assert "GPUMonitoringCallback.on_train_batch_start.allocations_per_call" in allocations[64]
+    assert allocations[64] == allocations[4]
+    assert results[64][ALLOCATIONS] == results[4][ALLOCATIONS]
+
+    logged_keys = {world_size: values[LOGGED_KEYS] for world_size, values in results.items()}
+    if aggregate_ranks:
+        assert logged_keys[64] == logged_keys[8] == logged_keys[4]
+    else:
+        # one key per rank for every per-rank metric, and no more metrics at larger world sizes
+        keys_per_rank = (logged_keys[8] - logged_keys[4]) / (8 - 4)
+        assert keys_per_rank > 0
+        assert logged_keys[64] - logged_keys[8] == keys_per_rank * (64 - 8)
@@ -1,13 +1,16 @@
+from unittest import mock
+
 import pytest
 import torch
 
-from lit_llms.moving_average import MovingAverage
+from lit_llms.moving_average import MovingAverage, MultiWindowMovingAverage
+from tests.helpers import setup_ddp
 
 
 def test_moving_average():
     ma = MovingAverage(window_size=5)
     assert ma.window_size == 5
-    assert ma.sliding_window == []
+    assert ma.num_values == 0
 
     # not yet updated -> division by length of sliding window is division by zero
     with pytest.raises(ZeroDivisionError):
@@ -16,17 +19,17 @@ def test_moving_average():
     # sequentially updating
     ma.update(torch.tensor(1.0))
     assert ma.compute() == 1.0
-    assert len(ma.sliding_window) == 1
+    assert ma.num_values == 1
     ma.update(torch.tensor(2.0))
     assert ma.compute() == 1.5
-    assert len(ma.sliding_window) == 2
+    assert ma.num_values == 2
     ma.update(torch.tensor(3.0))
     assert ma.compute() == 2.0
-    assert len(ma.sliding_window) == 3
+    assert ma.num_values == 3
 
     # resetting -> nothing in sliding window again
     ma.reset()
-    assert len(ma.sliding_window) == 0
+    assert ma.num_values == 0
 
     # updating again to previous state
     ma.update(torch.tensor(1.0))
@@ -36,35 +39,35 @@ def test_moving_average():
     # continue sequentially updating
     ma.update(torch.tensor(4.0))
     assert ma.compute() == 2.5
-    assert len(ma.sliding_window) == 4
+    assert ma.num_values == 4
 
     ma.update(torch.tensor(5.0))
     assert ma.compute() == 3.0
-    assert len(ma.sliding_window) == 5
+    assert ma.num_values == 5
 
     # since we are at maximum length,
     # the first item here is popped when a new one is added
     # -> 1.0 is popped -> (2+3+4+5+6)/5 = 20/5 = 4.0
     ma.update(torch.tensor(6.0))
     assert ma.compute() == 4.0
-    assert len(ma.sliding_window) == 5
+    assert ma.num_values == 5
 
     # sequentially updating (always pops first item)
     ma.update(torch.tensor(7.0))
     assert ma.compute() == 5.0
-    assert len(ma.sliding_window) == 5
+    assert ma.num_values == 5
 
     ma.update(torch.tensor(8.0))
     assert ma.compute() == 6.0
-    assert len(ma.sliding_window) == 5
+    assert ma.num_values == 5
 
     ma.update(torch.tensor(9.0))
     assert ma.compute() == 7.0
-    assert len(ma.sliding_window) == 5
+    assert ma.num_values == 5
 
     ma.update(torch.tensor(10.0))
     assert ma.compute() == 8.0
-    assert len(ma.sliding_window) == 5
+    assert ma.num_values == 5
 
 
 def test_moving_average_checkpoint():
@@ -78,19 +81,223 @@ def test_moving_average_checkpoint():
     ma.update(torch.tensor(10.0))
 
     state_dict = ma.state_dict()
-    assert state_dict["sliding_window"] == [
-        torch.tensor(5.0),
-        torch.tensor(6.0),
-        torch.tensor(7.0),
-        torch.tensor(8.0),
-        torch.tensor(9.0),
-        torch.tensor(10.0),
-    ]
+    assert torch.equal(state_dict["sliding_window"][:6], torch.tensor([5.0, 6.0, 7.0, 8.0, 9.0, 10.0]))
+    assert state_dict["sliding_window"].shape == (42,)
+    assert state_dict["running_sum"] == 45.0
+    assert state_dict["num_values"] == 6
     assert state_dict["_extra_state"]["window_size"] == 42
 
     ma2 = MovingAverage(5)
     ma2.load_state_dict(state_dict)
 
     assert ma2.window_size == 42
-    assert len(ma2.sliding_window) == 6
+    assert ma2.num_values == 6
     ma2.update(torch.tensor(11.0))
+    assert ma2.compute() == 8.0
+
+    # resetting falls back to a buffer of the loaded window size
+    ma2.reset()
+    assert ma2.sliding_window.shape == (42,)
+    assert ma2.num_values == 0
+
+
+def test_moving_average_list_checkpoint():
+    # state dict of the former list based window
+    state_dict = {
+        "sliding_window": [torch.tensor(float(i)) for i in range(1, 5)],
+        "_extra_state": {"window_size": 3},
+    }
+    ma = MovingAverage(10)
+    ma.load_state_dict(state_dict)
+
+    assert ma.window_size == 3
+    assert ma.num_values == 3
+    assert ma.compute() == 3.0
+    ma.update(torch.tensor(5.0))
+    assert ma.compute() == 4.0
+
+    with pytest.raises(ValueError, match="only be loaded into a single stream"):
+        MovingAverage(3, num_streams=2).load_state_dict(state_dict)
+    with pytest.raises(ValueError, match="cannot be loaded into a MultiWindowMovingAverage"):
+        MultiWindowMovingAverage([2, 3]).load_state_dict(state_dict)
+    with pytest.raises(ValueError, match="without its window size"):
+        MovingAverage(3).load_state_dict({"sliding_window": [torch.tensor(1.0)]})
+
+
+def test_moving_average_wraps_ring_buffer():
+    ma = MovingAverage(window_size=3)
+    for value in range(1, 8):
+        ma.update(torch.tensor(float(value)))
+
+    # 7 updates into a window of 3 -> the buffer wrapped around twice
+    assert ma.compute() == 6.0
+    assert ma.num_values == 3
+    assert ma.write_index == 1
+
+
+def test_moving_average_resummation():
+    ma = MovingAverage(window_size=4)
+    ma.update(torch.tensor(1.0))
+    # simulate accumulated floating point error in the running sum
+    ma.running_sum += 3.0
+    for _ in range(2):
+        ma.update(torch.tensor(1.0))
+    assert ma.compute() == 6.0 / 3
+
+    # the fourth update completes a full window and triggers re-summation from the buffer
+    ma.update(torch.tensor(1.0))
+    assert ma.compute() == 1.0
+
+
+def test_moving_average_num_streams():
+    ma = MovingAverage(window_size=3, num_streams=4)
+    assert ma.sliding_window.shape == (4, 3)
+    assert ma.running_sum.shape == (4,)
+
+    for step in range(5):
+        ma.update(torch.arange(4, dtype=torch.float) + step)
+
+    # each stream averages its last three values, i.e. steps 2, 3 and 4
+    assert torch.equal(ma.compute(), torch.arange(4, dtype=torch.float) + 3)
+    assert ma.num_values == 3
+
+
+@pytest.mark.parametrize("num_streams", [1, 7])
+def test_moving_average_num_streams_matches_single_stream(num_streams):
+    batched = MovingAverage(window_size=5, num_streams=num_streams)
+    singles = [MovingAverage(window_size=5) for _ in range(num_streams)]
+
+    for _ in range(13):
+        values = torch.rand(num_streams)
+        batched.update(values)
+        for single, value in zip(singles, values):
+            single.update(value)
+
+        expected = torch.stack([single.compute() for single in singles])
+        torch.testing.assert_close(batched.compute().reshape(num_streams), expected)
+
+
+def test_moving_average_num_streams_checkpoint():
+    ma = MovingAverage(window_size=3, num_streams=2)
+    ma.update(torch.tensor([1.0, 2.0]))
+    state_dict = ma.state_dict()
+    assert state_dict["_extra_state"]["num_streams"] == 2
+
+    ma2 = MovingAverage(window_size=3)
+    ma2.load_state_dict(state_dict)
+    assert ma2.num_streams == 2
+    ma2.update(torch.tensor([3.0, 4.0]))
+    assert torch.equal(ma2.compute(), torch.tensor([2.0, 3.0]))
+
+    ma2.reset()
+    assert ma2.sliding_window.shape == (2, 3)
+    assert ma2.running_sum.shape == (2,)
+
+
+@pytest.mark.parametrize("num_streams", [None, 3])
+def test_multi_window_moving_average(num_streams):
+    window_sizes = (2, 5, 4)
+    mwma = MultiWindowMovingAverage(window_sizes=window_sizes, num_streams=num_streams)
+    # one buffer sized to the largest window
+    assert mwma.sliding_window.shape == (*mwma._stream_shape, 5)
+
+    shape = () if num_streams is None else (num_streams,)
+    values = torch.rand(17, *shape)
+    for step, value in enumerate(values):
+        mwma.update(value)
+        averages = mwma.compute()
+        for k, window in enumerate(window_sizes):
+            expected = values[: step + 1][-window:].mean(0)
+            torch.testing.assert_close(averages[k], expected)
+
+
+def test_multi_window_moving_average_matches_moving_average():
+    mwma = MultiWindowMovingAverage(window_sizes=(10, 100))
+    ma10 = MovingAverage(window_size=10)
+    ma100 = MovingAverage(window_size=100)
+    for value in torch.rand(250):
+        mwma.update(value)
+        ma10.update(value)
+        ma100.update(value)
+    torch.testing.assert_close(mwma.compute(), torch.stack([ma10.compute(), ma100.compute()]))
+
+
+def test_multi_window_moving_average_ema():
+    mwma = MultiWindowMovingAverage(window_sizes=(3,), ema_decays=(0.5, 0.9))
+    mwma.update(torch.tensor(4.0))
+    # the bias correction makes the first EMA value equal to the first value
+    torch.testing.assert_close(mwma.compute(), torch.tensor([4.0, 4.0, 4.0]))
+
+    mwma.update(torch.tensor(2.0))
+    # 0.5 * 0.5 * 4 + 0.5 * 2 = 2 -> bias corrected 2 / (1 - 0.25)
+    torch.testing.assert_close(mwma.compute()[1], torch.tensor(2.0 / 0.75))
+
+
+def test_multi_window_moving_average_checkpoint():
+    mwma = MultiWindowMovingAverage(window_sizes=(2, 3), ema_decays=(0.5,), num_streams=2)
+    for value in range(4):
+        mwma.update(torch.full((2,), float(value)))
+    state_dict = mwma.state_dict()
+    assert state_dict["_extra_state"]["window_sizes"] == [2, 3]
+    assert state_dict["_extra_state"]["ema_decays"] == [0.5]
+
+    mwma2 = MultiWindowMovingAverage(window_sizes=(7,))
+    mwma2.load_state_dict(state_dict)
+    assert mwma2.window_sizes == (2, 3)
+    assert mwma2.ema_decays == (0.5,)
+    torch.testing.assert_close(mwma2.compute(), mwma.compute())
+
+    mwma.update(torch.full((2,), 4.0))
+    mwma2.update(torch.full((2,), 4.0))
+    torch.testing.assert_close(mwma2.compute(), mwma.compute())
+
+    mwma2.reset()
+    assert mwma2.window_sums.shape == (2, 2)
+    assert mwma2.ema.shape == (1, 2)
+
+
+def test_multi_window_moving_average_no_windows():
+    with pytest.raises(ValueError, match="At least one window size"):
+        MultiWindowMovingAverage(window_sizes=())
+
+
+def _moving_average_sync_on_compute(rank, world_size):
+    setup_ddp(rank, world_size)
+
+    ma = MovingAverage(window_size=2, sync_on_compute=True)
+    mwma = MultiWindowMovingAverage(window_sizes=(1, 3), ema_decays=(0.5,), num_streams=2, sync_on_compute=True)
+    # rank r sees the values r, r + 1, r + 2 -> the local windows differ per rank
+    for step in range(3):
+        ma.update(torch.tensor(float(rank + step)))
+        mwma.update(torch.full((2,), float(rank + step)))
+
+    with mock.patch("torch.distributed.all_reduce", wraps=torch.distributed.all_reduce) as all_reduce, mock.patch(
+        "torch.distributed.all_gather", wraps=torch.distributed.all_gather
+    ) as all_gather:
+        average = ma.compute()
+        averages = mwma.compute()
+
+    # exactly one small collective per metric
+    assert all_reduce.call_count == 2
+    all_gather.assert_not_called()
+
+    mean_rank = (world_size - 1) / 2
+    # global window of 2: mean of (r + 1, r + 2) over all ranks
+    torch.testing.assert_close(average, torch.tensor(mean_rank + 1.5))
+    # windows 1 and 3 and the EMA, averaged over all ranks
+    torch.testing.assert_close(averages[0], torch.full((2,), mean_rank + 2))
+    torch.testing.assert_close(averages[1], torch.full((2,), mean_rank + 1))
+    local_ema = (0.25 * (rank + 1) + 0.5 * (rank + 2) + 0.125 * rank) / (1 - 0.5**3)
+    global_ema = (0.25 * (mean_rank + 1) + 0.5 * (mean_rank + 2) + 0.125 * mean_rank) / (1 - 0.5**3)
+    torch.testing.assert_close(averages[2], torch.full((2,), global_ema))
+
+    # the local states are restored after the synced compute
+    assert ma.num_values == 2
+    torch.testing.assert_close(ma.running_sum, torch.tensor(2.0 * rank + 3))
+    torch.testing.assert_close(mwma.ema[0], torch.full((2,), local_ema * (1 - 0.5**3)))
+    assert torch.equal(mwma.window_counts, torch.tensor([1, 3]))
+
+
+@pytest.mark.parametrize("world_size", [1, 2, 3])
+def test_moving_average_sync_on_compute(world_size):
+    torch.multiprocessing.spawn(_moving_average_sync_on_compute, args=(world_size,), nprocs=world_size)
@@ -0,0 +1,111 @@
+import pytest
+import torch
+
+from lit_llms.streaming_quantile import StreamingQuantile
+from tests.helpers import setup_ddp
+
+
+@pytest.mark.parametrize("num_streams", [None, 4])
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_streaming_quantile_accuracy(num_streams, relative_accuracy):
+    sq = StreamingQuantile(
+        quantiles=(0.1, 0.5, 0.9, 0.99), relative_accuracy=relative_accuracy, num_streams=num_streams
+    )
+    shape = () if num_streams is None else (num_streams,)
+    values = torch.rand(2000, *shape).exp()
+
+    for value in values:
+        sq.update(value)
+
+    expected = torch.quantile(values, torch.tensor(sq.quantiles), dim=0, interpolation="lower")
+    result = sq.compute()
+    assert result.shape == expected.shape
+    assert ((result - expected).abs() / expected).max() <= relative_accuracy + 1e-6
+
+
+def test_streaming_quantile_constant_memory():
+    sq = StreamingQuantile(relative_accuracy=0.01, min_value=1e-4, max_value=1e4)
+    num_buckets = sq.counts.numel()
+    for value in torch.rand(500):
+        sq.update(value)
+    assert sq.counts.numel() == num_buckets
+    assert sq.counts.sum() == 500
+
+
+def test_streaming_quantile_out_of_range():
+    sq = StreamingQuantile(quantiles=(0.0, 1.0), min_value=1.0, max_value=100.0)
+    sq.update(torch.tensor(0.0))
+    sq.update(torch.tensor(1000.0))
+    # values below min_value are reported as zero, values above max_value as max_value
+    assert torch.equal(sq.compute(), torch.tensor([0.0, 100.0]))
+
+
+def test_streaming_quantile_merge():
+    first = StreamingQuantile(quantiles=(0.5,))
+    second = StreamingQuantile(quantiles=(0.5,))
+    combined = StreamingQuantile(quantiles=(0.5,))
+    for value in torch.arange(1, 101, dtype=torch.float):
+        (first if value <= 50 else second).update(value)
+        combined.update(value)
+
+    first.merge_state(second)
+    assert torch.equal(first.counts, combined.counts)
+    assert first.compute() == combined.compute()
+
+
+def test_streaming_quantile_empty():
+    with pytest.raises(ZeroDivisionError):
+        StreamingQuantile().compute()
+
+
+@pytest.mark.parametrize(
+    "kwargs, match",
+    [
+        ({"quantiles": (1.5,)}, "Quantiles must be within"),
+        ({"relative_accuracy": 0.0}, "relative_accuracy must be within"),
+        ({"min_value": 10.0, "max_value": 1.0}, "Expected 0 < min_value < max_value"),
+    ],
+)
+def test_streaming_quantile_invalid_arguments(kwargs, match):
+    with pytest.raises(ValueError, match=match):
+        StreamingQuantile(**kwargs)
+
+
+def test_streaming_quantile_checkpoint():
+    sq = StreamingQuantile(quantiles=(0.5, 0.9), relative_accuracy=0.02, min_value=1.0, max_value=100.0, num_streams=2)
+    for value in torch.rand(50, 2) * 100:
+        sq.update(value)
+    state_dict = sq.state_dict()
+    assert state_dict["_extra_state"]["quantiles"] == [0.5, 0.9]
+
+    sq2 = StreamingQuantile()
+    sq2.load_state_dict(state_dict)
+    assert sq2.quantiles == (0.5, 0.9)
+    assert sq2.num_streams == 2
+    assert torch.equal(sq2.compute(), sq.compute())
+    # the state dict can be loaded again
+    assert state_dict["_extra_state"]["quantiles"] == [0.5, 0.9]
+    sq3 = StreamingQuantile()
+    sq3.load_state_dict(state_dict)
+    assert torch.equal(sq3.compute(), sq.compute())
+
+    sq2.reset()
+    assert sq2.counts.shape == sq.counts.shape
+
+
+def _streaming_quantile_sync(rank, world_size):
+    setup_ddp(rank, world_size)
+
+    sq = StreamingQuantile(quantiles=(0.0, 1.0), min_value=0.5, max_value=100.0)
+    sq.update(torch.tensor(float(rank + 1)))
+
+    # the sketches of all ranks are summed
+    result = sq.compute()
+    assert result[0] == pytest.approx(1.0, rel=0.01)
+    assert result[1] == pytest.approx(float(world_size), rel=0.01)
+    assert sq.counts.sum() == 1
+
+
+@pytest.mark.parametrize("world_size", [2])
+def test_streaming_quantile_sync(world_size):
+    torch.multiprocessing.spawn(_streaming_quantile_sync, args=(world_size,), nprocs=world_size)